@@ -1,4 +1,5 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, Response, redirect, url_for
+from flask import Flask, render_template, request, jsonify, send_from_directory, send_file, Response, redirect, url_for, g, has_request_context
+from flask.json.provider import DefaultJSONProvider
 import logging
 import traceback
 import json
@@ -9,14 +10,40 @@ from functools import wraps
 from typing import Generator, List, Dict, Any, Optional
 from dataclasses import dataclass
 import time
-import PyPDF2
-from docx import Document
 import uuid
+import base64
+import hashlib
 import datetime
 import socket
 import psutil
 from dotenv import load_dotenv
-import openai
+import atexit
+from llm_client import LLMClientManager
+from upstream_router import UpstreamEndpoint, UpstreamRouter, parse_endpoints
+from conversation_store import create_conversation_store
+from sse import AnswerStream, FlushPolicy, StreamEncoder, sse_event
+from context_builder import ContextBuilder, load_tokenizer
+from summarizer import ConversationSummarizer
+from extraction import DocumentExtractor
+from response_cache import ResponseCache, make_cache_key
+from chunked_analysis import ChunkedAnalyzer
+from rate_limit import (
+    AdmissionController, AdmittedStream, AsyncAdmittedStream, RateLimiter, UpstreamBusyError
+)
+from metrics import MetricsRegistry
+from eviction import EvictionPolicy, select_victims
+from search_index import HistorySearchIndex, StoreSearchIndex, highlight
+from singleflight import SingleFlight
+from resumable_stream import ResumableStreams, parse_event_id
+from batch_jobs import BatchJobManager
+from message_model import Message
+from static_assets import StaticAssets
+from image_pipeline import ImagePipeline
+import asyncio
+import math
+import threading
+from contextlib import closing
+from collections import defaultdict
 
 # 加载环境变量
 load_dotenv()
@@ -24,13 +51,103 @@ load_dotenv()
 # 配置类
 class Config:
     UPLOAD_FOLDER = 'uploads'
-    CONVERSATIONS_FILE = 'conversations.json'  # 对话历史存储文件
+    CONVERSATIONS_FILE = 'conversations.json'  # 对话历史快照文件
+    CONVERSATIONS_JOURNAL = 'conversations.journal'  # 对话变更追加日志
+    JOURNAL_COMPACT_THRESHOLD = int(os.getenv("JOURNAL_COMPACT_THRESHOLD", "500"))  # 日志条数达到后后台压缩
+    JOURNAL_FSYNC = os.getenv("JOURNAL_FSYNC", "false").lower() == "true"  # 每条记录是否 fsync
+    HISTORY_INDEX_FILE = 'conversations.index'  # 历史搜索的倒排索引
+    CONVERSATION_MEMORY_BUDGET = int(os.getenv("CONVERSATION_MEMORY_BUDGET", str(64 * 1024 * 1024)))  # 常驻内存的历史字节数，0 不限
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "journal")  # journal 或 sqlite（多进程部署）
+    SQLITE_PATH = os.getenv("SQLITE_PATH", "conversations.db")
+    # 旧对话淘汰（0 表示不限制）
+    CLEANUP_MAX_CONVERSATIONS = int(os.getenv("CLEANUP_MAX_CONVERSATIONS", "100"))  # 最多保留的会话数
+    CLEANUP_MAX_AGE_DAYS = float(os.getenv("CLEANUP_MAX_AGE_DAYS", "7"))  # 超过该天数未更新即淘汰
+    CLEANUP_MAX_BYTES = int(os.getenv("CLEANUP_MAX_BYTES", "0"))  # 全部历史的总字节数上限
+    CLEANUP_INTERVAL_HOURS = float(os.getenv("CLEANUP_INTERVAL_HOURS", "12"))
+    # 文档提取
+    EXTRACTION_CACHE_DIR = os.path.join('uploads', 'extract_cache')  # 按文件 SHA-256 缓存提取结果
+    EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "2"))  # 提取进程数
+    EXTRACTION_MAX_CHARS = int(os.getenv("EXTRACTION_MAX_CHARS", "200000"))  # 单个文件最多提取的字符数
+    # 图片预处理
+    IMAGE_CACHE_DIR = os.path.join('uploads', 'image_cache')  # 按图片 SHA-256 缓存缩放后的变体
+    IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))  # 图片处理进程数
+    IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1568"))  # 缩放后的最长边
+    IMAGE_THUMB_SIZE = int(os.getenv("IMAGE_THUMB_SIZE", "256"))  # 缩略图最长边
+    # /search 和 /upload 的响应缓存
+    RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # 秒
+    RESPONSE_CACHE_FILE = os.getenv("RESPONSE_CACHE_FILE", "")  # 为空时不持久化
+    # 大文件分块分析
+    UPLOAD_CHUNK_TOKENS = int(os.getenv("UPLOAD_CHUNK_TOKENS", "6000"))  # 单块 token 预算，超过即分块
+    UPLOAD_CHUNK_CONCURRENCY = int(os.getenv("UPLOAD_CHUNK_CONCURRENCY", "4"))  # 并发上游调用数
+    # 批量任务（JSONL 输入输出）
+    BATCH_DIR = os.path.join('uploads', 'batch')  # 每个任务一个目录：输入、输出和进度
+    BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))  # 单个任务的并发请求数
+    BATCH_MAX_JOBS = int(os.getenv("BATCH_MAX_JOBS", "1"))  # 同时运行的任务数，其余排队
+    BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "10000"))  # 单个任务最多的请求条数
+    # 限流：每个 IP / 每个会话的令牌桶
+    RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))
+    RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+    CONVERSATION_RATE_LIMIT_PER_MINUTE = float(os.getenv("CONVERSATION_RATE_LIMIT_PER_MINUTE", "10"))
+    CONVERSATION_RATE_LIMIT_BURST = float(os.getenv("CONVERSATION_RATE_LIMIT_BURST", "3"))
+    # 上游并发闸门
+    UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "8"))
+    UPSTREAM_MAX_QUEUE = int(os.getenv("UPSTREAM_MAX_QUEUE", "32"))
+    UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "60"))  # 排队最长等待秒数
+    UPSTREAM_COALESCE = os.getenv("UPSTREAM_COALESCE", "true").lower() == "true"  # 合并相同的并发上游请求
+    # 流式输出的合并策略：距上一帧不足 MAX_DELAY_MS 的增量合并成一帧，缓冲达到 MAX_BYTES 或遇到句末标点时立即发送
+    STREAM_CONTENT_MAX_DELAY_MS = float(os.getenv("STREAM_CONTENT_MAX_DELAY_MS", "100"))
+    STREAM_CONTENT_MAX_BYTES = int(os.getenv("STREAM_CONTENT_MAX_BYTES", "512"))
+    STREAM_CONTENT_FLUSH_ON_SENTENCE = os.getenv("STREAM_CONTENT_FLUSH_ON_SENTENCE", "true").lower() == "true"
+    STREAM_REASONING_MAX_DELAY_MS = float(os.getenv("STREAM_REASONING_MAX_DELAY_MS", "250"))
+    STREAM_REASONING_MAX_BYTES = int(os.getenv("STREAM_REASONING_MAX_BYTES", "2048"))
+    STREAM_REASONING_FLUSH_ON_SENTENCE = os.getenv("STREAM_REASONING_FLUSH_ON_SENTENCE", "false").lower() == "true"
+    # 断线续传：/ask 的每次生成缓冲最近的事件，客户端带 Last-Event-ID 重连时从断点继续
+    SSE_RESUME_BUFFER = int(os.getenv("SSE_RESUME_BUFFER", "10000"))  # 每次生成缓冲的事件数
+    SSE_RESUME_GRACE = float(os.getenv("SSE_RESUME_GRACE", "10"))  # 断开后等待重连的秒数，超时关闭上游；0 立即关闭
+    # 多上游路由：逗号分隔的 base_url 或 base_url|model，为空时只用 OPENAI_BASE_URL
+    UPSTREAM_ENDPOINTS = os.getenv("UPSTREAM_ENDPOINTS", "")
+    UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))  # 可重试错误的重试次数
+    UPSTREAM_RETRY_BACKOFF = float(os.getenv("UPSTREAM_RETRY_BACKOFF", "0.5"))  # 退避基数（秒），按 2 的幂增长
+    UPSTREAM_FAILURE_THRESHOLD = int(os.getenv("UPSTREAM_FAILURE_THRESHOLD", "3"))  # 连续失败多少次摘除
+    UPSTREAM_COOLDOWN = float(os.getenv("UPSTREAM_COOLDOWN", "30"))  # 摘除秒数
+    UPSTREAM_HEDGE_PERCENTILE = float(os.getenv("UPSTREAM_HEDGE_PERCENTILE", "0"))  # 首块等待超过该分位数时对冲，0 关闭
+    UPSTREAM_HEDGE_MIN_SAMPLES = int(os.getenv("UPSTREAM_HEDGE_MIN_SAMPLES", "20"))  # 对冲所需的最少首块耗时样本
     ARK_API_KEY = os.getenv("ARK_API_KEY")
     OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
     ENDPOINT_ID = "飞舟id"
+    MAX_TOKENS = int(os.getenv("MAX_TOKENS", "8000"))  # 单次回复的最大 token 数
+    TEMPERATURE = 0.7
+    MODEL_CONTEXT_TOKENS = int(os.getenv("MODEL_CONTEXT_TOKENS", "64000"))  # 模型上下文窗口大小
+    TOKENIZER = os.getenv("TOKENIZER", "approx")  # approx（离线近似）或 tiktoken
+    SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").lower() == "true"  # 长对话滚动摘要
+    SUMMARY_TRIGGER_TOKENS = int(os.getenv("SUMMARY_TRIGGER_TOKENS", "6000"))  # 未摘要历史超过该值时更新摘要
+    SUMMARY_KEEP_RECENT = int(os.getenv("SUMMARY_KEEP_RECENT", "6"))  # 始终原文保留的最近消息条数
+    # 上游连接池配置
+    LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+    LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+    LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+    LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+    LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "1800"))  # 30分钟超时
+    LLM_HTTP2 = os.getenv("LLM_HTTP2", "false").lower() == "true"
+    # 监控
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"  # 是否开放 /metrics
+    TIMING_HEADERS = os.getenv("TIMING_HEADERS", "false").lower() == "true"  # 响应附带 Server-Timing 头
 
 # 初始化应用
+class AppJSONProvider(DefaultJSONProvider):
+    """Message 对象按原来的消息 dict 格式输出"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Message):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
 app = Flask(__name__)
+app.json = AppJSONProvider(app)
 app.config.from_object(Config)
 
 # 确保上传目录存在
@@ -40,6 +157,12 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 app.static_folder = 'static'
 app.static_url_path = '/static'
 
+# 静态资源：启动时计算内容摘要并预压缩，模板用 asset_url() 生成带版本号的 URL
+static_assets = StaticAssets(app.static_folder)
+static_assets.build()
+app.view_functions['static'] = static_assets.serve
+app.add_template_global(static_assets.url, 'asset_url')
+
 # 配置日志
 logging.basicConfig(
     level=logging.DEBUG,
@@ -53,18 +176,49 @@ def handle_errors(f):
     def wrapper(*args, **kwargs):
         try:
             return f(*args, **kwargs)
+        except UpstreamBusyError:
+            raise
         except Exception as e:
             error_msg = f"Error in {f.__name__}: {str(e)}"
             logger.error(f"{error_msg}\n{traceback.format_exc()}")
             return jsonify({"error": error_msg}), 500
     return wrapper
 
-# 请求速率限制装饰器
+# 请求速率限制：按客户端 IP 和会话各一个令牌桶，超限立即返回 429
+ip_limiter = RateLimiter(Config.RATE_LIMIT_PER_MINUTE, Config.RATE_LIMIT_BURST)
+conversation_limiter = RateLimiter(
+    Config.CONVERSATION_RATE_LIMIT_PER_MINUTE, Config.CONVERSATION_RATE_LIMIT_BURST
+)
+
+RATE_LIMITED_MESSAGE = '请求过于频繁，请稍后再试'
+
+def retry_after_header(retry_after: float) -> str:
+    return str(max(math.ceil(retry_after), 1))
+
+def too_many_requests(retry_after: float, message: str = RATE_LIMITED_MESSAGE):
+    response = jsonify({'error': message})
+    response.status_code = 429
+    response.headers['Retry-After'] = retry_after_header(retry_after)
+    return response
+
+def check_rate_limit(client_ip: Optional[str], conversation_id: Any = None) -> Optional[float]:
+    """依次检查 IP 和会话的令牌桶，超限时返回需要等待的秒数，Flask 和 ASGI 路由共用"""
+    allowed, retry_after = ip_limiter.check(client_ip or 'unknown')
+    if not allowed:
+        return retry_after
+    if conversation_id:
+        allowed, retry_after = conversation_limiter.check(str(conversation_id))
+        if not allowed:
+            return retry_after
+    return None
+
 def rate_limit(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
-        # 简单的速率限制实现
-        time.sleep(0.1)  # 每个请求至少间隔 0.1 秒
+        data = request.get_json(silent=True) if request.is_json else None
+        retry_after = check_rate_limit(request.remote_addr, (data or {}).get('conversation_id'))
+        if retry_after is not None:
+            return too_many_requests(retry_after)
         return f(*args, **kwargs)
     return wrapper
 
@@ -88,29 +242,259 @@ def allowed_file(filename, file_type='code'):
         return ext in ALLOWED_IMAGE_EXTENSIONS
     return False
 
-# 工具函数
-def create_chat_completion(messages: List[Dict[str, str]], stream: bool = False) -> Any:
-    """创建对话，支持多轮对话和推理内容"""
-    client = openai.OpenAI(
-        api_key=Config.ARK_API_KEY,
-        base_url=Config.OPENAI_BASE_URL,
-        http_client=httpx.Client(
-            timeout=1800,  # 30分钟超时
-            follow_redirects=True
+# 监控指标（Prometheus 文本格式，见 /metrics）
+metrics = MetricsRegistry()
+http_request_seconds = metrics.histogram(
+    'pip_http_request_seconds', '请求处理耗时（流式响应只计到响应头）', ['endpoint', 'status'])
+upstream_connect_seconds = metrics.histogram(
+    'pip_upstream_connect_seconds', '新建上游连接的 TCP+TLS 耗时',
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+upstream_ttft_seconds = metrics.histogram(
+    'pip_upstream_ttft_seconds', '从发起流式调用（含排队）到收到首个增量的耗时', ['endpoint'])
+stream_tokens_per_second = metrics.histogram(
+    'pip_stream_tokens_per_second', '每个流的生成速度（按上游增量块计数）', ['endpoint'],
+    buckets=(1, 5, 10, 20, 40, 80, 160, 320, 640, 1280))
+stream_ttfv_seconds = metrics.histogram(
+    'pip_stream_ttfv_seconds', '从开始生成到发出首个可见文本帧（推理或正文）的耗时', ['endpoint'])
+stream_frames_total = metrics.counter('pip_stream_frames_total', '发出的文本帧', ['endpoint', 'type'])
+stream_deltas_total = metrics.counter('pip_stream_deltas_total', '收到的上游文本增量', ['endpoint', 'type'])
+streams_total = metrics.counter('pip_streams_total', '结束的上游流', ['endpoint', 'status'])
+streams_active = metrics.gauge('pip_streams_active', '正在进行的上游流')
+conversation_save_seconds = metrics.histogram(
+    'pip_conversation_save_seconds', '对话持久化耗时（append 为单条消息，compact 为整理快照）', ['operation'])
+extraction_seconds = metrics.histogram(
+    'pip_extraction_seconds', '上传文件的文本提取耗时', ['type', 'cached'])
+conversations_gauge = metrics.gauge('pip_conversations', '会话数')
+conversation_messages_gauge = metrics.gauge('pip_conversation_messages', '历史消息数')
+history_bytes_gauge = metrics.gauge('pip_history_bytes', '历史消息正文和推理内容的字节数')
+resident_conversations_gauge = metrics.gauge('pip_resident_conversations', '正文常驻内存的会话数')
+resident_bytes_gauge = metrics.gauge('pip_resident_history_bytes', '常驻内存的历史字节数')
+upstream_active_gauge = metrics.gauge('pip_upstream_active', '占用并发名额的上游调用数')
+upstream_queue_gauge = metrics.gauge('pip_upstream_queue_depth', '等待并发名额的请求数')
+response_cache_gauge = metrics.gauge('pip_response_cache', '响应缓存状态', ['field'])
+conversations_evicted_total = metrics.counter('pip_conversations_evicted_total', '被淘汰的会话数')
+upstream_events_total = metrics.counter(
+    'pip_upstream_events_total', '各上游的失败、重试、对冲和对冲胜出次数', ['event', 'endpoint'])
+upstream_endpoint_healthy = metrics.gauge(
+    'pip_upstream_endpoint_healthy', '上游是否可用（连续失败后摘除为 0）', ['endpoint'],
+    function=lambda: {(e['name'],): int(e['healthy']) for e in upstream_router.stats()['endpoints']})
+upstream_endpoint_ttft = metrics.gauge(
+    'pip_upstream_endpoint_ttft_seconds', '各上游最近请求的首块耗时分位数', ['endpoint', 'quantile'],
+    function=lambda: {
+        (e['name'], q): e[f'ttft_p{q}'] for e in upstream_router.stats()['endpoints']
+        for q in ('50', '95') if e[f'ttft_p{q}'] is not None
+    })
+batch_requests_total = metrics.counter('pip_batch_requests_total', '批量任务处理的请求', ['status'])
+stream_resumes_total = metrics.counter(
+    'pip_stream_resumes_total', '带 Last-Event-ID 的续传请求', ['result'])
+upstream_coalesced_total = metrics.counter(
+    'pip_upstream_coalesced_total', '与进行中的相同请求合并、未单独调用上游的请求数', ['mode'])
+history_search_seconds = metrics.histogram(
+    'pip_history_search_seconds', '历史搜索的索引查询耗时',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+
+def record_timing(name: str, seconds: float):
+    """记录当前请求的一段耗时，开启 TIMING_HEADERS 时写入 Server-Timing"""
+    if Config.TIMING_HEADERS and has_request_context():
+        g.setdefault('timings', []).append((name, seconds))
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    start = g.get('request_start')
+    if start is None or request.endpoint in (None, 'static', 'metrics_route'):
+        return response
+    elapsed = time.perf_counter() - start
+    http_request_seconds.observe(elapsed, endpoint=request.endpoint, status=response.status_code)
+    if Config.TIMING_HEADERS:
+        parts = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in g.get('timings', [])]
+        parts.append(f'total;dur={elapsed * 1000:.1f}')
+        response.headers['Server-Timing'] = ', '.join(parts)
+    return response
+
+# 每个上游一个共享客户端（复用连接池，避免每次请求重新握手），重试由路由负责
+upstream_router = UpstreamRouter(
+    [
+        UpstreamEndpoint(name, LLMClientManager(
+            api_key=Config.ARK_API_KEY,
+            base_url=base_url,
+            max_connections=Config.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.LLM_MAX_KEEPALIVE,
+            keepalive_expiry=Config.LLM_KEEPALIVE_EXPIRY,
+            connect_timeout=Config.LLM_CONNECT_TIMEOUT,
+            read_timeout=Config.LLM_READ_TIMEOUT,
+            http2=Config.LLM_HTTP2,
+            on_connect=upstream_connect_seconds.observe,
+            max_retries=0
+        ), model)
+        for name, base_url, model in parse_endpoints(
+            Config.UPSTREAM_ENDPOINTS, Config.OPENAI_BASE_URL, Config.ENDPOINT_ID
         )
+    ],
+    max_retries=Config.UPSTREAM_MAX_RETRIES,
+    backoff=Config.UPSTREAM_RETRY_BACKOFF,
+    failure_threshold=Config.UPSTREAM_FAILURE_THRESHOLD,
+    cooldown=Config.UPSTREAM_COOLDOWN,
+    hedge_percentile=Config.UPSTREAM_HEDGE_PERCENTILE,
+    hedge_min_samples=Config.UPSTREAM_HEDGE_MIN_SAMPLES,
+    on_event=lambda event, endpoint: upstream_events_total.inc(event=event, endpoint=endpoint)
+)
+atexit.register(upstream_router.close)
+
+# 上下文预算：模型窗口减去回复预留
+context_builder = ContextBuilder(
+    context_tokens=Config.MODEL_CONTEXT_TOKENS,
+    reserve_tokens=Config.MAX_TOKENS,
+    tokenizer=load_tokenizer(Config.TOKENIZER)
+)
+
+# 文档提取服务（进程池 + 磁盘缓存）
+document_extractor = DocumentExtractor(
+    Config.EXTRACTION_CACHE_DIR,
+    max_workers=Config.EXTRACTION_WORKERS,
+    max_chars=Config.EXTRACTION_MAX_CHARS
+)
+atexit.register(document_extractor.shutdown)
+
+# 图片预处理服务（进程池缩放 + 按内容缓存变体）
+image_pipeline = ImagePipeline(
+    Config.IMAGE_CACHE_DIR,
+    max_workers=Config.IMAGE_WORKERS,
+    max_side=Config.IMAGE_MAX_SIDE,
+    thumb_size=Config.IMAGE_THUMB_SIZE
+)
+atexit.register(image_pipeline.shutdown)
+
+# 一次性问答（/search、/upload）的响应缓存
+response_cache = ResponseCache(
+    max_entries=Config.RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=Config.RESPONSE_CACHE_MAX_BYTES,
+    ttl=Config.RESPONSE_CACHE_TTL,
+    persist_path=Config.RESPONSE_CACHE_FILE or None
+)
+atexit.register(response_cache.save)
+
+# 上游并发闸门：限制同时进行的生成数，超出的请求排队
+upstream_admission = AdmissionController(
+    max_concurrent=Config.UPSTREAM_MAX_CONCURRENCY,
+    max_queue=Config.UPSTREAM_MAX_QUEUE,
+    timeout=Config.UPSTREAM_QUEUE_TIMEOUT
+)
+
+# 相同的并发上游请求只调用一次，流式请求的后来者先回放已生成的块
+upstream_flights = SingleFlight(on_coalesce=lambda mode: upstream_coalesced_total.inc(mode=mode))
+
+# /ask 的可续传流
+resumable_streams = ResumableStreams(
+    capacity=Config.SSE_RESUME_BUFFER,
+    grace=Config.SSE_RESUME_GRACE
+)
+
+# 流式输出的合并策略，推理和正文分开配置
+CONTENT_FLUSH_POLICY = FlushPolicy(
+    max_delay=Config.STREAM_CONTENT_MAX_DELAY_MS / 1000,
+    max_bytes=Config.STREAM_CONTENT_MAX_BYTES,
+    sentence=Config.STREAM_CONTENT_FLUSH_ON_SENTENCE
+)
+REASONING_FLUSH_POLICY = FlushPolicy(
+    max_delay=Config.STREAM_REASONING_MAX_DELAY_MS / 1000,
+    max_bytes=Config.STREAM_REASONING_MAX_BYTES,
+    sentence=Config.STREAM_REASONING_FLUSH_ON_SENTENCE
+)
+
+def record_answer_stats(endpoint: str, stats: Dict[str, Any]):
+    """记录首个可见文本的耗时和帧数，增量数 / 帧数即合并倍数"""
+    if stats['ttfv'] is not None:
+        stream_ttfv_seconds.observe(stats['ttfv'], endpoint=endpoint)
+    for kind in ('reasoning', 'content'):
+        stream_frames_total.inc(stats['frames'][kind], endpoint=endpoint, type=kind)
+        stream_deltas_total.inc(stats['deltas'][kind], endpoint=endpoint, type=kind)
+
+def answer_stream(endpoint: str, cumulative: bool = False) -> AnswerStream:
+    """按配置的合并策略创建 AnswerStream，结束时记录统计"""
+    return AnswerStream(
+        cumulative=cumulative,
+        content_policy=CONTENT_FLUSH_POLICY,
+        reasoning_policy=REASONING_FLUSH_POLICY,
+        on_finish=lambda stats: record_answer_stats(endpoint, stats)
     )
-    
+
+# 工具函数
+def create_chat_completion(messages: List[Dict[str, str]], stream: bool = False, priority: int = 0) -> Any:
+    """创建对话，支持多轮对话和推理内容
+
+    调用前先通过并发闸门，priority 越小越优先；流式响应在读完或关闭时归还名额。
+    开启 UPSTREAM_COALESCE 时，与进行中的相同请求共享同一次上游调用（不占名额）。
+    """
+    if not Config.UPSTREAM_COALESCE:
+        return _admitted_chat_completion(messages, stream, priority)
+    key = make_cache_key(
+        Config.ENDPOINT_ID, messages,
+        temperature=Config.TEMPERATURE, max_tokens=Config.MAX_TOKENS, stream=stream
+    )
+    if stream:
+        return upstream_flights.stream(key, lambda: _admitted_chat_completion(messages, True, priority))
+    return upstream_flights.do(key, lambda: _admitted_chat_completion(messages, False, priority))
+
+def _admitted_chat_completion(messages: List[Dict[str, str]], stream: bool, priority: int) -> Any:
+    upstream_admission.acquire(priority)
+    if stream:
+        try:
+            return AdmittedStream(_create_chat_completion(messages, stream=True), upstream_admission.release)
+        except Exception:
+            upstream_admission.release()
+            raise
     try:
-        response = client.chat.completions.create(
-            model=Config.ENDPOINT_ID,
-            messages=messages,
+        return _create_chat_completion(messages, stream=False)
+    finally:
+        upstream_admission.release()
+
+def _create_chat_completion(messages: List[Dict[str, str]], stream: bool = False) -> Any:
+    try:
+        params = {'messages': messages, 'temperature': Config.TEMPERATURE, 'max_tokens': Config.MAX_TOKENS}
+        # 路由选最快的健康上游；流式在拿到首块后返回
+        if stream:
+            return upstream_router.stream(**params)
+        response = upstream_router.complete(**params)
+        
+        if hasattr(response.choices[0].message, 'reasoning_content'):
+            # 如果存在推理内容，将其添加到响应中
+            return {
+                'content': response.choices[0].message.content,
+                'reasoning_content': response.choices[0].message.reasoning_content
+            }
+        return response
+    except Exception as e:
+        logging.error(f"OpenAI API 调用失败: {str(e)}")
+        raise
+
+async def acreate_chat_completion(messages: List[Dict[str, str]], stream: bool = False, priority: int = 0) -> Any:
+    """create_chat_completion 的异步版本，供 ASGI 模式使用"""
+    # 协程在事件循环中排队，不占用线程；等待中被取消不会遗留名额
+    await upstream_admission.acquire_async(priority)
+    try:
+        response = await _acreate_chat_completion(messages, stream=stream)
+    except Exception:
+        upstream_admission.release()
+        raise
+    if stream:
+        return AsyncAdmittedStream(response, upstream_admission.release)
+    upstream_admission.release()
+    return response
+
+async def _acreate_chat_completion(messages: List[Dict[str, str]], stream: bool = False) -> Any:
+    try:
+        response = await upstream_router.acreate(
             stream=stream,
-            temperature=0.7,
-            max_tokens=8000
+            messages=messages,
+            temperature=Config.TEMPERATURE,
+            max_tokens=Config.MAX_TOKENS
         )
         
         if not stream and hasattr(response.choices[0].message, 'reasoning_content'):
-            # 如果存在推理内容，将其添加到响应中
             return {
                 'content': response.choices[0].message.content,
                 'reasoning_content': response.choices[0].message.reasoning_content
@@ -120,90 +504,293 @@ def create_chat_completion(messages: List[Dict[str, str]], stream: bool = False)
         logging.error(f"OpenAI API 调用失败: {str(e)}")
         raise
 
+class MeteredStream:
+    """流式调用上游，记录首个增量耗时、生成速度和活跃流数
+
+    循环内只做计数，耗时统计都放在首个增量和结束时。迭代在 iter_frames() 的读取线程中进行，
+    close() 可从其他线程调用：正在读取时直接关闭上游流（归还并发名额并打断读取），
+    不必等下一个 chunk 到达，客户端断开后上游立即关闭。
+    """
+
+    def __init__(self, messages: List[Dict[str, str]], endpoint: str):
+        self._messages = messages
+        self._endpoint = endpoint
+        self._lock = threading.Lock()
+        self._closed = False
+        self._upstream = None
+        self._chunks = None
+
+    def __iter__(self):
+        if self._chunks is None:
+            self._chunks = self._iterate()
+        return self._chunks
+
+    def _iterate(self) -> Generator:
+        start = time.perf_counter()
+        first = None
+        chunks = 0
+        status = 'error'
+        upstream = None
+        streams_active.inc()
+        try:
+            upstream = create_chat_completion(self._messages, stream=True)
+            with self._lock:
+                self._upstream = upstream
+                closed = self._closed
+            if closed:
+                status = 'cancelled'
+                return
+            for chunk in upstream:
+                if first is None:
+                    first = time.perf_counter()
+                    upstream_ttft_seconds.observe(first - start, endpoint=self._endpoint)
+                chunks += 1
+                yield chunk
+            status = 'ok'
+        except GeneratorExit:
+            status = 'cancelled'
+            raise
+        except Exception:
+            # 其他线程关闭上游会让阻塞中的读取出错，按取消处理
+            if not self._closed:
+                raise
+            status = 'cancelled'
+        finally:
+            if upstream is not None:
+                upstream.close()
+            streams_active.dec()
+            streams_total.inc(endpoint=self._endpoint, status=status)
+            observe_stream_rate(self._endpoint, first, chunks)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            upstream = self._upstream
+        if self._chunks is not None:
+            try:
+                self._chunks.close()
+                return
+            except ValueError:
+                # 生成器正在读取线程中执行，改为直接关闭上游
+                pass
+        if upstream is not None:
+            upstream.close()
+
+async def ametered_stream(messages: List[Dict[str, str]], endpoint: str):
+    """MeteredStream 的异步版本，供 ASGI 模式使用"""
+    start = time.perf_counter()
+    first = None
+    chunks = 0
+    status = 'error'
+    upstream = None
+    streams_active.inc()
+    try:
+        upstream = await acreate_chat_completion(messages, stream=True)
+        async for chunk in upstream:
+            if first is None:
+                first = time.perf_counter()
+                upstream_ttft_seconds.observe(first - start, endpoint=endpoint)
+            chunks += 1
+            yield chunk
+        status = 'ok'
+    except (GeneratorExit, asyncio.CancelledError):
+        status = 'cancelled'
+        raise
+    finally:
+        if upstream is not None:
+            await upstream.aclose()
+        streams_active.dec()
+        streams_total.inc(endpoint=endpoint, status=status)
+        observe_stream_rate(endpoint, first, chunks)
+
+def observe_stream_rate(endpoint: str, first: Optional[float], chunks: int):
+    if first is None or chunks < 2:
+        return
+    elapsed = time.perf_counter() - first
+    if elapsed > 0:
+        stream_tokens_per_second.observe((chunks - 1) / elapsed, endpoint=endpoint)
+
 def add_message(conversation_id: str, role: str, content: str, reasoning: str = None):
     """添加消息到会话，支持推理内容"""
-    if conversation_id not in conversations:
-        return False
-    
-    message = {
-        "role": role,
-        "content": content,
-        "timestamp": datetime.datetime.now().isoformat()
-    }
-    if reasoning:
-        message["reasoning_content"] = reasoning
-    
-    conversations[conversation_id]['messages'].append(message)
-    conversations[conversation_id]['updated_at'] = datetime.datetime.now().isoformat()
-    save_conversations_to_file()  # 保存到文件
-    return True
+    message = Message(
+        role,
+        content,
+        tokens=context_builder.count(content),  # 缓存 token 数，组装上下文时不再重算
+        reasoning_content=reasoning
+    )
+
+    # 只追加一条日志记录，不再整体重写文件
+    with conversation_save_seconds.time(operation='append'):
+        added = conversation_store.add_message(
+            conversation_id, message, datetime.datetime.now().isoformat()
+        )
+    if added:
+        history_index.add_message(conversation_id, content)
+    return added
+
+def extract_completion(response: Any) -> tuple:
+    """从非流式响应中取出 (content, reasoning_content)"""
+    if isinstance(response, dict):
+        return response.get('content'), response.get('reasoning_content')
+    message = response.choices[0].message
+    return message.content, getattr(message, 'reasoning_content', None)
+
+def cache_mode_from_request() -> str:
+    """根据请求头决定缓存策略：use 正常使用，refresh 跳过读取但写入，off 完全绕过"""
+    if not Config.RESPONSE_CACHE_ENABLED:
+        return 'off'
+    cache_control = request.headers.get('Cache-Control', '').lower()
+    if 'no-store' in cache_control or request.headers.get('X-Cache-Bypass') == '1':
+        return 'off'
+    if 'no-cache' in cache_control:
+        return 'refresh'
+    return 'use'
+
+def cached_chat_completion(messages: List[Dict[str, str]], mode: str = 'use') -> tuple:
+    """带缓存的非流式调用，返回 ({'content', 'reasoning_content'}, 缓存状态)"""
+    key = make_cache_key(
+        Config.ENDPOINT_ID, messages,
+        temperature=Config.TEMPERATURE, max_tokens=Config.MAX_TOKENS
+    )
+    if mode == 'use':
+        cached = response_cache.get(key)
+        if cached is not None:
+            return cached, 'HIT'
+    start = time.perf_counter()
+    content, reasoning = extract_completion(create_chat_completion(messages, stream=False))
+    record_timing('upstream', time.perf_counter() - start)
+    result = {'content': content, 'reasoning_content': reasoning}
+    if mode == 'off':
+        return result, 'BYPASS'
+    response_cache.set(key, result)
+    return result, 'MISS'
+
+def summarize_messages(messages: List[Dict[str, str]]) -> str:
+    """调用上游生成摘要（后台任务，排队优先级低于交互请求）"""
+    content, _ = extract_completion(create_chat_completion(messages, stream=False, priority=1))
+    return content or ''
+
+summarizer = ConversationSummarizer(
+    complete=summarize_messages,
+    count_tokens=context_builder.message_tokens,
+    trigger_tokens=Config.SUMMARY_TRIGGER_TOKENS,
+    keep_recent=Config.SUMMARY_KEEP_RECENT
+)
 
 def process_file_content(file_path: str) -> str:
     with open(file_path, 'r', encoding='utf-8') as f:
         return f.read()
 
-def process_with_ai(prompt: str) -> str:
-    """使用AI处理文本内容"""
+def process_with_ai(prompt: str, system_prompt: Optional[str] = None, priority: int = 0,
+                    raise_errors: bool = False) -> str:
+    """使用AI处理文本内容；raise_errors 为 False 时失败返回错误说明"""
+    messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+    messages.append({"role": "user", "content": prompt})
     try:
-        response = create_chat_completion([
-            {"role": "user", "content": prompt}
-        ], stream=False)
-        return response.choices[0].message.content
+        content, _ = extract_completion(create_chat_completion(messages, stream=False, priority=priority))
+        return content or ''
     except Exception as e:
         logger.error(f"AI处理失败: {str(e)}")
+        if raise_errors:
+            raise
         return f"处理失败: {str(e)}"
 
+# 批量任务：优先级低于交互请求和摘要，排队时让出并发名额
+batch_jobs = BatchJobManager(
+    Config.BATCH_DIR,
+    lambda prompt, system: process_with_ai(prompt, system_prompt=system, priority=2, raise_errors=True),
+    max_workers=Config.BATCH_WORKERS,
+    max_jobs=Config.BATCH_MAX_JOBS,
+    on_result=lambda result: batch_requests_total.inc(status='error' if 'error' in result else 'ok')
+)
+atexit.register(batch_jobs.shutdown)
+
 # 对话管理
-conversations = {}
+conversation_store = create_conversation_store(
+    Config.STORAGE_BACKEND,
+    snapshot_path=Config.CONVERSATIONS_FILE,
+    journal_path=Config.CONVERSATIONS_JOURNAL,
+    compact_threshold=Config.JOURNAL_COMPACT_THRESHOLD,
+    fsync=Config.JOURNAL_FSYNC,
+    memory_budget=Config.CONVERSATION_MEMORY_BUDGET,
+    db_path=Config.SQLITE_PATH
+)
+atexit.register(conversation_store.close)
+
+# 历史消息全文搜索索引，随消息增删增量更新
+if getattr(conversation_store, 'full_text', False):
+    # SQLite 后端：索引在数据库中（FTS5），所有工作进程共享
+    history_index = StoreSearchIndex(conversation_store)
+elif Config.STORAGE_BACKEND == 'sqlite':
+    # SQLite 不带 FTS5 时退回进程内索引：不写共享的索引文件，启动时从数据库重建，
+    # 多进程部署下只能搜到本进程写入的新消息
+    logger.warning("SQLite 不支持 FTS5，历史搜索使用进程内索引")
+    history_index = HistorySearchIndex()
+else:
+    history_index = HistorySearchIndex(Config.HISTORY_INDEX_FILE)
+atexit.register(history_index.save)
 
 def load_conversations_from_file():
-    """从文件加载对话历史"""
+    """加载对话历史（快照+日志或 SQLite）和搜索索引"""
     try:
-        if os.path.exists(Config.CONVERSATIONS_FILE):
-            with open(Config.CONVERSATIONS_FILE, 'r', encoding='utf-8') as f:
-                loaded_conversations = json.load(f)
-                conversations.clear()
-                conversations.update(loaded_conversations)
-                logger.info(f"已加载 {len(conversations)} 个对话历史")
+        conversation_store.load()
     except Exception as e:
         logger.error(f"加载对话历史失败: {str(e)}")
+        return
+    # 索引缺失或与存储不一致（如上次异常退出）时重建
+    if not history_index.load() or history_index.message_count != conversation_store.stats()['messages']:
+        logger.info("正在重建历史搜索索引...")
+        history_index.rebuild(conversation_store.iter_conversations())
 
 def save_conversations_to_file():
-    """保存对话历史到文件"""
+    """整理持久化存储（日志后端压缩为快照）"""
     try:
-        with open(Config.CONVERSATIONS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(conversations, f, ensure_ascii=False, indent=2)
-        logger.info(f"已保存 {len(conversations)} 个对话历史")
+        with conversation_save_seconds.time(operation='compact'):
+            conversation_store.compact()
     except Exception as e:
         logger.error(f"保存对话历史失败: {str(e)}")
 
 def get_conversations():
     """获取所有会话"""
-    return list(conversations.values())
+    return conversation_store.get_conversations()
 
 def create_conversation():
     """创建新会话"""
     conversation_id = str(uuid.uuid4())
-    conversations[conversation_id] = {
+    conversation = {
         'id': conversation_id,
         'messages': [],
         'created_at': datetime.datetime.now().isoformat(),
         'updated_at': datetime.datetime.now().isoformat()
     }
-    save_conversations_to_file()  # 保存到文件
-    return conversations[conversation_id]
+    conversation_store.create_conversation(conversation)
+    return conversation
+
+def list_conversation_summaries(limit: int, before: Optional[tuple] = None) -> List[Dict]:
+    """按更新时间倒序获取会话摘要（不含消息）"""
+    return conversation_store.list_summaries(limit, before)
 
 def get_conversation(conversation_id):
     """获取指定会话"""
-    return conversations.get(conversation_id)
+    return conversation_store.get_conversation(conversation_id)
 
 def delete_conversation(conversation_id):
     """删除会话"""
-    if conversation_id in conversations:
-        del conversations[conversation_id]
-        save_conversations_to_file()  # 保存到文件
-        return True
-    return False
+    deleted = conversation_store.delete_conversation(conversation_id)
+    if deleted:
+        history_index.remove_conversation(conversation_id)
+    return deleted
+
+def set_conversation_summary(conversation_id: str, summary: Dict) -> bool:
+    """保存会话摘要"""
+    return conversation_store.set_summary(conversation_id, summary)
+
+def maybe_update_summary(conversation_id: str):
+    """历史超过阈值时在后台更新滚动摘要，下一轮对话生效"""
+    if Config.SUMMARY_ENABLED:
+        summarizer.summarize_in_background(
+            conversation_id, get_conversation, set_conversation_summary
+        )
 
 def prepare_chat_history(messages: List[Dict]) -> List[Dict]:
     """准备对话历史，确保符合API要求"""
@@ -226,32 +813,30 @@ def prepare_chat_history(messages: List[Dict]) -> List[Dict]:
 def index():
     return render_template('index.html')
 
-@app.route('/ask', methods=['POST'])
-@handle_errors
-def ask():
-    """处理用户问题，支持多轮对话"""
-    data = request.json
+def prepare_ask_messages(data: Dict) -> tuple:
+    """记录用户消息并构建发送给上游的消息列表，返回 (conversation_id, messages)"""
     conversation_id = data.get('conversation_id')
     message = data.get('message', '').strip()
 
     if not message:
-        return jsonify({'error': '消息不能为空'}), 400
+        raise ValueError('消息不能为空')
 
     # 获取或创建对话
     conversation = get_conversation(conversation_id)
     if not conversation:
         # 如果没有指定对话ID或对话不存在，获取最新的对话
-        conversations_list = get_conversations()
-        if conversations_list:
-            conversation = conversations_list[0]
+        latest = list_conversation_summaries(1)
+        if latest:
+            conversation = get_conversation(latest[0]['id'])
         else:
             # 如果没有任何对话，创建新对话
             conversation = create_conversation()
     
     conversation_id = conversation['id']
 
-    # 添加用户消息
+    # 添加用户消息，并重新读取会话（SQLite 后端返回的是副本）
     add_message(conversation_id, "user", message)
+    conversation = get_conversation(conversation_id)
     
     # 准备符合API要求的消息列表
     system_prompt = {
@@ -264,66 +849,81 @@ def ask():
 5. 记住上下文，保持对话连贯性"""
     }
     
-    # 使用所有历史消息，但限制token数量
-    messages = [msg for msg in conversation['messages'] if msg['role'] != 'system']
-    total_tokens = sum(len(msg['content']) for msg in messages)
+    # 已有摘要时并入系统提示，只发送摘要之后的消息
+    system_prompt, history = ConversationSummarizer.apply(system_prompt, conversation)
     
-    # 如果总token数超过限制，移除最旧的消息直到满足限制
-    max_tokens = 4000  # 根据实际情况调整
-    while total_tokens > max_tokens and len(messages) > 2:
-        removed_msg = messages.pop(0)
-        total_tokens -= len(removed_msg['content'])
-    
-    # 添加系统提示和清理后的消息
-    messages = [system_prompt] + messages
+    # 按 token 预算选取最近的历史消息，并去掉上游不接受的字段
+    messages = context_builder.build(system_prompt, history)
+    return conversation_id, prepare_chat_history(messages)
+
+@app.route('/ask', methods=['POST'])
+@rate_limit
+@handle_errors
+def ask():
+    """处理用户问题，支持多轮对话；带 Last-Event-ID 时续传之前的生成"""
+    if request.headers.get('Last-Event-ID'):
+        return _resume_response()
+    data = request.json
+    try:
+        conversation_id, messages = prepare_ask_messages(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # 默认使用增量格式，旧客户端可传 stream_format=cumulative
+    cumulative = data.get('stream_format') == 'cumulative'
 
     def generate():
-        content_buffer = ""
-        reasoning_buffer = ""
-        current_sentence = ""
+        stream = answer_stream('ask', cumulative=cumulative)
         
         try:
-            response = create_chat_completion(messages, stream=True)
-            
-            for chunk in response:
-                if chunk.choices and chunk.choices[0].delta:
-                    delta = chunk.choices[0].delta
-                    
-                    # 处理推理内容
-                    if hasattr(delta, 'reasoning_content') and delta.reasoning_content:
-                        reasoning_buffer += delta.reasoning_content
-                        yield f'data: {{"type": "reasoning", "content": {json.dumps(reasoning_buffer)}}}\n\n'
-                    
-                    # 处理主要内容
-                    if delta.content:
-                        content_chunk = delta.content
-                        current_sentence += content_chunk
-                        content_buffer += content_chunk
-                        
-                        # 当遇到句子结束符时，发送完整的句子
-                        if any(current_sentence.endswith(end) for end in ['.', '!', '?', '\n']):
-                            yield f'data: {{"type": "content", "content": {json.dumps(content_buffer)}}}\n\n'
-                            current_sentence = ""
-
-            # 发送剩余的内容
-            if current_sentence:
-                yield f'data: {{"type": "content", "content": {json.dumps(content_buffer)}}}\n\n'
+            # 生成器被关闭时（所有连接断开且超过等待时间）立即关闭上游
+            with closing(MeteredStream(messages, 'ask')) as upstream:
+                yield from stream.iter_frames(upstream)
+
+            yield from stream.finish()
 
             # 添加助手回复到对话历史并保存
             add_message(
                 conversation_id, 
                 "assistant", 
-                content_buffer,
-                reasoning=reasoning_buffer
+                stream.encoder.content_text,
+                reasoning=stream.encoder.reasoning_text
             )
+            maybe_update_summary(conversation_id)
             
-            yield f'data: {{"type": "done", "conversation_id": "{conversation_id}"}}\n\n'
+            yield stream.encoder.done(conversation_id=conversation_id)
             
         except Exception as e:
             logger.error(f"流式请求失败: {str(e)}")
-            yield f'data: {{"type": "error", "content": "{str(e)}"}}\n\n'
+            yield StreamEncoder.error(str(e))
 
-    return Response(generate(), mimetype='text/event-stream')
+    # 每次生成一个流 id（会话 id + 消息 id），事件带 id 行，断线后可从断点续传
+    resumable = resumable_streams.start(f"{conversation_id}:{uuid.uuid4().hex[:12]}", generate())
+    return Response(resumable.subscribe(), mimetype='text/event-stream')
+
+def _resume_response():
+    """按 Last-Event-ID（请求头或 last_event_id 参数）继续读取同一次生成，不重新调用上游"""
+    parsed = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id', ''))
+    if parsed is None:
+        return jsonify({'error': '缺少或无效的 Last-Event-ID'}), 400
+    stream_id, seq = parsed
+    resumable = resumable_streams.get(stream_id)
+    if resumable is None:
+        stream_resumes_total.inc(result='missing')
+        return jsonify({'error': '该回答已结束或不存在，无法续传'}), 404
+    try:
+        frames = resumable.subscribe(after=seq)
+    except ValueError as e:
+        stream_resumes_total.inc(result='invalid')
+        return jsonify({'error': str(e)}), 400
+    stream_resumes_total.inc(result='ok')
+    return Response(frames, mimetype='text/event-stream')
+
+@app.route('/ask/resume', methods=['GET', 'POST'])
+@rate_limit
+def resume_stream():
+    """断线续传"""
+    return _resume_response()
 
 @app.route('/conversations', methods=['GET', 'POST'])
 def list_conversations():
@@ -336,6 +936,77 @@ def list_conversations():
     # GET 请求返回所有对话
     return jsonify(get_conversations())
 
+def encode_cursor(entry: Dict) -> str:
+    """分页游标：上一页最后一条的 (updated_at, id)"""
+    raw = json.dumps([entry['updated_at'], entry['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor: str) -> tuple:
+    updated_at, conversation_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return str(updated_at), str(conversation_id)
+
+@app.route('/conversations/summary', methods=['GET'])
+def list_conversation_summaries_route():
+    """分页获取会话摘要列表，只包含 id、标题和时间戳"""
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+        cursor = request.args.get('cursor')
+        before = decode_cursor(cursor) if cursor else None
+    except (ValueError, TypeError):
+        return jsonify({"error": "分页参数无效"}), 400
+    
+    # 多取一条判断是否还有下一页
+    items = list_conversation_summaries(limit + 1, before)
+    next_cursor = encode_cursor(items[limit - 1]) if len(items) > limit else None
+    body = json.dumps({'items': items[:limit], 'next_cursor': next_cursor}, ensure_ascii=False)
+    
+    response = Response(body, mimetype='application/json')
+    response.set_etag(hashlib.sha1(body.encode('utf-8')).hexdigest())
+    response.headers['Cache-Control'] = 'no-cache'  # 允许缓存但每次用 ETag 校验
+    return response.make_conditional(request)
+
+@app.route('/conversations/search', methods=['GET'])
+def search_conversations_route():
+    """全文搜索历史消息，按 BM25 相关度排序，片段中的命中词用 <mark> 标出"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "搜索内容不能为空"}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError:
+        return jsonify({"error": "limit 参数无效"}), 400
+    
+    start = time.perf_counter()
+    hits = history_index.search(query, limit)
+    elapsed = time.perf_counter() - start
+    history_search_seconds.observe(elapsed)
+    
+    # 标题取自摘要索引，片段只读取命中的消息，不把整段会话换入内存
+    positions = defaultdict(list)
+    for conversation_id, position, _ in hits:
+        positions[conversation_id].append(position)
+    summaries = conversation_store.get_summaries(positions)
+    messages = {
+        conversation_id: conversation_store.get_messages(conversation_id, wanted)
+        for conversation_id, wanted in positions.items() if conversation_id in summaries
+    }
+    
+    items = []
+    for conversation_id, position, score in hits:
+        message = messages.get(conversation_id, {}).get(position)
+        if message is None:
+            continue
+        items.append({
+            'conversation_id': conversation_id,
+            'title': summaries[conversation_id]['title'],
+            'message_index': position,
+            'role': message['role'],
+            'timestamp': message.get('timestamp'),
+            'score': round(score, 4),
+            'snippet': highlight(message['content'], query)
+        })
+    return jsonify({'items': items, 'took_ms': round(elapsed * 1000, 2)})
+
 @app.route('/conversations/<conversation_id>', methods=['GET'])
 def get_conversation_route(conversation_id):
     """获取指定会话"""
@@ -351,33 +1022,148 @@ def delete_conversation_route(conversation_id):
         return '', 204
     return jsonify({"error": "会话不存在"}), 404
 
-def cleanup_conversations():
-    """自动清理旧对话，保持内存效率"""
-    max_conversations = 100  # 最大保留对话数
-    max_age = datetime.timedelta(days=7)  # 最长保留时间
+eviction_policy = EvictionPolicy(
+    max_count=Config.CLEANUP_MAX_CONVERSATIONS,
+    max_age=Config.CLEANUP_MAX_AGE_DAYS * 86400,
+    max_bytes=Config.CLEANUP_MAX_BYTES
+)
+_cleanup_lock = threading.Lock()
+
+def cleanup_conversations() -> int:
+    """按淘汰策略清理旧对话，返回删除数
+
+    从最久未更新的会话开始选出超龄、超量、超字节的会话，整批一次删除；
+    选出之后又收到新消息的会话不会被删除。
+    """
+    if not eviction_policy.enabled or not _cleanup_lock.acquire(blocking=False):
+        return 0
+    try:
+        now = datetime.datetime.now()
+        victims = select_victims(conversation_store.conversation_sizes(), eviction_policy, now)
+        if not victims:
+            return 0
+        deleted = conversation_store.delete_conversations(victims, updated_before=now.isoformat())
+        for conversation_id in deleted:
+            history_index.remove_conversation(conversation_id)
+        conversations_evicted_total.inc(len(deleted))
+        logger.info(f"已淘汰 {len(deleted)} 个旧对话")
+        
+        # 删除后整理一次快照，回收日志和快照中的空间
+        save_conversations_to_file()
+        return len(deleted)
+    finally:
+        _cleanup_lock.release()
+
+UPLOAD_SYSTEM_PROMPT = "你是一个专业的代码分析助手，擅长分析各种文件并给出建议。"
+
+def wants_stream() -> bool:
+    """请求是否要求 SSE 流式响应（表单或 JSON 中的 stream 字段）"""
+    value = request.form.get('stream')
+    if value is None and request.is_json:
+        value = (request.get_json(silent=True) or {}).get('stream')
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def stream_one_shot(messages: List[Dict[str, str]], mode: str = 'use', endpoint: str = 'search') -> Response:
+    """一次性问答的 SSE 流式响应，事件格式与 /ask 相同；命中缓存时直接回放"""
+    key = make_cache_key(
+        Config.ENDPOINT_ID, messages,
+        temperature=Config.TEMPERATURE, max_tokens=Config.MAX_TOKENS
+    )
+    cached = response_cache.get(key) if mode == 'use' else None
     
-    now = datetime.datetime.now()
-    to_delete = []
+    def generate():
+        stream = answer_stream(endpoint)
+        try:
+            if cached is not None:
+                if cached.get('reasoning_content'):
+                    yield stream.encoder.add_reasoning(cached['reasoning_content'])
+                yield stream.encoder.add_content(cached['content'] or '')
+                yield stream.encoder.done()
+                return
+            
+            # 客户端断开、生成器被关闭时立即关闭上游并归还名额
+            with closing(MeteredStream(messages, endpoint)) as upstream:
+                yield from stream.iter_frames(upstream)
+            yield from stream.finish()
+            
+            if mode != 'off':
+                response_cache.set(key, {
+                    'content': stream.encoder.content_text,
+                    'reasoning_content': stream.encoder.reasoning_text or None
+                })
+            yield stream.encoder.done()
+        except Exception as e:
+            logger.error(f"流式请求失败: {str(e)}")
+            yield StreamEncoder.error(str(e))
     
-    for conv_id, conv in conversations.items():
-        # 按时间清理
-        create_time = datetime.datetime.fromisoformat(conv['created_at'])
-        if (now - create_time) > max_age:
-            to_delete.append(conv_id)
-            continue
-        
-        # 按数量清理
-        if len(conversations) > max_conversations:
-            oldest = min(conversations.values(), key=lambda x: x['created_at'])
-            to_delete.append(oldest['id'])
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['X-Cache'] = 'HIT' if cached is not None else ('BYPASS' if mode == 'off' else 'MISS')
+    return response
+
+def analyze_large_document(pages: List[str], filename: str, user_message: str):
+    """对大文件分块并发分析后合并，stream=1 时以 SSE 推送进度"""
+    mode = cache_mode_from_request()
+    analyzer = ChunkedAnalyzer(
+        complete=lambda messages: cached_chat_completion(messages, mode=mode)[0]['content'] or '',
+        count_tokens=context_builder.tokenizer,
+        chunk_tokens=Config.UPLOAD_CHUNK_TOKENS,
+        max_concurrency=Config.UPLOAD_CHUNK_CONCURRENCY,
+        system_prompt=UPLOAD_SYSTEM_PROMPT
+    )
+    question = f'问题：{user_message}' if user_message else '请分析文件内容并给出建议。'
+    events = analyzer.run(pages, filename, question)
+    
+    if not wants_stream():
+        for event in events:
+            if event['type'] == 'result':
+                return jsonify({'success': True, 'content': event['content'], 'chunks': event['chunks']})
+            logger.debug(f"分块分析进度: {event}")
     
-    for conv_id in to_delete:
-        delete_conversation(conv_id)
+    def generate():
+        encoder = StreamEncoder()
+        try:
+            for event in events:
+                if event['type'] == 'result':
+                    yield encoder.add_content(event['content'])
+                    yield encoder.done(chunks=event['chunks'])
+                else:
+                    yield sse_event(event)
+        except Exception as e:
+            logger.error(f"分块分析失败: {str(e)}")
+            yield StreamEncoder.error(str(e))
     
-    # 保存更改到文件
-    save_conversations_to_file()
+    return Response(generate(), mimetype='text/event-stream')
+
+def image_info(image) -> Dict[str, Any]:
+    """返回给前端的图片信息和各变体的 URL"""
+    return {
+        'sha256': image.sha256,
+        'width': image.width,
+        'height': image.height,
+        'variants': {
+            name: {
+                'url': url_for('image_variant', digest=image.sha256, variant=name),
+                'width': image.sizes[name][0],
+                'height': image.sizes[name][1]
+            }
+            for name in image.variants
+        }
+    }
+
+@app.route('/images/<digest>/<variant>', methods=['GET'])
+def image_variant(digest, variant):
+    """上传图片的缩放变体，地址含内容摘要，可以永久缓存"""
+    if len(digest) != 64 or not all(c in '0123456789abcdef' for c in digest):
+        return jsonify({'error': '图片不存在'}), 404
+    path = image_pipeline.variant_path(digest, variant)
+    if path is None or not os.path.exists(path):
+        return jsonify({'error': '图片不存在'}), 404
+    response = send_file(os.path.abspath(path), conditional=True)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
 @app.route('/upload', methods=['POST'])
+@rate_limit
 def upload_file():
     if 'file' not in request.files:
         return jsonify({'error': '没有文件被上传'})
@@ -393,20 +1179,33 @@ def upload_file():
         # 获取文件内容
         content = ''
         if file_type == 'code' or file_type == 'document':
-            if file.filename.endswith('.pdf'):
-                # 处理PDF文件
-                pdf_reader = PyPDF2.PdfReader(file)
-                content = '\n'.join([page.extract_text() for page in pdf_reader.pages])
-            elif file.filename.endswith(('.doc', '.docx')):
-                # 处理Word文件
-                doc = Document(file)
-                content = '\n'.join([paragraph.text for paragraph in doc.paragraphs])
-            else:
-                # 处理文本文件
-                content = file.read().decode('utf-8')
+            # PDF/Word/文本在进程池中提取，相同文件直接命中缓存
+            start = time.perf_counter()
+            document = document_extractor.extract(file.read(), file.filename)
+            elapsed = time.perf_counter() - start
+            extraction_seconds.observe(
+                elapsed, type=os.path.splitext(file.filename)[1].lstrip('.').lower() or 'none',
+                cached=str(document.cached).lower()
+            )
+            record_timing('extract', elapsed)
+            content = document.text
+            if document.truncated:
+                content += f'\n\n[文件内容过长，仅截取前 {Config.EXTRACTION_MAX_CHARS} 个字符]'
+            
+            # 大文件走分块 map-reduce 分析
+            if context_builder.tokenizer(content) > Config.UPLOAD_CHUNK_TOKENS:
+                return analyze_large_document(document.pages, file.filename, user_message)
         elif file_type == 'image':
-            # 处理图片文件
-            content = '图片已上传成功，正在分析...'
+            # 图片在进程池中缩放并生成缩略图/WebP，相同图片直接命中缓存；
+            # 上游模型只接受文本，提示词中给出图片信息
+            start = time.perf_counter()
+            image = image_pipeline.process(file.read())
+            record_timing('image', time.perf_counter() - start)
+            large_width, large_height = image.sizes['large']
+            content = (
+                f'图片格式：{image.format or "未知"}，原始尺寸：{image.width}x{image.height}，'
+                f'已缩放为 {large_width}x{large_height}，内容 SHA-256：{image.sha256}'
+            )
         
         # 构建提示词
         prompt = f"""分析以下{file_type}文件，文件名为{file.filename}。
@@ -422,17 +1221,28 @@ def upload_file():
 2. 如果需要展示代码，使用 ```语言名 代码 ``` 格式
 3. 保持专业、简洁和友好的语气"""
         
-        # 调用AI处理文件内容
-        response = create_chat_completion([
-            {"role": "system", "content": "你是一个专业的代码分析助手，擅长分析各种文件并给出建议。"},
+        messages = [
+            {"role": "system", "content": UPLOAD_SYSTEM_PROMPT},
             {"role": "user", "content": prompt}
-        ], stream=False)
+        ]
+        if wants_stream():
+            return stream_one_shot(messages, mode=cache_mode_from_request(), endpoint='upload')
         
-        return jsonify({
+        # 调用AI处理文件内容（相同文件和问题命中缓存）
+        result, cache_status = cached_chat_completion(messages, mode=cache_mode_from_request())
+        
+        payload = {
             'success': True,
-            'content': response.choices[0].message.content
-        })
+            'content': result['content']
+        }
+        if file_type == 'image':
+            payload['image'] = image_info(image)
+        response = jsonify(payload)
+        response.headers['X-Cache'] = cache_status
+        return response
         
+    except UpstreamBusyError:
+        raise
     except Exception as e:
         logger.error(f"处理文件时出错: {str(e)}\n{traceback.format_exc()}")
         return jsonify({
@@ -440,42 +1250,135 @@ def upload_file():
         })
 
 @app.route('/search', methods=['POST'])
+@rate_limit
 @handle_errors
 def search():
-    """搜索功能"""
+    """搜索功能，stream=true 时以 SSE 流式返回"""
     query = request.json.get('query', '')
     if not query:
         return jsonify({'error': '搜索查询不能为空'}), 400
 
-    response = create_chat_completion([
+    messages = [
         {"role": "system", "content": """你是一个专业的搜索助手。在回答问题时：
 1. 先用[思考过程]...[/思考过程]标记你的分析和搜索过程
 2. 如果需要展示代码，使用 ```语言名 代码 ``` 格式
 3. 保持专业、简洁和友好的语气"""},
         {"role": "user", "content": f"请搜索并回答以下问题：{query}"}
-    ], stream=False)
+    ]
+    if wants_stream():
+        return stream_one_shot(messages, mode=cache_mode_from_request())
+    
+    result, cache_status = cached_chat_completion(messages, mode=cache_mode_from_request())
     
-    return jsonify({
-        'content': response.choices[0].message.content,
-        'reasoning': response.choices[0].message.get('reasoning_content')
+    response = jsonify({
+        'content': result['content'],
+        'reasoning': result['reasoning_content']
     })
+    response.headers['X-Cache'] = cache_status
+    return response
 
-@app.route('/static/image/<path:filename>')
-def serve_image(filename):
-    app.logger.info(f'Requesting image: {filename}')
+@app.route('/batch/jobs', methods=['GET', 'POST'])
+@rate_limit
+@handle_errors
+def batch_job_list():
+    """批量任务：GET 列出任务；POST 上传 JSONL 文件（file）或 JSON 中的 requests 列表创建任务"""
+    if request.method == 'GET':
+        return jsonify([job.to_dict() for job in batch_jobs.list()])
+
+    if 'file' in request.files:
+        lines = [line for line in request.files['file'].read().decode('utf-8').splitlines() if line.strip()]
+        workers = request.form.get('workers', type=int)
+    else:
+        data = request.get_json(silent=True) or {}
+        requests_list = data.get('requests')
+        if not isinstance(requests_list, list):
+            return jsonify({'error': '请上传 JSONL 文件或提供 requests 列表'}), 400
+        lines = [json.dumps(item, ensure_ascii=False) for item in requests_list]
+        workers = data.get('workers')
+    if not lines:
+        return jsonify({'error': '没有请求'}), 400
+    if len(lines) > Config.BATCH_MAX_REQUESTS:
+        return jsonify({'error': f'单个任务最多 {Config.BATCH_MAX_REQUESTS} 条请求'}), 400
+    if workers is not None and (not isinstance(workers, int) or not 1 <= workers <= Config.BATCH_WORKERS):
+        return jsonify({'error': f'workers 需在 1 到 {Config.BATCH_WORKERS} 之间'}), 400
+
+    job = batch_jobs.submit(lines, workers=workers)
+    return jsonify(job.to_dict()), 202
+
+@app.route('/batch/jobs/<job_id>', methods=['GET'])
+def batch_job_status(job_id):
+    """任务状态、进度、吞吐和预计剩余时间"""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/batch/jobs/<job_id>/results', methods=['GET'])
+def batch_job_results(job_id):
+    """下载已完成的结果（JSONL，按完成顺序），任务进行中也可以读取"""
+    job = batch_jobs.get(job_id)
+    if job is None or not os.path.exists(job.output_path):
+        return jsonify({'error': '结果不存在'}), 404
+    return send_file(os.path.abspath(job.output_path), mimetype='application/x-ndjson',
+                     as_attachment=True, download_name=f'{job_id}.jsonl', max_age=0)
+
+@app.route('/batch/jobs/<job_id>/<action>', methods=['POST'])
+def batch_job_action(job_id, action):
+    """cancel 取消任务；resume 续跑中断、取消或失败的任务"""
+    if action not in ('cancel', 'resume'):
+        return jsonify({'error': '未知操作'}), 404
     try:
-        response = send_from_directory('static/image', filename)
-        app.logger.info(f'Successfully served image: {filename}')
-        return response
-    except Exception as e:
-        app.logger.error(f'Error serving image {filename}: {str(e)}')
-        return f'Error loading image: {str(e)}', 500
+        job = batch_jobs.cancel(job_id) if action == 'cancel' else batch_jobs.resume(job_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/upstream/stats', methods=['GET'])
+def upstream_stats():
+    """上游并发闸门的排队深度和等待时间"""
+    stats = upstream_admission.stats()
+    stats['rate_limited'] = ip_limiter.rejected + conversation_limiter.rejected
+    stats['coalesced'] = upstream_flights.coalesced
+    stats['router'] = upstream_router.stats()
+    stats['resumable_streams'] = resumable_streams.stats()
+    return jsonify(stats)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    """Prometheus 指标；存储和缓存的状态在采集时读取"""
+    if not Config.METRICS_ENABLED:
+        return jsonify({'error': '监控未开启'}), 404
+    store_stats = conversation_store.stats()
+    conversations_gauge.set(store_stats['conversations'])
+    conversation_messages_gauge.set(store_stats['messages'])
+    history_bytes_gauge.set(store_stats['history_bytes'])
+    resident_conversations_gauge.set(store_stats['resident_conversations'])
+    resident_bytes_gauge.set(store_stats['resident_bytes'])
+    admission = upstream_admission.stats()
+    upstream_active_gauge.set(admission['active'])
+    upstream_queue_gauge.set(admission['queue_depth'])
+    for field, value in response_cache.stats().items():
+        response_cache_gauge.set(value, field=field)
+    return Response(metrics.render(), content_type=MetricsRegistry.CONTENT_TYPE)
+
+@app.errorhandler(UpstreamBusyError)
+def handle_upstream_busy(e):
+    response = jsonify({'error': str(e)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(max(math.ceil(e.retry_after), 1))
+    return response
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """响应缓存的命中统计"""
+    return jsonify(response_cache.stats())
 
 if __name__ == '__main__':
     # 启动时加载对话历史
     load_conversations_from_file()
     
-    import atexit
     import signal
     import sys
     
@@ -501,6 +1404,10 @@ if __name__ == '__main__':
 
     def cleanup():
         print("正在关闭服务器...")
+        batch_jobs.shutdown()
+        upstream_router.close()
+        document_extractor.shutdown()
+        conversation_store.close()
         # 确保端口 5000 被释放
         kill_process_on_port(5000)
         sys.exit(0)
@@ -518,7 +1425,7 @@ if __name__ == '__main__':
 
     from apscheduler.schedulers.background import BackgroundScheduler
     scheduler = BackgroundScheduler()
-    scheduler.add_job(cleanup_conversations, 'interval', hours=12)  # 每12小时清理一次
+    scheduler.add_job(cleanup_conversations, 'interval', hours=Config.CLEANUP_INTERVAL_HOURS)  # 定期淘汰旧对话
     scheduler.start()
     
     app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
@@ -0,0 +1,132 @@
+"""异步（ASGI）服务入口
+
+/ask 由异步路由处理，上游流式响应通过 AsyncOpenAI 读取，每个等待中的流
+只占用一个协程而不是一个工作线程。其余路由仍交给原有的 Flask 应用。
+
+启动方式（依赖见 requirements-asgi.txt）：
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import contextlib
+import logging
+from typing import Optional
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+import app as flask_app
+from sse import StreamEncoder
+
+logger = logging.getLogger(__name__)
+
+
+def rate_limited(request: Request, data: Optional[dict] = None) -> Optional[JSONResponse]:
+    """超限时返回与 Flask 路由相同的 429 响应（带 Retry-After）"""
+    client_ip = request.client.host if request.client else None
+    conversation_id = data.get('conversation_id') if isinstance(data, dict) else None
+    retry_after = flask_app.check_rate_limit(client_ip, conversation_id)
+    if retry_after is None:
+        return None
+    return JSONResponse(
+        {'error': flask_app.RATE_LIMITED_MESSAGE}, status_code=429,
+        headers={'Retry-After': flask_app.retry_after_header(retry_after)}
+    )
+
+
+def resume_unsupported():
+    """ASGI 模式的生成不做缓冲，续传请求明确拒绝，避免被当作新问题重新生成"""
+    flask_app.stream_resumes_total.inc(result='unsupported')
+    return JSONResponse({'error': '当前服务模式不支持断线续传，请重新提问'}, status_code=409)
+
+
+async def ask(request: Request):
+    """异步版本的 /ask，事件格式与 Flask 路由一致"""
+    if request.headers.get('Last-Event-ID'):
+        return resume_unsupported()
+    data = await request.json()
+    # 与 Flask 路由相同的 IP 和会话令牌桶
+    limited = rate_limited(request, data)
+    if limited is not None:
+        return limited
+    try:
+        # 存储操作是同步的，放到线程池中执行
+        conversation_id, messages = await run_in_threadpool(flask_app.prepare_ask_messages, data)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    cumulative = data.get('stream_format') == 'cumulative'
+
+    async def generate():
+        stream = flask_app.answer_stream('ask', cumulative=cumulative)
+
+        try:
+            # 客户端断开时 Starlette 取消本生成器，aclosing 保证上游流随之关闭
+            async with contextlib.aclosing(flask_app.ametered_stream(messages, 'ask')) as upstream:
+                async with contextlib.aclosing(stream.aiter_frames(upstream)) as frames:
+                    async for frame in frames:
+                        yield frame
+
+            for frame in stream.finish():
+                yield frame
+
+            await run_in_threadpool(
+                flask_app.add_message,
+                conversation_id,
+                "assistant",
+                stream.encoder.content_text,
+                stream.encoder.reasoning_text
+            )
+            flask_app.maybe_update_summary(conversation_id)
+
+            yield stream.encoder.done(conversation_id=conversation_id)
+
+        except Exception as e:
+            logger.error(f"流式请求失败: {str(e)}")
+            yield StreamEncoder.error(str(e))
+
+    return StreamingResponse(generate(), media_type='text/event-stream')
+
+
+async def resume(request: Request):
+    return resume_unsupported()
+
+
+async def cleanup_periodically(interval: float):
+    """定期淘汰旧对话（python app.py 时由 APScheduler 负责），清理在线程池中执行"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(flask_app.cleanup_conversations)
+        except Exception as e:
+            logger.error(f"清理旧对话失败: {str(e)}")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_):
+    flask_app.load_conversations_from_file()
+    interval = flask_app.Config.CLEANUP_INTERVAL_HOURS * 3600
+    cleanup_task = asyncio.create_task(cleanup_periodically(interval)) if interval > 0 else None
+    yield
+    if cleanup_task is not None:
+        cleanup_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await cleanup_task
+    await flask_app.upstream_router.aclose()
+
+
+app = Starlette(
+    routes=[
+        Route('/ask', ask, methods=['POST']),
+        Route('/ask/resume', resume, methods=['GET', 'POST']),
+        Mount('/', app=WSGIMiddleware(flask_app.app)),
+    ],
+    lifespan=lifespan
+)
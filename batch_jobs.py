@@ -0,0 +1,427 @@
+"""批量任务：读取 JSONL 请求，用有界的工作线程池调用模型，结果逐条写入 JSONL
+
+输入每行一个 JSON 对象：{"id": 可选, "prompt": "...", "system": 可选}
+输出每行一条结果：{"index": 行号, "id": ..., "content": ..., "latency": 秒} 或带 "error" 的失败记录。
+结果按完成顺序写入；输出文件本身就是断点，中断后再次运行会跳过已完成的行。
+
+    python batch_jobs.py prompts.jsonl -o results.jsonl --workers 8
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# process(prompt, system) -> 回复正文，失败时抛出异常
+Process = Callable[[str, Optional[str]], str]
+
+
+def read_requests(path: str) -> Iterator[Tuple[int, object]]:
+    """逐行读取请求，产出 (行号, 记录)；空行跳过，无法解析的行产出异常"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for index, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield index, json.loads(line)
+            except ValueError as e:
+                yield index, e
+
+
+def count_requests(path: str) -> int:
+    with open(path, 'r', encoding='utf-8') as f:
+        return sum(1 for line in f if line.strip())
+
+
+def load_checkpoint(output_path: str, retry_errors: bool = True) -> Set[int]:
+    """读取已有的输出，返回已完成的行号
+
+    崩溃时最后一行可能只写了一半，会被丢弃；retry_errors 为 True 时失败的记录
+    也从输出中移除，稍后重新执行。需要丢弃内容时原子地重写输出文件。
+    """
+    if not os.path.exists(output_path):
+        return set()
+    done, kept, dropped = set(), [], False
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+                index = int(result['index'])
+            except (ValueError, KeyError, TypeError):
+                dropped = True
+                continue
+            if not line.endswith('\n') or (retry_errors and 'error' in result) or index in done:
+                dropped = True
+                continue
+            done.add(index)
+            kept.append(line)
+    if dropped:
+        with open(f"{output_path}.tmp", 'w', encoding='utf-8') as f:
+            f.writelines(kept)
+        os.replace(f"{output_path}.tmp", output_path)
+    return done
+
+
+def _format_seconds(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}时{seconds % 3600 // 60}分"
+    if seconds >= 60:
+        return f"{seconds // 60}分{seconds % 60}秒"
+    return f"{seconds}秒"
+
+
+class BatchProgress:
+    """批量任务的进度、吞吐和预计剩余时间；吞吐只按本次运行完成的条数计算"""
+
+    def __init__(self, total: int, skipped: int = 0):
+        self.total = total
+        self.skipped = skipped
+        self.succeeded = 0
+        self.failed = 0
+        self.started_at = time.time()
+        self._start = time.monotonic()
+        self._end: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def record(self, ok: bool):
+        with self._lock:
+            if ok:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+
+    def stop(self):
+        self._end = time.monotonic()
+
+    @property
+    def completed(self) -> int:
+        return self.skipped + self.succeeded + self.failed
+
+    @property
+    def elapsed(self) -> float:
+        return (self._end or time.monotonic()) - self._start
+
+    @property
+    def throughput(self) -> float:
+        """每秒完成的请求数"""
+        elapsed = self.elapsed
+        return (self.succeeded + self.failed) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        throughput = self.throughput
+        if not throughput:
+            return None
+        return max(self.total - self.completed, 0) / throughput
+
+    def to_dict(self) -> Dict:
+        eta = self.eta
+        return {
+            'total': self.total,
+            'completed': self.completed,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'elapsed': round(self.elapsed, 3),
+            'throughput': round(self.throughput, 3),
+            'eta': round(eta, 1) if eta is not None else None
+        }
+
+    def format(self) -> str:
+        eta = self.eta
+        text = f"{self.completed}/{self.total}（失败 {self.failed}）{self.throughput:.2f} 条/秒"
+        if eta is not None and self.completed < self.total:
+            text += f"，预计剩余 {_format_seconds(eta)}"
+        return text
+
+
+class BatchJob:
+    """一个批量任务：窗口内最多 2×workers 条请求在途，其余留在输入文件中
+
+    每条结果写完即 flush，进程中断后重新运行同一任务会按输出文件续跑。
+    """
+
+    def __init__(self, input_path: str, output_path: str, process: Process,
+                 max_workers: int = 4, retry_errors: bool = True, job_id: Optional[str] = None,
+                 on_result: Optional[Callable[[Dict], None]] = None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.input_path = input_path
+        self.output_path = output_path
+        self.process = process
+        self.max_workers = max_workers
+        self.retry_errors = retry_errors
+        self.on_result = on_result
+        self.status = 'pending'
+        self.error: Optional[str] = None
+        self.progress = BatchProgress(0)
+        self._cancelled = threading.Event()
+        self._write_lock = threading.Lock()
+        # 状态的检查和修改都在 lock 下进行；runner 为执行本任务的后台调用
+        self.lock = threading.Lock()
+        self.runner: Optional[Future] = None
+
+    @property
+    def active(self) -> bool:
+        """仍有后台调用在排队或运行"""
+        return self.runner is not None and not self.runner.done()
+
+    def cancel(self):
+        """不再提交新请求，已在途的请求完成后结束"""
+        self._cancelled.set()
+
+    def _run_one(self, index: int, record: object) -> Dict:
+        result = {'index': index}
+        if isinstance(record, dict) and 'id' in record:
+            result['id'] = record['id']
+        start = time.perf_counter()
+        try:
+            if isinstance(record, Exception):
+                raise ValueError(f"无法解析的 JSON: {record}")
+            prompt = record.get('prompt') if isinstance(record, dict) else None
+            if not isinstance(prompt, str) or not prompt.strip():
+                raise ValueError('缺少 prompt')
+            result['content'] = self.process(prompt, record.get('system'))
+        except Exception as e:
+            result['error'] = str(e)
+        result['latency'] = round(time.perf_counter() - start, 3)
+        return result
+
+    def _write(self, output, result: Dict):
+        with self._write_lock:
+            output.write(json.dumps(result, ensure_ascii=False) + '\n')
+            output.flush()
+        self.progress.record('error' not in result)
+        if self.on_result:
+            self.on_result(result)
+
+    def run(self, on_progress: Optional[Callable[['BatchJob'], None]] = None) -> str:
+        """执行到结束（或被取消），返回最终状态"""
+        self.status = 'running'
+        self.error = None
+        try:
+            done = load_checkpoint(self.output_path, self.retry_errors)
+            self.progress = BatchProgress(count_requests(self.input_path), skipped=len(done))
+            window = self.max_workers * 2
+            with open(self.output_path, 'a', encoding='utf-8') as output, \
+                    ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                pending = set()
+                for index, record in read_requests(self.input_path):
+                    if self._cancelled.is_set():
+                        break
+                    if index in done:
+                        continue
+                    if len(pending) >= window:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            self._write(output, future.result())
+                            if on_progress:
+                                on_progress(self)
+                    pending.add(executor.submit(self._run_one, index, record))
+                for future in as_completed(pending):
+                    self._write(output, future.result())
+                    if on_progress:
+                        on_progress(self)
+            self.status = 'cancelled' if self._cancelled.is_set() else 'completed'
+        except Exception as e:
+            logger.error(f"批量任务 {self.id} 失败: {str(e)}")
+            self.status = 'failed'
+            self.error = str(e)
+        finally:
+            self.progress.stop()
+        return self.status
+
+    def to_dict(self) -> Dict:
+        data = {'id': self.id, 'status': self.status, 'workers': self.max_workers}
+        data.update(self.progress.to_dict())
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+class BatchJobManager:
+    """HTTP 批量任务：每个任务一个目录（input.jsonl、output.jsonl、job.json）
+
+    同时最多运行 max_jobs 个任务，其余排队。服务重启后未结束的任务显示为
+    interrupted，调用 resume() 按输出文件续跑。
+    """
+
+    def __init__(self, base_dir: str, process: Process, max_workers: int = 4, max_jobs: int = 1,
+                 on_result: Optional[Callable[[Dict], None]] = None):
+        self.base_dir = base_dir
+        self.process = process
+        self.max_workers = max_workers
+        self.on_result = on_result
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='batch')
+        self._jobs: Dict[str, BatchJob] = {}
+        self._lock = threading.Lock()
+        os.makedirs(base_dir, exist_ok=True)
+        self._load()
+
+    def _job_dir(self, job_id: str) -> str:
+        return os.path.join(self.base_dir, job_id)
+
+    def _new_job(self, job_id: str, workers: int) -> BatchJob:
+        job_dir = self._job_dir(job_id)
+        return BatchJob(
+            os.path.join(job_dir, 'input.jsonl'), os.path.join(job_dir, 'output.jsonl'),
+            self.process, max_workers=workers, job_id=job_id, on_result=self.on_result
+        )
+
+    def _load(self):
+        """恢复磁盘上的任务记录，上次运行中断的任务标记为 interrupted"""
+        for job_id in sorted(os.listdir(self.base_dir)):
+            try:
+                with open(os.path.join(self._job_dir(job_id), 'job.json'), 'r', encoding='utf-8') as f:
+                    saved = json.load(f)
+            except (OSError, ValueError):
+                continue
+            job = self._new_job(job_id, saved.get('workers', self.max_workers))
+            job.status = saved.get('status', 'interrupted')
+            if job.status in ('pending', 'running'):
+                job.status = 'interrupted'
+            job.error = saved.get('error')
+            job.progress = BatchProgress(saved.get('total', 0), skipped=saved.get('completed', 0))
+            job.progress.stop()
+            self._jobs[job_id] = job
+
+    def _save(self, job: BatchJob):
+        path = os.path.join(self._job_dir(job.id), 'job.json')
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(job.to_dict(), f, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+
+    def _run(self, job: BatchJob):
+        with job.lock:
+            if job.status == 'cancelled':
+                return
+            job.status = 'running'
+        last_save = [0.0]
+
+        def on_progress(job: BatchJob):
+            # 进度至多每秒落盘一次
+            now = time.monotonic()
+            if now - last_save[0] >= 1.0:
+                last_save[0] = now
+                self._save(job)
+
+        job.run(on_progress)
+        self._save(job)
+        logger.info(f"批量任务 {job.id} {job.status}: {job.progress.format()}")
+
+    def _start(self, job: BatchJob):
+        """调用方需持有 job.lock"""
+        job.status = 'pending'
+        job._cancelled.clear()
+        self._save(job)
+        job.runner = self._executor.submit(self._run, job)
+
+    def submit(self, lines: List[str], workers: Optional[int] = None) -> BatchJob:
+        """保存输入并排队执行，lines 为 JSONL 的各行"""
+        job = self._new_job(uuid.uuid4().hex[:12], workers or self.max_workers)
+        os.makedirs(self._job_dir(job.id), exist_ok=True)
+        with open(job.input_path, 'w', encoding='utf-8') as f:
+            for line in lines:
+                f.write(line.rstrip('\n') + '\n')
+        job.progress = BatchProgress(count_requests(job.input_path))
+        with self._lock:
+            self._jobs[job.id] = job
+        with job.lock:
+            self._start(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[BatchJob]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> Optional[BatchJob]:
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with job.lock:
+            if job.status in ('pending', 'running', 'interrupted'):
+                job.cancel()
+                if job.status != 'running':
+                    # 还在排队的调用直接撤销，撤销不了的会在开始时看到 cancelled 后返回
+                    if job.runner is not None:
+                        job.runner.cancel()
+                    job.status = 'cancelled'
+                    self._save(job)
+        return job
+
+    def resume(self, job_id: str) -> Optional[BatchJob]:
+        """续跑中断、取消或失败的任务，已完成的行不会重复调用
+
+        上一次的调用仍在运行（如取消后还在等待在途请求）时抛出 ValueError，
+        避免两个调用同时追加同一个输出文件。
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with job.lock:
+            if job.status in ('interrupted', 'cancelled', 'failed'):
+                if job.active:
+                    raise ValueError('任务仍在停止中，请稍后再续跑')
+                self._start(job)
+        return job
+
+    def shutdown(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量调用模型：JSONL 输入，JSONL 输出，可中断续跑')
+    parser.add_argument('input', help='输入 JSONL，每行 {"id", "prompt", "system"}')
+    parser.add_argument('-o', '--output', help='输出 JSONL（默认为输入文件名加 .results.jsonl）')
+    parser.add_argument('--workers', type=int, default=4, help='并发请求数')
+    parser.add_argument('--keep-errors', action='store_true', help='续跑时不重试已失败的记录')
+    args = parser.parse_args()
+
+    output = args.output or f"{os.path.splitext(args.input)[0]}.results.jsonl"
+    from app import process_with_ai
+    # 应用的调试日志会打断进度输出
+    logging.getLogger().setLevel(logging.WARNING)
+    job = BatchJob(
+        args.input, output,
+        lambda prompt, system: process_with_ai(prompt, system_prompt=system, priority=2, raise_errors=True),
+        max_workers=args.workers, retry_errors=not args.keep_errors
+    )
+    last_print = [0.0]
+
+    def on_progress(job: BatchJob):
+        now = time.monotonic()
+        if now - last_print[0] >= 1.0:
+            last_print[0] = now
+            print(f"\r{job.progress.format()}", end='', file=sys.stderr, flush=True)
+
+    try:
+        status = job.run(on_progress)
+    except KeyboardInterrupt:
+        job.cancel()
+        status = 'cancelled'
+    print(f"\r{job.progress.format()}", file=sys.stderr)
+    if job.progress.skipped:
+        print(f"跳过已完成 {job.progress.skipped} 条", file=sys.stderr)
+    print(f"{status}: 结果已写入 {output}", file=sys.stderr)
+    if job.error:
+        print(job.error, file=sys.stderr)
+    sys.exit(0 if status == 'completed' else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""对比历史消息的两种内存表示：原来的 dict（ISO 时间字符串）和 Message（__slots__、epoch 浮点数）
+
+    python -m bench.bench_messages --counts 10000 100000 --content-chars 200
+
+报告构造 N 条消息占用的内存（tracemalloc，含正文），以及序列化为 JSON 和从 JSON
+读回的耗时：dict 写成带键名的对象，Message 写成紧凑数组。
+"""
+import argparse
+import datetime
+import gc
+import json
+import time
+import tracemalloc
+from typing import Callable, List
+
+from bench.common import sample_messages
+from message_model import Message, compact_messages, load_messages
+
+
+def build_dicts(count: int, content_chars: int) -> List[dict]:
+    messages = []
+    for i, sample in enumerate(sample_messages(count, content_chars)):
+        message = {
+            'role': sample['role'],
+            'content': f"{sample['content']}{i}",
+            'timestamp': datetime.datetime.now().isoformat(),
+            'tokens': content_chars // 2
+        }
+        if i % 2:
+            message['reasoning_content'] = f"推理 {i}"
+        messages.append(message)
+    return messages
+
+
+def build_messages(count: int, content_chars: int) -> List[Message]:
+    return [
+        Message(sample['role'], f"{sample['content']}{i}", tokens=content_chars // 2,
+                reasoning_content=f"推理 {i}" if i % 2 else None)
+        for i, sample in enumerate(sample_messages(count, content_chars))
+    ]
+
+
+def measure_memory(build: Callable[[], list]) -> float:
+    """返回构造结果占用的内存（MB）"""
+    gc.collect()
+    tracemalloc.start()
+    messages = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del messages
+    return size / 1024 / 1024
+
+
+def best_of(fn: Callable[[], object], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='消息内存表示基准')
+    parser.add_argument('--counts', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--content-chars', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'消息数':>8}{'表示':>10}{'内存(MB)':>12}{'字节/条':>10}{'JSON(MB)':>11}{'序列化(ms)':>13}{'读取(ms)':>11}")
+    for count in args.counts:
+        dicts = build_dicts(count, args.content_chars)
+        messages = build_messages(count, args.content_chars)
+        cases = {
+            'dict': (
+                lambda: build_dicts(count, args.content_chars),
+                lambda: json.dumps(dicts, ensure_ascii=False, separators=(',', ':')),
+                lambda text: json.loads(text)
+            ),
+            'Message': (
+                lambda: build_messages(count, args.content_chars),
+                lambda: json.dumps(compact_messages(messages), ensure_ascii=False, separators=(',', ':')),
+                lambda text: load_messages(json.loads(text))
+            ),
+        }
+        for name, (build, dump, load) in cases.items():
+            memory = measure_memory(build)
+            text = dump()
+            dump_time = best_of(dump, args.repeat)
+            load_time = best_of(lambda: load(text), args.repeat)
+            print(f"{count:>8}{name:>10}{memory:>12.2f}{memory * 1024 * 1024 / count:>10.0f}"
+                  f"{len(text.encode('utf-8')) / 1024 / 1024:>11.2f}"
+                  f"{dump_time * 1000:>13.1f}{load_time * 1000:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
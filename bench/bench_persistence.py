@@ -0,0 +1,87 @@
+"""对比对话持久化的单条消息开销随历史规模的变化
+
+    python -m bench.bench_persistence --sizes 100 1000 10000
+
+legacy 为旧版 save_conversations_to_file 的做法（每条消息整体重写 indent=2 的 JSON），
+journal / sqlite 为当前的两个存储后端。
+"""
+import argparse
+import datetime
+import json
+import os
+import tempfile
+import time
+import uuid
+
+from bench.common import sample_messages
+from conversation_store import JournaledConversationStore, SQLiteConversationStore
+
+
+def build_history(total_messages: int, per_conversation: int = 50):
+    conversations = {}
+    messages = sample_messages(per_conversation)
+    now = datetime.datetime.now().isoformat()
+    for _ in range(max(total_messages // per_conversation, 1)):
+        conversation_id = str(uuid.uuid4())
+        conversations[conversation_id] = {
+            'id': conversation_id,
+            'created_at': now,
+            'updated_at': now,
+            'messages': [dict(m, timestamp=now) for m in messages]
+        }
+    return conversations
+
+
+def time_legacy(conversations, path: str, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(conversations, f, ensure_ascii=False, indent=2)
+    return (time.perf_counter() - start) / repeat
+
+
+def time_store(store, conversations, repeat: int) -> float:
+    for conversation in conversations.values():
+        messages = conversation['messages']
+        store.create_conversation(dict(conversation, messages=[]))
+        for message in messages:
+            store.add_message(conversation['id'], dict(message), conversation['updated_at'])
+    target = next(iter(conversations))
+    message = {'role': 'user', 'content': sample_messages(1)[0]['content'],
+               'timestamp': datetime.datetime.now().isoformat()}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        store.add_message(target, dict(message), message['timestamp'])
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对话持久化开销基准')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000, 20000],
+                        help='历史消息总数')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'历史消息数':>10}{'JSON 大小(MB)':>16}{'legacy(ms)':>14}{'journal(ms)':>14}{'sqlite(ms)':>14}")
+    for size in args.sizes:
+        workdir = tempfile.mkdtemp(prefix='pip-bench-')
+        conversations = build_history(size)
+
+        legacy_path = os.path.join(workdir, 'legacy.json')
+        legacy = time_legacy(conversations, legacy_path, max(args.repeat // 5, 1))
+        json_mb = os.path.getsize(legacy_path) / 1024 / 1024
+
+        journal = JournaledConversationStore(os.path.join(workdir, 'conversations.json'),
+                                             compact_threshold=10 ** 9)
+        journal_cost = time_store(journal, conversations, args.repeat)
+        journal.close()
+
+        sqlite = SQLiteConversationStore(os.path.join(workdir, 'conversations.db'))
+        sqlite_cost = time_store(sqlite, conversations, args.repeat)
+        sqlite.close()
+
+        print(f"{size:>10}{json_mb:>16.2f}{legacy * 1000:>14.3f}{journal_cost * 1000:>14.3f}{sqlite_cost * 1000:>14.3f}")
+
+
+if __name__ == '__main__':
+    main()
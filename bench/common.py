@@ -0,0 +1,74 @@
+import os
+import statistics
+import tempfile
+import threading
+from typing import Dict, List, Sequence
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """最近秩法计算分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(q / 100.0 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(values: Sequence[float]) -> Dict[str, float]:
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': statistics.fmean(values),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': max(values)
+    }
+
+
+def print_table(title: str, rows: Dict[str, Dict[str, float]], unit: str = ''):
+    print(f"\n== {title} ==")
+    columns = ['count', 'mean', 'p50', 'p90', 'p99', 'max']
+    print(f"{'指标':<24}" + ''.join(f"{c:>12}" for c in columns))
+    for name, stats in rows.items():
+        cells = []
+        for c in columns:
+            value = stats.get(c, 0)
+            cells.append(f"{value:>12}" if c == 'count' else f"{value:>12.4f}")
+        print(f"{name + unit:<24}" + ''.join(cells))
+
+
+def start_app(base_url: str, env: Dict[str, str] = None):
+    """在临时目录中以指定上游启动 Flask 应用，返回 (app 模块, 服务地址)
+
+    必须在导入 app 之前设置环境变量，因此每个进程只能调用一次。
+    """
+    os.environ['OPENAI_BASE_URL'] = base_url
+    os.environ.setdefault('ARK_API_KEY', 'bench')
+    # 压测时放开限流
+    os.environ.setdefault('RATE_LIMIT_PER_MINUTE', '1000000')
+    os.environ.setdefault('RATE_LIMIT_BURST', '1000000')
+    os.environ.setdefault('CONVERSATION_RATE_LIMIT_PER_MINUTE', '1000000')
+    os.environ.setdefault('CONVERSATION_RATE_LIMIT_BURST', '1000000')
+    os.environ.setdefault('UPSTREAM_MAX_CONCURRENCY', '1000')
+    os.environ.setdefault('UPSTREAM_MAX_QUEUE', '1000')
+    for key, value in (env or {}).items():
+        os.environ[key] = value
+    os.chdir(tempfile.mkdtemp(prefix='pip-bench-'))
+
+    import logging
+    import app as app_module
+    from werkzeug.serving import make_server
+
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app_module.load_conversations_from_file()
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return app_module, f"http://127.0.0.1:{server.server_port}"
+
+
+def sample_messages(count: int, content_chars: int = 400) -> List[Dict[str, str]]:
+    text = ('这是用于压测的消息内容，包含中文和 English words. ' * (content_chars // 30 + 1))[:content_chars]
+    return [{'role': 'user' if i % 2 == 0 else 'assistant', 'content': text} for i in range(count)]
@@ -0,0 +1,129 @@
+"""对 /ask、/search、/upload 做离线并发压测
+
+    python -m bench.load_test --conversations 20 --turns 3 --tokens-per-second 300
+
+默认在进程内启动模拟上游和 Flask 应用；传 --target 可以压测已经运行的服务。
+报告首帧时间（TTFT）、首个正文帧时间、总延迟的 p50/p99，以及每个回答的 SSE 字节数和帧数。
+"""
+import argparse
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import httpx
+
+from bench.common import print_table, start_app, summarize
+from bench.mock_upstream import MockSettings, start_mock_upstream
+
+
+def consume_stream(response: httpx.Response, start: float) -> Dict[str, float]:
+    """读取 SSE 响应并记录各个时间点"""
+    result = {'bytes': 0, 'frames': 0, 'ttft': None, 'ttfc': None, 'error': None}
+    for line in response.iter_lines():
+        result['bytes'] += len(line.encode('utf-8')) + 1
+        if not line.startswith('data: '):
+            continue
+        result['frames'] += 1
+        event = json.loads(line[6:])
+        now = time.perf_counter() - start
+        if event['type'] in ('reasoning', 'content') and result['ttft'] is None:
+            result['ttft'] = now
+        if event['type'] == 'content' and result['ttfc'] is None:
+            result['ttfc'] = now
+        if event['type'] == 'error':
+            result['error'] = event.get('content')
+    result['latency'] = time.perf_counter() - start
+    return result
+
+
+def run_conversation(client: httpx.Client, base: str, endpoint: str, turns: int,
+                     stream_format: str, index: int) -> List[Dict[str, float]]:
+    results = []
+    conversation_id = None
+    if endpoint == 'ask':
+        conversation_id = client.post(f"{base}/conversations").json()['id']
+    for turn in range(turns):
+        # 每个问题都不同，避免命中响应缓存
+        question = f"压测问题 {index}-{turn}-{time.time_ns()}"
+        start = time.perf_counter()
+        if endpoint == 'ask':
+            request = client.build_request('POST', f"{base}/ask", json={
+                'message': question, 'conversation_id': conversation_id, 'stream_format': stream_format
+            })
+        elif endpoint == 'search':
+            request = client.build_request('POST', f"{base}/search", json={'query': question, 'stream': True})
+        else:
+            files = {'file': (f'bench-{index}-{turn}.txt', io.BytesIO(question.encode('utf-8') * 50))}
+            request = client.build_request('POST', f"{base}/upload", files=files,
+                                           data={'type': 'document', 'stream': '1'})
+        response = client.send(request, stream=True)
+        try:
+            if response.status_code != 200:
+                response.read()
+                results.append({'error': f"HTTP {response.status_code}", 'latency': time.perf_counter() - start})
+                continue
+            results.append(consume_stream(response, start))
+        finally:
+            response.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线并发压测')
+    parser.add_argument('--target', help='已运行服务的地址；不传则在进程内启动应用和模拟上游')
+    parser.add_argument('--endpoint', choices=['ask', 'search', 'upload'], default='ask')
+    parser.add_argument('--conversations', type=int, default=10, help='并发会话数')
+    parser.add_argument('--turns', type=int, default=3, help='每个会话的轮数')
+    parser.add_argument('--stream-format', choices=['delta', 'cumulative'], default='delta')
+    parser.add_argument('--tokens-per-second', type=float, default=200.0)
+    parser.add_argument('--first-token-latency', type=float, default=0.3)
+    parser.add_argument('--reasoning-tokens', type=int, default=200)
+    parser.add_argument('--content-tokens', type=int, default=300)
+    args = parser.parse_args()
+
+    base = args.target
+    if not base:
+        mock = start_mock_upstream(0, MockSettings(
+            tokens_per_second=args.tokens_per_second,
+            first_token_latency=args.first_token_latency,
+            reasoning_tokens=args.reasoning_tokens,
+            content_tokens=args.content_tokens
+        ))
+        _, base = start_app(f"http://127.0.0.1:{mock.server_address[1]}/v1")
+
+    limits = httpx.Limits(max_connections=args.conversations * 2)
+    all_results = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+    with httpx.Client(timeout=600, limits=limits) as client, \
+            ThreadPoolExecutor(max_workers=args.conversations) as executor:
+        futures = [
+            executor.submit(run_conversation, client, base, args.endpoint, args.turns, args.stream_format, i)
+            for i in range(args.conversations)
+        ]
+        for future in futures:
+            with lock:
+                all_results.extend(future.result())
+    elapsed = time.perf_counter() - started
+
+    ok = [r for r in all_results if not r.get('error')]
+    errors = len(all_results) - len(ok)
+    print(f"\n端点 /{args.endpoint}，{args.conversations} 个并发会话 × {args.turns} 轮，"
+          f"共 {len(all_results)} 个请求，失败 {errors} 个，耗时 {elapsed:.2f}s，"
+          f"吞吐 {len(ok) / elapsed:.2f} 回答/s")
+    print_table('延迟（秒）', {
+        'ttft': summarize([r['ttft'] for r in ok if r['ttft'] is not None]),
+        'first_content': summarize([r['ttfc'] for r in ok if r['ttfc'] is not None]),
+        'latency': summarize([r['latency'] for r in ok]),
+    })
+    print_table('每个回答的 SSE 流量', {
+        'bytes': summarize([r['bytes'] for r in ok]),
+        'frames': summarize([r['frames'] for r in ok]),
+    })
+
+
+if __name__ == '__main__':
+    main()
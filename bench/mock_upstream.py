@@ -0,0 +1,175 @@
+"""本地模拟上游：兼容 OpenAI chat.completions 协议（含 reasoning_content 增量）
+
+用法：
+    python -m bench.mock_upstream --port 18000 --tokens-per-second 200 --first-token-latency 0.3
+
+然后把 OPENAI_BASE_URL 指向 http://127.0.0.1:18000/v1 即可离线压测。
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+class MockSettings:
+    """模拟上游的行为参数"""
+
+    def __init__(self, tokens_per_second: float = 200.0, first_token_latency: float = 0.3,
+                 reasoning_tokens: int = 200, content_tokens: int = 300,
+                 error_rate: float = 0.0, token: str = '测试',
+                 stall_rate: float = 0.0, stall_latency: float = 2.0):
+        self.tokens_per_second = tokens_per_second
+        self.first_token_latency = first_token_latency
+        self.reasoning_tokens = reasoning_tokens
+        self.content_tokens = content_tokens
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate  # 首块额外卡顿 stall_latency 秒的请求比例（模拟长尾）
+        self.stall_latency = stall_latency
+        self.token = token
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def next_request(self) -> int:
+        with self._lock:
+            self.requests += 1
+            return self.requests
+
+
+def _content_tokens(settings: MockSettings):
+    """正文每 20 个 token 插入一个句号，模拟真实的句子边界"""
+    for i in range(settings.content_tokens):
+        yield '。' if i % 20 == 19 else settings.token
+
+
+class MockUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    settings: MockSettings = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        settings = self.settings
+        n = settings.next_request()
+
+        if not self.path.endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'not found'}})
+            return
+        if settings.error_rate and (n * 7919 % 1000) / 1000 < settings.error_rate:
+            self._send_json(500, {'error': {'message': 'mock upstream error'}})
+            return
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = request.get('model', 'mock')
+        interval = 1.0 / settings.tokens_per_second if settings.tokens_per_second > 0 else 0
+        time.sleep(settings.first_token_latency)
+        if settings.stall_rate and (n * 104729 % 1000) / 1000 < settings.stall_rate:
+            time.sleep(settings.stall_latency)
+
+        if not request.get('stream'):
+            time.sleep(interval * (settings.reasoning_tokens + settings.content_tokens))
+            self._send_json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'finish_reason': 'stop',
+                    'message': {
+                        'role': 'assistant',
+                        'content': ''.join(_content_tokens(settings)),
+                        'reasoning_content': settings.token * settings.reasoning_tokens
+                    }
+                }]
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        def send(delta: dict, finish_reason: Optional[str] = None):
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        try:
+            send({'role': 'assistant', 'content': ''})
+            for _ in range(settings.reasoning_tokens):
+                send({'reasoning_content': settings.token})
+                time.sleep(interval)
+            for token in _content_tokens(settings):
+                send({'content': token})
+                time.sleep(interval)
+            send({}, finish_reason='stop')
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前断开
+            pass
+        self.close_connection = True
+
+
+def start_mock_upstream(port: int = 0, settings: Optional[MockSettings] = None) -> ThreadingHTTPServer:
+    """在后台线程中启动模拟上游，port=0 时自动分配端口"""
+    handler = type('Handler', (MockUpstreamHandler,), {'settings': settings or MockSettings()})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟 OpenAI 兼容上游')
+    parser.add_argument('--port', type=int, default=18000)
+    parser.add_argument('--tokens-per-second', type=float, default=200.0)
+    parser.add_argument('--first-token-latency', type=float, default=0.3)
+    parser.add_argument('--reasoning-tokens', type=int, default=200)
+    parser.add_argument('--content-tokens', type=int, default=300)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--stall-rate', type=float, default=0.0)
+    parser.add_argument('--stall-latency', type=float, default=2.0)
+    args = parser.parse_args()
+
+    settings = MockSettings(
+        tokens_per_second=args.tokens_per_second,
+        first_token_latency=args.first_token_latency,
+        reasoning_tokens=args.reasoning_tokens,
+        content_tokens=args.content_tokens,
+        error_rate=args.error_rate,
+        stall_rate=args.stall_rate,
+        stall_latency=args.stall_latency
+    )
+    server = start_mock_upstream(args.port, settings)
+    print(f"模拟上游已启动: http://127.0.0.1:{server.server_address[1]}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+MAP_PROMPT = """你正在分块阅读一个较大的文件（{filename}），这是第 {index}/{total} 块。
+{question}
+请只根据本块内容，提炼与问题相关的要点、关键数据和发现的问题，使用简洁的条目。
+本块内容：
+```
+{chunk}
+```"""
+
+REDUCE_PROMPT = """以下是对文件 {filename} 各部分的分析结果（共 {count} 份）。
+{question}
+请合并这些结果，去除重复，给出完整、有条理的最终回答。
+
+{partials}"""
+
+
+def split_into_chunks(pages: List[str], count_tokens: Callable[[str], int], chunk_tokens: int) -> List[str]:
+    """按页 → 段落 → 字符的顺序切分，使每块不超过 chunk_tokens"""
+    units = []
+    for page in pages:
+        if count_tokens(page) <= chunk_tokens:
+            units.append(page)
+            continue
+        for paragraph in page.split('\n'):
+            if count_tokens(paragraph) <= chunk_tokens:
+                units.append(paragraph)
+                continue
+            # 单个段落仍然过长，按字符硬切
+            step = max(len(paragraph) * chunk_tokens // max(count_tokens(paragraph), 1), 1)
+            units.extend(paragraph[i:i + step] for i in range(0, len(paragraph), step))
+
+    # 贪心合并相邻单元，尽量填满每块
+    chunks = []
+    current, current_tokens = [], 0
+    for unit in units:
+        tokens = count_tokens(unit)
+        if current and current_tokens + tokens > chunk_tokens:
+            chunks.append('\n'.join(current))
+            current, current_tokens = [], 0
+        current.append(unit)
+        current_tokens += tokens
+    if current:
+        chunks.append('\n'.join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+class ChunkedAnalyzer:
+    """大文件的 map-reduce 分析：分块并发分析，再合并结果
+
+    run() 是一个生成器，依次产出进度事件，最后产出 {'type': 'result', 'content': ...}。
+    """
+
+    def __init__(self, complete: Callable[[List[Dict[str, str]]], str],
+                 count_tokens: Callable[[str], int], chunk_tokens: int = 6000,
+                 max_concurrency: int = 4, system_prompt: str = ''):
+        self.complete = complete
+        self.count_tokens = count_tokens
+        self.chunk_tokens = chunk_tokens
+        self.max_concurrency = max_concurrency
+        self.system_prompt = system_prompt
+
+    def _messages(self, prompt: str) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": self.system_prompt}] if self.system_prompt else []
+        return messages + [{"role": "user", "content": prompt}]
+
+    def _map(self, prompts: List[str], stage: str) -> Iterator[Dict]:
+        """并发执行一批调用，每完成一个产出一次进度"""
+        results = [None] * len(prompts)
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        try:
+            futures = {
+                executor.submit(self.complete, self._messages(prompt)): i
+                for i, prompt in enumerate(prompts)
+            }
+            for completed, future in enumerate(as_completed(futures), 1):
+                results[futures[future]] = future.result()
+                yield {'type': 'progress', 'stage': stage, 'completed': completed, 'total': len(prompts)}
+        finally:
+            # 客户端断开时生成器被关闭：取消排队中的调用，不等进行中的调用结束
+            executor.shutdown(wait=False, cancel_futures=True)
+        yield {'type': 'partials', 'results': results}
+
+    def _truncate(self, text: str, tokens: int) -> str:
+        """按 token 比例截断文本"""
+        total = self.count_tokens(text)
+        if total <= tokens:
+            return text
+        return text[:max(len(text) * tokens // total, 1)]
+
+    def _group(self, partials: List[str]) -> List[str]:
+        """把分析结果分组，每组不超过一块的预算
+
+        单份结果已接近预算而无法成组时，截断到半块后两两合并，保证每轮至少减半。
+        """
+        labeled = [f"【第 {i} 部分】\n{p}" for i, p in enumerate(partials, 1)]
+        groups = split_into_chunks(labeled, self.count_tokens, self.chunk_tokens)
+        if len(groups) < len(partials) or len(partials) <= 1:
+            return groups
+        logger.warning("分析结果过长，截断后两两合并: %d 份", len(partials))
+        limit = (self.chunk_tokens - self.count_tokens('\n')) // 2
+        half = [self._truncate(text, limit) for text in labeled]
+        return ['\n'.join(half[i:i + 2]) for i in range(0, len(half), 2)]
+
+    def run(self, pages: List[str], filename: str, question: str) -> Iterator[Dict]:
+        chunks = split_into_chunks(pages, self.count_tokens, self.chunk_tokens)
+        yield {'type': 'progress', 'stage': 'split', 'completed': len(chunks), 'total': len(chunks)}
+
+        prompts = [
+            MAP_PROMPT.format(filename=filename, index=i, total=len(chunks), question=question, chunk=chunk)
+            for i, chunk in enumerate(chunks, 1)
+        ]
+        partials = []
+        for event in self._map(prompts, 'map'):
+            if event['type'] == 'partials':
+                partials = event['results']
+            else:
+                yield event
+
+        # 分析结果仍然过多时分层合并，每组不超过一块的预算
+        level = 0
+        groups = self._group(partials)
+        while len(groups) > 1:
+            level += 1
+            prompts = [
+                REDUCE_PROMPT.format(filename=filename, count=group.count('【第 '), question=question, partials=group)
+                for group in groups
+            ]
+            for event in self._map(prompts, f'reduce-{level}'):
+                if event['type'] == 'partials':
+                    partials = event['results']
+                else:
+                    yield event
+            groups = self._group(partials)
+
+        if len(partials) == 1 and level > 0:
+            content = partials[0]
+        else:
+            content = self.complete(self._messages(
+                REDUCE_PROMPT.format(filename=filename, count=len(partials), question=question,
+                                     partials=groups[0] if groups else '')
+            ))
+            yield {'type': 'progress', 'stage': 'reduce', 'completed': 1, 'total': 1}
+        yield {'type': 'result', 'content': content, 'chunks': len(chunks)}
@@ -0,0 +1,73 @@
+import bisect
+import itertools
+import logging
+import math
+import re
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 中日韩文字及全角符号
+_CJK_RE = re.compile(r'[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+# 每条消息的格式开销（角色标记等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def approx_token_count(text: str) -> int:
+    """离线近似计数：中文约 0.6 token/字，其他字符约 0.3 token/字"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return math.ceil(cjk * 0.6 + (len(text) - cjk) * 0.3)
+
+
+def load_tokenizer(name: str) -> Callable[[str], int]:
+    """按名称加载分词器，不可用时回退到近似计数"""
+    if name == 'tiktoken':
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding('cl100k_base')
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        except ImportError:
+            logger.warning("未安装 tiktoken，使用近似 token 计数")
+    return approx_token_count
+
+
+class ContextBuilder:
+    """按 token 预算挑选历史消息窗口"""
+
+    def __init__(self, context_tokens: int, reserve_tokens: int,
+                 tokenizer: Optional[Callable[[str], int]] = None, min_messages: int = 2):
+        self.context_tokens = context_tokens
+        self.reserve_tokens = reserve_tokens
+        self.tokenizer = tokenizer or approx_token_count
+        self.min_messages = min_messages
+
+    def count(self, text: str) -> int:
+        return self.tokenizer(text or '') + MESSAGE_OVERHEAD_TOKENS
+
+    def message_tokens(self, message: Dict) -> int:
+        """读取缓存的 token 数，旧消息没有时补算并缓存"""
+        tokens = message.get('tokens')
+        if tokens is None:
+            tokens = self.count(message.get('content'))
+            message['tokens'] = tokens
+        return tokens
+
+    def select_window(self, history: List[Dict], budget: int) -> List[Dict]:
+        """用前缀和 + 二分查找找出预算内最长的最新消息后缀"""
+        if not history:
+            return []
+        prefix = list(itertools.accumulate(self.message_tokens(m) for m in history))
+        # 需要丢弃的 token 数；第一个 prefix[j] >= excess 的 j 之后即为窗口起点
+        excess = prefix[-1] - budget
+        start = bisect.bisect_left(prefix, excess) + 1 if excess > 0 else 0
+        start = min(start, max(len(history) - self.min_messages, 0))
+        return history[start:]
+
+    def build(self, system_prompt: Dict, history: List[Dict]) -> List[Dict]:
+        """构建发送给上游的消息列表（系统提示 + 预算内的历史）"""
+        budget = self.context_tokens - self.reserve_tokens - self.message_tokens(dict(system_prompt))
+        messages = [msg for msg in history if msg['role'] != 'system']
+        return [system_prompt] + self.select_window(messages, budget)
@@ -0,0 +1,1042 @@
+import bisect
+import glob
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from message_model import Message, compact_messages, load_messages
+from search_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+def _atomic_write_json(path: str, data: Any):
+    """先写临时文件再原子替换，崩溃时不会留下被截断的文件"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+TITLE_LENGTH = 30
+
+
+def conversation_title(content: Optional[str]) -> str:
+    """用第一条消息生成会话标题"""
+    if not content:
+        return '新对话'
+    return content[:TITLE_LENGTH] + '...' if len(content) > TITLE_LENGTH else content
+
+
+def message_bytes(message: Dict) -> int:
+    """消息正文和推理内容的 UTF-8 字节数"""
+    return len((message.get('content') or '').encode('utf-8')) + \
+        len((message.get('reasoning_content') or '').encode('utf-8'))
+
+
+class ConversationIndex:
+    """按 updated_at 排序的会话摘要索引，随写操作增量维护"""
+
+    def __init__(self):
+        self.entries: Dict[str, Dict] = {}
+        self._order: List[Tuple[str, str]] = []  # (updated_at, id) 升序
+
+    def _key(self, entry: Dict) -> Tuple[str, str]:
+        return entry['updated_at'], entry['id']
+
+    def _remove_key(self, key: Tuple[str, str]):
+        i = bisect.bisect_left(self._order, key)
+        if i < len(self._order) and self._order[i] == key:
+            del self._order[i]
+
+    def put(self, conversation: Dict):
+        """新增或整体刷新一个会话的条目"""
+        messages = conversation.get('messages', [])
+        self.put_entry({
+            'id': conversation['id'],
+            'title': conversation_title(messages[0]['content'] if messages else None),
+            'created_at': conversation['created_at'],
+            'updated_at': conversation['updated_at'],
+            'message_count': len(messages)
+        })
+
+    def put_entry(self, entry: Dict):
+        """直接写入已构造好的条目（元数据中已有标题和消息数时使用）"""
+        self.remove(entry['id'])
+        self.entries[entry['id']] = entry
+        bisect.insort(self._order, self._key(entry))
+
+    def touch(self, conversation_id: str, message: Dict, updated_at: str):
+        """追加消息后更新条目，O(log n) 定位"""
+        entry = self.entries.get(conversation_id)
+        if entry is None:
+            return
+        self._remove_key(self._key(entry))
+        if entry['message_count'] == 0:
+            entry['title'] = conversation_title(message['content'])
+        entry['message_count'] += 1
+        entry['updated_at'] = updated_at
+        bisect.insort(self._order, self._key(entry))
+
+    def remove(self, conversation_id: str):
+        entry = self.entries.pop(conversation_id, None)
+        if entry is not None:
+            self._remove_key(self._key(entry))
+
+    def remove_many(self, conversation_ids: Iterable[str]):
+        """批量删除，只重建一次排序列表"""
+        removed = {cid for cid in conversation_ids if self.entries.pop(cid, None) is not None}
+        if removed:
+            self._order = [key for key in self._order if key[1] not in removed]
+
+    def rebuild(self, entries: Iterable[Dict]):
+        """整体重建，一次排序"""
+        self.entries = {entry['id']: entry for entry in entries}
+        self._order = sorted(self._key(entry) for entry in self.entries.values())
+
+    def page(self, limit: int, before: Optional[Tuple[str, str]] = None) -> List[Dict]:
+        """按 updated_at 倒序返回 before 之后的最多 limit 条"""
+        end = bisect.bisect_left(self._order, tuple(before)) if before else len(self._order)
+        keys = self._order[max(end - limit, 0):end]
+        return [dict(self.entries[conversation_id]) for _, conversation_id in reversed(keys)]
+
+
+class ConversationStore:
+    """对话存储接口，不同后端实现相同的方法"""
+
+    def get_conversation(self, conversation_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def get_conversations(self) -> List[Dict]:
+        raise NotImplementedError
+
+    def list_summaries(self, limit: int, before: Optional[Tuple[str, str]] = None) -> List[Dict]:
+        """按 updated_at 倒序列出会话摘要（不含消息），before 为上一页最后一条的 (updated_at, id)"""
+        raise NotImplementedError
+
+    def get_summaries(self, conversation_ids: Iterable[str]) -> Dict[str, Dict]:
+        """按 id 取会话摘要（标题、时间、消息数），不读取消息正文"""
+        raise NotImplementedError
+
+    def get_messages(self, conversation_id: str, positions: Iterable[int]) -> Dict[int, Dict]:
+        """按序号取会话中的若干条消息，不把正文换入内存，供搜索结果生成片段"""
+        raise NotImplementedError
+
+    def create_conversation(self, conversation: Dict):
+        raise NotImplementedError
+
+    def add_message(self, conversation_id: str, message: Dict, updated_at: str) -> bool:
+        raise NotImplementedError
+
+    def delete_conversation(self, conversation_id: str) -> bool:
+        raise NotImplementedError
+
+    def delete_conversations(self, conversation_ids: Iterable[str], updated_before: Optional[str] = None) -> List[str]:
+        """批量删除会话，作为一次持久化操作；updated_before 之后有更新的会话会被跳过，返回实际删除的 id"""
+        raise NotImplementedError
+
+    def iter_conversations(self) -> Iterator[Dict]:
+        """逐个遍历全部会话（重建索引等一次性任务使用）"""
+        yield from self.get_conversations()
+
+    def conversation_sizes(self) -> List[Tuple[str, str, int]]:
+        """所有会话的 (updated_at, id, 历史字节数)，供淘汰策略使用"""
+        raise NotImplementedError
+
+    def set_summary(self, conversation_id: str, summary: Dict) -> bool:
+        """保存会话的滚动摘要"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        """会话数、消息数、历史字节数和常驻内存的部分，供监控采集"""
+        raise NotImplementedError
+
+    def load(self):
+        """启动时加载或初始化存储"""
+
+    def compact(self):
+        """整理存储（快照、清理等），默认无操作"""
+
+    def close(self):
+        """释放文件句柄或连接"""
+
+
+class JournaledConversationStore(ConversationStore):
+    """追加写日志的对话存储，消息正文按需加载
+
+    每次变更以一条紧凑的 JSON 记录追加到日志文件，日志过长时在后台线程
+    压缩为快照。快照分两部分：只含元数据的索引文件（启动时加载），以及按偏移
+    寻址的正文数据文件（打开或需要时才读取）。常驻内存的正文按 LRU 控制在
+    memory_budget 字节内，超出时淘汰最久未用的会话（0 表示不限制）。
+    消息在内存中是 Message 对象，日志和数据文件中写成紧凑数组，旧版的 dict 格式仍可读取。
+    """
+
+    SNAPSHOT_FORMAT = 2
+
+    def __init__(self, snapshot_path: str, journal_path: Optional[str] = None,
+                 compact_threshold: int = 500, fsync: bool = False, memory_budget: int = 0):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or f"{snapshot_path}.journal"
+        self.rotated_path = f"{self.journal_path}.1"
+        self.compact_threshold = compact_threshold
+        self.fsync = fsync
+        self.memory_budget = memory_budget
+        # 每个会话的元数据：时间戳、摘要、字节数，正文在数据文件中的位置
+        # (offset, length, persisted 条消息)，以及未常驻时快照之后新增的消息 tail
+        self.meta: Dict[str, Dict] = {}
+        # 常驻内存的完整会话，按最近使用排序
+        self.conversations: "OrderedDict[str, Dict]" = OrderedDict()
+        self.resident_bytes = 0
+        self.index = ConversationIndex()
+        self.lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._journal = None
+        self._data_path: Optional[str] = None
+        self._data = None
+        self._seq = 0
+        self._records_since_compact = 0
+        self._compacting = False
+
+    # ---- 元数据与正文 ----
+
+    @staticmethod
+    def _new_meta(conversation: Dict) -> Dict:
+        messages = conversation.get('messages', [])
+        return {
+            'id': conversation['id'],
+            'title': conversation_title(messages[0]['content'] if messages else None),
+            'created_at': conversation['created_at'],
+            'updated_at': conversation['updated_at'],
+            'message_count': len(messages),
+            'bytes': sum(message_bytes(m) for m in messages),
+            'summary': conversation.get('summary'),
+            'offset': 0,
+            'length': 0,
+            'persisted': 0,
+            'tail': load_messages(messages)
+        }
+
+    @staticmethod
+    def _index_entry(meta: Dict) -> Dict:
+        return {key: meta[key] for key in ('id', 'title', 'created_at', 'updated_at', 'message_count')}
+
+    def _data_file_path(self, name: str) -> str:
+        return os.path.join(os.path.dirname(os.path.abspath(self.snapshot_path)), name)
+
+    def _read_persisted(self, meta: Dict, handle=None) -> List[Dict]:
+        """从数据文件读取快照中的消息"""
+        if not meta['length']:
+            return []
+        if handle is None:
+            if self._data is None:
+                self._data = open(self._data_path, 'rb')
+            handle = self._data
+        handle.seek(meta['offset'])
+        return load_messages(json.loads(handle.read(meta['length']))['messages'])
+
+    def _load_body(self, conversation_id: str) -> Optional[Dict]:
+        """返回常驻的会话，不在内存时从数据文件加载并放入 LRU，调用方需持有锁"""
+        conversation = self.conversations.get(conversation_id)
+        if conversation is not None:
+            self.conversations.move_to_end(conversation_id)
+            return conversation
+        meta = self.meta.get(conversation_id)
+        if meta is None:
+            return None
+        conversation = self._materialize(meta)
+        meta['tail'] = []
+        self.conversations[conversation_id] = conversation
+        self.resident_bytes += meta['bytes']
+        self._evict_cold()
+        return conversation
+
+    def _materialize(self, meta: Dict) -> Dict:
+        conversation = {
+            'id': meta['id'],
+            'messages': self._read_persisted(meta) + meta['tail'],
+            'created_at': meta['created_at'],
+            'updated_at': meta['updated_at']
+        }
+        if meta.get('summary') is not None:
+            conversation['summary'] = meta['summary']
+        return conversation
+
+    def _evict_cold(self):
+        """常驻正文超出预算时按 LRU 换出，至少保留最近使用的一个"""
+        if not self.memory_budget:
+            return
+        while self.resident_bytes > self.memory_budget and len(self.conversations) > 1:
+            conversation_id, conversation = self.conversations.popitem(last=False)
+            meta = self.meta[conversation_id]
+            # 快照之后新增的消息只在日志里，换出时留在元数据中
+            meta['tail'] = conversation['messages'][meta['persisted']:]
+            self.resident_bytes -= meta['bytes']
+
+    def _drop(self, conversation_id: str):
+        meta = self.meta.pop(conversation_id, None)
+        if meta is not None and self.conversations.pop(conversation_id, None) is not None:
+            self.resident_bytes -= meta['bytes']
+
+    # ---- 读取 ----
+
+    def get_conversation(self, conversation_id: str) -> Optional[Dict]:
+        with self.lock:
+            return self._load_body(conversation_id)
+
+    def get_conversations(self) -> List[Dict]:
+        """返回全部会话；不常驻的会话只临时读取，不挤占 LRU"""
+        with self.lock:
+            return [
+                self.conversations.get(cid) or self._materialize(meta)
+                for cid, meta in self.meta.items()
+            ]
+
+    def list_summaries(self, limit: int, before: Optional[Tuple[str, str]] = None) -> List[Dict]:
+        with self.lock:
+            return self.index.page(limit, before)
+
+    def get_summaries(self, conversation_ids: Iterable[str]) -> Dict[str, Dict]:
+        with self.lock:
+            return {
+                cid: dict(self.index.entries[cid])
+                for cid in conversation_ids if cid in self.index.entries
+            }
+
+    def get_messages(self, conversation_id: str, positions: Iterable[int]) -> Dict[int, Dict]:
+        """常驻时直接取；否则只临时读取快照中的正文，不放入 LRU"""
+        with self.lock:
+            conversation = self.conversations.get(conversation_id)
+            if conversation is not None:
+                messages = conversation['messages']
+                return {p: messages[p] for p in positions if 0 <= p < len(messages)}
+            meta = self.meta.get(conversation_id)
+            if meta is None:
+                return {}
+            positions = [p for p in positions if 0 <= p < meta['message_count']]
+            persisted = self._read_persisted(meta) if any(p < meta['persisted'] for p in positions) else []
+            return {
+                p: persisted[p] if p < meta['persisted'] else meta['tail'][p - meta['persisted']]
+                for p in positions
+            }
+
+    def conversation_sizes(self) -> List[Tuple[str, str, int]]:
+        with self.lock:
+            return [(meta['updated_at'], cid, meta['bytes']) for cid, meta in self.meta.items()]
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'conversations': len(self.meta),
+                'messages': sum(meta['message_count'] for meta in self.meta.values()),
+                'history_bytes': sum(meta['bytes'] for meta in self.meta.values()),
+                'resident_conversations': len(self.conversations),
+                'resident_bytes': self.resident_bytes
+            }
+
+    # ---- 写入 ----
+
+    def create_conversation(self, conversation: Dict):
+        with self.lock:
+            conversation['messages'] = load_messages(conversation.get('messages', []))
+            meta = self._new_meta(conversation)
+            meta['tail'] = []
+            self.meta[conversation['id']] = meta
+            self.conversations[conversation['id']] = conversation
+            self.resident_bytes += meta['bytes']
+            self.index.put_entry(self._index_entry(meta))
+            self._append({'op': 'create', 'conv': dict(conversation, messages=compact_messages(conversation['messages']))})
+            self._evict_cold()
+
+    def _account(self, meta: Dict, message: Dict, updated_at: str) -> int:
+        """更新元数据中的计数、字节数和标题，返回消息字节数"""
+        size = message_bytes(message)
+        if meta['message_count'] == 0:
+            meta['title'] = conversation_title(message['content'])
+        meta['message_count'] += 1
+        meta['bytes'] += size
+        meta['updated_at'] = updated_at
+        return size
+
+    def add_message(self, conversation_id: str, message: Dict, updated_at: str) -> bool:
+        message = Message.load(message)
+        with self.lock:
+            meta = self.meta.get(conversation_id)
+            if meta is None:
+                return False
+            size = self._account(meta, message, updated_at)
+            conversation = self.conversations.get(conversation_id)
+            if conversation is not None:
+                conversation['messages'].append(message)
+                conversation['updated_at'] = updated_at
+                self.conversations.move_to_end(conversation_id)
+                self.resident_bytes += size
+            else:
+                # 追加不需要加载正文
+                meta['tail'].append(message)
+            self.index.touch(conversation_id, message, updated_at)
+            self._append({'op': 'add', 'id': conversation_id, 'msg': message.to_compact(), 'ts': updated_at})
+            self._evict_cold()
+            return True
+
+    def delete_conversation(self, conversation_id: str) -> bool:
+        with self.lock:
+            if conversation_id not in self.meta:
+                return False
+            self._drop(conversation_id)
+            self.index.remove(conversation_id)
+            self._append({'op': 'delete', 'id': conversation_id})
+            return True
+
+    def delete_conversations(self, conversation_ids: Iterable[str], updated_before: Optional[str] = None) -> List[str]:
+        with self.lock:
+            ids = [
+                cid for cid in conversation_ids
+                if cid in self.meta and (
+                    updated_before is None or self.meta[cid]['updated_at'] <= updated_before
+                )
+            ]
+            if not ids:
+                return []
+            for cid in ids:
+                self._drop(cid)
+            self.index.remove_many(ids)
+            # 整批只写一条日志记录
+            self._append({'op': 'delete_many', 'ids': ids})
+            return ids
+
+    def iter_conversations(self) -> Iterator[Dict]:
+        """逐个读取，不常驻的会话不进入 LRU"""
+        with self.lock:
+            ids = list(self.meta)
+        for conversation_id in ids:
+            with self.lock:
+                meta = self.meta.get(conversation_id)
+                if meta is None:
+                    continue
+                conversation = self.conversations.get(conversation_id) or self._materialize(meta)
+            yield conversation
+
+    def set_summary(self, conversation_id: str, summary: Dict) -> bool:
+        with self.lock:
+            meta = self.meta.get(conversation_id)
+            if meta is None:
+                return False
+            meta['summary'] = summary
+            conversation = self.conversations.get(conversation_id)
+            if conversation is not None:
+                conversation['summary'] = summary
+            self._append({'op': 'summary', 'id': conversation_id, 'summary': summary})
+            return True
+
+    # ---- 持久化 ----
+
+    def load(self):
+        """加载索引快照并重放日志，消息正文留在磁盘上"""
+        with self.lock:
+            self.meta.clear()
+            self.conversations.clear()
+            self.resident_bytes = 0
+            if self._data is not None:
+                self._data.close()
+                self._data = None
+            self._data_path = None
+            snapshot_seq = 0
+            legacy = False
+            if os.path.exists(self.snapshot_path):
+                with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('format') == self.SNAPSHOT_FORMAT:
+                    snapshot_seq = data['seq']
+                    self._data_path = self._data_file_path(data['data_file'])
+                    for conversation_id, meta in data['index'].items():
+                        meta['tail'] = []
+                        self.meta[conversation_id] = meta
+                else:
+                    # 旧版快照包含全部正文，加载后立即转换为新格式
+                    legacy = True
+                    if 'conversations' in data and 'seq' in data:
+                        snapshot_seq = data['seq']
+                        data = data['conversations']
+                    for conversation in data.values():
+                        self.meta[conversation['id']] = self._new_meta(conversation)
+            self._seq = snapshot_seq
+            replayed = 0
+            for path in (self.rotated_path, self.journal_path):
+                replayed += self._replay(path, snapshot_seq)
+            self._records_since_compact = replayed
+            self.index.rebuild(self._index_entry(meta) for meta in self.meta.values())
+            logger.info(f"已加载 {len(self.meta)} 个对话的索引，重放 {replayed} 条日志")
+        if legacy:
+            logger.info("正在将旧版对话快照转换为索引 + 数据文件格式")
+            self.compact()
+        self._remove_stale_data_files()
+
+    def _remove_stale_data_files(self):
+        """清理崩溃或压缩遗留的、不再被快照引用的数据文件"""
+        pattern = f"{glob.escape(os.path.abspath(self.snapshot_path))}.*.data"
+        current = os.path.abspath(self._data_path) if self._data_path else None
+        for path in glob.glob(pattern):
+            if path != current:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _replay(self, path: str, snapshot_seq: int) -> int:
+        if not os.path.exists(path):
+            return 0
+        count = 0
+        valid_size = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # 崩溃时最后一行可能只写了一半，丢弃并截断
+                    logger.warning(f"丢弃未写完的日志记录: {path}")
+                    break
+                valid_size += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"跳过损坏的日志记录: {path}")
+                    continue
+                seq = record.get('seq', 0)
+                if seq <= snapshot_seq:
+                    continue
+                self._apply(record)
+                self._seq = max(self._seq, seq)
+                count += 1
+        if valid_size < os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(valid_size)
+        return count
+
+    def _apply(self, record: Dict):
+        """重放时只更新元数据，新增消息暂存在 tail 中"""
+        op = record['op']
+        if op == 'create':
+            self.meta[record['conv']['id']] = self._new_meta(record['conv'])
+        elif op == 'add':
+            meta = self.meta.get(record['id'])
+            if meta is not None:
+                message = Message.load(record['msg'])
+                self._account(meta, message, record['ts'])
+                meta['tail'].append(message)
+        elif op == 'delete':
+            self.meta.pop(record['id'], None)
+        elif op == 'delete_many':
+            for conversation_id in record['ids']:
+                self.meta.pop(conversation_id, None)
+        elif op == 'summary':
+            meta = self.meta.get(record['id'])
+            if meta is not None:
+                meta['summary'] = record['summary']
+
+    def _append(self, record: Dict):
+        """追加一条日志记录，调用方需持有锁"""
+        self._seq += 1
+        record['seq'] = self._seq
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._journal.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self._records_since_compact += 1
+        if self._records_since_compact >= self.compact_threshold and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self.compact, name='conversation-compact', daemon=True).start()
+
+    def compact(self):
+        """写出新的数据文件和索引快照并截断日志"""
+        with self._compact_lock:
+            self._compact()
+
+    def _compact(self):
+        with self.lock:
+            self._compacting = True
+            # 只在锁内复制引用：常驻会话复制消息列表，其余记下数据文件位置和 tail
+            plan = []
+            for conversation_id, meta in self.meta.items():
+                conversation = self.conversations.get(conversation_id)
+                header = {k: v for k, v in meta.items() if k != 'tail'}
+                if conversation is not None:
+                    plan.append((header, list(conversation['messages']), None))
+                else:
+                    plan.append((header, None, list(meta['tail'])))
+            seq = self._seq
+            old_data_path = self._data_path
+            # 轮转日志：快照落盘前旧日志仍保留，崩溃后可重放
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if os.path.exists(self.journal_path):
+                if os.path.exists(self.rotated_path):
+                    # 上次压缩未完成，合并到轮转日志中
+                    with open(self.rotated_path, 'a', encoding='utf-8') as dst, \
+                            open(self.journal_path, 'r', encoding='utf-8') as src:
+                        dst.write(src.read())
+                    os.remove(self.journal_path)
+                else:
+                    os.replace(self.journal_path, self.rotated_path)
+            self._records_since_compact = 0
+        try:
+            data_name = f"{os.path.basename(self.snapshot_path)}.{seq}.data"
+            data_path = self._data_file_path(data_name)
+            index = self._write_data_file(plan, old_data_path, data_path)
+            _atomic_write_json(self.snapshot_path, {
+                'seq': seq, 'format': self.SNAPSHOT_FORMAT, 'data_file': data_name, 'index': index
+            })
+            with self.lock:
+                # 切换到新数据文件；压缩期间新增的消息仍保留在 tail / 常驻正文中
+                for conversation_id, header in index.items():
+                    meta = self.meta.get(conversation_id)
+                    if meta is None:
+                        continue
+                    if conversation_id not in self.conversations:
+                        meta['tail'] = meta['tail'][header['persisted'] - meta['persisted']:]
+                    meta['offset'] = header['offset']
+                    meta['length'] = header['length']
+                    meta['persisted'] = header['persisted']
+                if self._data is not None:
+                    self._data.close()
+                    self._data = None
+                self._data_path = data_path
+            if os.path.exists(self.rotated_path):
+                os.remove(self.rotated_path)
+            if old_data_path and old_data_path != data_path and os.path.exists(old_data_path):
+                os.remove(old_data_path)
+            logger.info(f"已压缩 {len(index)} 个对话历史到快照")
+        except Exception as e:
+            logger.error(f"压缩对话历史失败: {str(e)}")
+        finally:
+            self._compacting = False
+
+    def _write_data_file(self, plan: List[Tuple[Dict, Optional[List[Dict]], Optional[List[Dict]]]],
+                         old_data_path: Optional[str], data_path: str) -> Dict[str, Dict]:
+        """把全部正文写入新数据文件，返回带偏移量的索引；在锁外执行"""
+        index = {}
+        tmp_path = f"{data_path}.tmp"
+        old = open(old_data_path, 'rb') if old_data_path and os.path.exists(old_data_path) else None
+        try:
+            with open(tmp_path, 'wb') as out:
+                for header, messages, tail in plan:
+                    if messages is None:
+                        messages = self._read_persisted(header, old) + tail
+                    line = json.dumps({'id': header['id'], 'messages': compact_messages(messages)},
+                                      ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+                    header.update(offset=out.tell(), length=len(line), persisted=len(messages))
+                    out.write(line + b'\n')
+                    index[header['id']] = header
+                out.flush()
+                os.fsync(out.fileno())
+        finally:
+            if old is not None:
+                old.close()
+        os.replace(tmp_path, data_path)
+        return index
+
+    def close(self):
+        # 等待进行中的压缩完成，避免留下写了一半的数据文件
+        with self._compact_lock, self.lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if self._data is not None:
+                self._data.close()
+                self._data = None
+
+
+class SQLiteConversationStore(ConversationStore):
+    """SQLite（WAL 模式）对话存储，多个工作进程可共享同一份数据
+
+    SQLite 带 FTS5 时，历史搜索的倒排索引也放在数据库中（message_terms，rowid 即消息 id），
+    与消息在同一事务内增删，所有工作进程看到的索引一致。
+    """
+
+    FTS_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS message_terms USING fts5(
+        terms, tokenize = 'unicode61 remove_diacritics 0'
+    );
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS conversations (
+        id TEXT PRIMARY KEY,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        summary TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations(updated_at);
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        conversation_id TEXT NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        reasoning_content TEXT,
+        timestamp TEXT NOT NULL,
+        tokens INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages(conversation_id, id);
+    """
+
+    def __init__(self, db_path: str, busy_timeout: float = 30.0):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self.full_text = self.fts5_available()
+
+    @staticmethod
+    def fts5_available() -> bool:
+        conn = sqlite3.connect(':memory:')
+        try:
+            conn.execute('CREATE VIRTUAL TABLE t USING fts5(x)')
+            return True
+        except sqlite3.OperationalError:
+            return False
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _terms(content: Optional[str]) -> str:
+        """预先切好的词用空格连接，FTS5 按空格切分即可得到同样的词"""
+        return ' '.join(tokenize(content))
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程使用独立连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(self.SCHEMA)
+            if self.full_text:
+                conn.executescript(self.FTS_SCHEMA)
+            self._migrate(conn)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        """为旧数据库补充新增的列"""
+        for table, column, column_type in (('messages', 'tokens', 'INTEGER'),
+                                           ('conversations', 'summary', 'TEXT')):
+            columns = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+            if column not in columns:
+                try:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+                except sqlite3.OperationalError:
+                    # 其他进程已经添加
+                    pass
+
+    @staticmethod
+    def _conversation_from_row(row: sqlite3.Row) -> Dict:
+        conversation = {
+            'id': row['id'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+            'messages': []
+        }
+        if row['summary']:
+            conversation['summary'] = json.loads(row['summary'])
+        return conversation
+
+    @staticmethod
+    def _message_from_row(row: sqlite3.Row) -> Message:
+        return Message(row['role'], row['content'], row['timestamp'], row['tokens'], row['reasoning_content'])
+
+    def load(self):
+        conn = self._connect()
+        count = conn.execute('SELECT COUNT(*) FROM conversations').fetchone()[0]
+        logger.info(f"SQLite 存储中共有 {count} 个对话历史")
+
+    def get_conversation(self, conversation_id: str) -> Optional[Dict]:
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT id, created_at, updated_at, summary FROM conversations WHERE id = ?',
+            (conversation_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        conversation = self._conversation_from_row(row)
+        conversation['messages'] = [
+            self._message_from_row(r) for r in conn.execute(
+                'SELECT * FROM messages WHERE conversation_id = ? ORDER BY id',
+                (conversation_id,)
+            )
+        ]
+        return conversation
+
+    def get_conversations(self) -> List[Dict]:
+        conn = self._connect()
+        result = {}
+        for row in conn.execute(
+                'SELECT id, created_at, updated_at, summary FROM conversations ORDER BY updated_at DESC'):
+            result[row['id']] = self._conversation_from_row(row)
+        for row in conn.execute('SELECT * FROM messages ORDER BY conversation_id, id'):
+            conversation = result.get(row['conversation_id'])
+            if conversation is not None:
+                conversation['messages'].append(self._message_from_row(row))
+        return list(result.values())
+
+    SUMMARY_SQL = (
+        'SELECT c.id, c.created_at, c.updated_at, '
+        '(SELECT content FROM messages m WHERE m.conversation_id = c.id ORDER BY m.id LIMIT 1) AS first_content, '
+        '(SELECT COUNT(*) FROM messages m WHERE m.conversation_id = c.id) AS message_count '
+        'FROM conversations c '
+    )
+
+    @staticmethod
+    def _summary_from_row(row) -> Dict:
+        return {
+            'id': row['id'],
+            'title': conversation_title(row['first_content']),
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+            'message_count': row['message_count']
+        }
+
+    def list_summaries(self, limit: int, before: Optional[Tuple[str, str]] = None) -> List[Dict]:
+        conn = self._connect()
+        sql = self.SUMMARY_SQL
+        params: list = []
+        if before:
+            sql += 'WHERE (c.updated_at, c.id) < (?, ?) '
+            params.extend(before)
+        sql += 'ORDER BY c.updated_at DESC, c.id DESC LIMIT ?'
+        params.append(limit)
+        return [self._summary_from_row(row) for row in conn.execute(sql, params)]
+
+    def get_summaries(self, conversation_ids: Iterable[str]) -> Dict[str, Dict]:
+        conversation_ids = list(conversation_ids)
+        if not conversation_ids:
+            return {}
+        sql = self.SUMMARY_SQL + 'WHERE c.id IN ({})'.format(', '.join('?' * len(conversation_ids)))
+        return {row['id']: self._summary_from_row(row) for row in self._connect().execute(sql, conversation_ids)}
+
+    def get_messages(self, conversation_id: str, positions: Iterable[int]) -> Dict[int, Dict]:
+        conn = self._connect()
+        result = {}
+        for position in positions:
+            if position < 0:
+                continue
+            row = conn.execute(
+                'SELECT * FROM messages WHERE conversation_id = ? ORDER BY id LIMIT 1 OFFSET ?',
+                (conversation_id, position)
+            ).fetchone()
+            if row is not None:
+                result[position] = self._message_from_row(row)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        conn = self._connect()
+        conversations = conn.execute('SELECT COUNT(*) FROM conversations').fetchone()[0]
+        messages, history_bytes = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM('
+            'LENGTH(CAST(content AS BLOB)) + COALESCE(LENGTH(CAST(reasoning_content AS BLOB)), 0)), 0) '
+            'FROM messages'
+        ).fetchone()
+        # 正文都在数据库中，进程内不常驻
+        return {'conversations': conversations, 'messages': messages, 'history_bytes': history_bytes,
+                'resident_conversations': 0, 'resident_bytes': 0}
+
+    def create_conversation(self, conversation: Dict):
+        conn = self._connect()
+        conn.execute(
+            'INSERT INTO conversations (id, created_at, updated_at) VALUES (?, ?, ?)',
+            (conversation['id'], conversation['created_at'], conversation['updated_at'])
+        )
+
+    def add_message(self, conversation_id: str, message: Dict, updated_at: str) -> bool:
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = conn.execute(
+                'UPDATE conversations SET updated_at = ? WHERE id = ?',
+                (updated_at, conversation_id)
+            )
+            if cursor.rowcount == 0:
+                conn.execute('ROLLBACK')
+                return False
+            cursor = conn.execute(
+                'INSERT INTO messages (conversation_id, role, content, reasoning_content, timestamp, tokens) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (conversation_id, message['role'], message['content'],
+                 message.get('reasoning_content'), message['timestamp'], message.get('tokens'))
+            )
+            if self.full_text:
+                conn.execute(
+                    'INSERT INTO message_terms (rowid, terms) VALUES (?, ?)',
+                    (cursor.lastrowid, self._terms(message['content']))
+                )
+            conn.execute('COMMIT')
+            return True
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete_conversation(self, conversation_id: str) -> bool:
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = conn.execute('DELETE FROM conversations WHERE id = ?', (conversation_id,))
+            if self.full_text:
+                conn.execute(
+                    'DELETE FROM message_terms WHERE rowid IN '
+                    '(SELECT id FROM messages WHERE conversation_id = ?)', (conversation_id,)
+                )
+            conn.execute('DELETE FROM messages WHERE conversation_id = ?', (conversation_id,))
+            conn.execute('COMMIT')
+            return cursor.rowcount > 0
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete_conversations(self, conversation_ids: Iterable[str], updated_before: Optional[str] = None) -> List[str]:
+        ids = list(conversation_ids)
+        if not ids:
+            return []
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS evict_ids (id TEXT PRIMARY KEY)')
+            conn.execute('DELETE FROM evict_ids')
+            conn.executemany('INSERT OR IGNORE INTO evict_ids (id) VALUES (?)', [(cid,) for cid in ids])
+            if updated_before is not None:
+                # 选出之后又有新消息的会话不删除
+                conn.execute(
+                    'DELETE FROM evict_ids WHERE id IN '
+                    '(SELECT id FROM conversations WHERE updated_at > ?)', (updated_before,)
+                )
+            deleted = [row[0] for row in conn.execute(
+                'SELECT id FROM conversations WHERE id IN (SELECT id FROM evict_ids)'
+            )]
+            conn.execute('DELETE FROM conversations WHERE id IN (SELECT id FROM evict_ids)')
+            if self.full_text:
+                conn.execute(
+                    'DELETE FROM message_terms WHERE rowid IN '
+                    '(SELECT id FROM messages WHERE conversation_id IN (SELECT id FROM evict_ids))'
+                )
+            conn.execute('DELETE FROM messages WHERE conversation_id IN (SELECT id FROM evict_ids)')
+            conn.execute('DELETE FROM evict_ids')
+            conn.execute('COMMIT')
+            return deleted
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def iter_conversations(self) -> Iterator[Dict]:
+        ids = [row[0] for row in self._connect().execute('SELECT id FROM conversations')]
+        for conversation_id in ids:
+            conversation = self.get_conversation(conversation_id)
+            if conversation is not None:
+                yield conversation
+
+    def conversation_sizes(self) -> List[Tuple[str, str, int]]:
+        conn = self._connect()
+        return [
+            (row[0], row[1], row[2]) for row in conn.execute(
+                'SELECT c.updated_at, c.id, COALESCE(SUM('
+                'LENGTH(CAST(m.content AS BLOB)) + COALESCE(LENGTH(CAST(m.reasoning_content AS BLOB)), 0)'
+                '), 0) FROM conversations c LEFT JOIN messages m ON m.conversation_id = c.id GROUP BY c.id'
+            )
+        ]
+
+    def set_summary(self, conversation_id: str, summary: Dict) -> bool:
+        conn = self._connect()
+        cursor = conn.execute(
+            'UPDATE conversations SET summary = ? WHERE id = ?',
+            (json.dumps(summary, ensure_ascii=False), conversation_id)
+        )
+        return cursor.rowcount > 0
+
+    def search_messages(self, query: str, limit: int) -> List[Tuple[str, int, float]]:
+        """FTS5 全文检索，返回按 BM25 得分排序的 (会话 id, 消息序号, 得分)"""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        expression = ' OR '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+        conn = self._connect()
+        rows = conn.execute(
+            'SELECT m.conversation_id, m.id, bm25(message_terms) AS rank FROM message_terms '
+            'JOIN messages m ON m.id = message_terms.rowid '
+            'WHERE message_terms MATCH ? ORDER BY rank LIMIT ?',
+            (expression, limit)
+        ).fetchall()
+        hits = []
+        for conversation_id, message_id, rank in rows:
+            position = conn.execute(
+                'SELECT COUNT(*) FROM messages WHERE conversation_id = ? AND id < ?',
+                (conversation_id, message_id)
+            ).fetchone()[0]
+            # FTS5 的 bm25() 越小越相关，取反后与内存索引的得分方向一致
+            hits.append((conversation_id, position, -rank))
+        return hits
+
+    def search_index_size(self) -> int:
+        return self._connect().execute('SELECT COUNT(*) FROM message_terms').fetchone()[0]
+
+    def rebuild_search_index(self):
+        """按 messages 表重建 message_terms；其他进程已经重建好时跳过"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            indexed = conn.execute('SELECT COUNT(*) FROM message_terms').fetchone()[0]
+            messages = conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+            if indexed != messages:
+                conn.execute('DELETE FROM message_terms')
+                last_id = 0
+                while True:
+                    rows = conn.execute(
+                        'SELECT id, content FROM messages WHERE id > ? ORDER BY id LIMIT 1000', (last_id,)
+                    ).fetchall()
+                    if not rows:
+                        break
+                    conn.executemany(
+                        'INSERT INTO message_terms (rowid, terms) VALUES (?, ?)',
+                        [(row[0], self._terms(row[1])) for row in rows]
+                    )
+                    last_id = rows[-1][0]
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def compact(self):
+        """合并 WAL 到主库"""
+        self._connect().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def create_conversation_store(backend: str, **kwargs) -> ConversationStore:
+    """根据配置创建对话存储后端"""
+    if backend == 'journal':
+        return JournaledConversationStore(
+            kwargs['snapshot_path'],
+            journal_path=kwargs.get('journal_path'),
+            compact_threshold=kwargs.get('compact_threshold', 500),
+            fsync=kwargs.get('fsync', False),
+            memory_budget=kwargs.get('memory_budget', 0)
+        )
+    if backend == 'sqlite':
+        return SQLiteConversationStore(kwargs['db_path'])
+    raise ValueError(f"未知的存储后端: {backend}")
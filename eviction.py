@@ -0,0 +1,44 @@
+import datetime
+import heapq
+from dataclasses import dataclass
+from typing import Iterable, List, Tuple
+
+
+@dataclass
+class EvictionPolicy:
+    """对话淘汰策略，各项为 0 表示不限制"""
+    max_count: int = 0  # 最多保留的会话数
+    max_age: float = 0  # 最久未更新的秒数
+    max_bytes: int = 0  # 全部历史的总字节数
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_count or self.max_age or self.max_bytes)
+
+
+def select_victims(entries: Iterable[Tuple[str, str, int]], policy: EvictionPolicy,
+                   now: datetime.datetime) -> List[str]:
+    """从最久未更新的会话开始，一次遍历同时满足年龄、数量和字节数限制
+
+    entries 为 (updated_at, id, 字节数)。建堆 O(n)，每淘汰一个 O(log n)；
+    堆顶不再超限时后面的会话都更新，直接停止。
+    """
+    heap = list(entries)
+    heapq.heapify(heap)
+    count = len(heap)
+    total = sum(size for _, _, size in heap)
+    cutoff = (now - datetime.timedelta(seconds=policy.max_age)).isoformat() if policy.max_age else None
+
+    victims = []
+    while heap:
+        updated_at, conversation_id, size = heap[0]
+        expired = cutoff is not None and updated_at < cutoff
+        over_count = policy.max_count and count > policy.max_count
+        over_bytes = policy.max_bytes and total > policy.max_bytes
+        if not (expired or over_count or over_bytes):
+            break
+        heapq.heappop(heap)
+        victims.append(conversation_id)
+        count -= 1
+        total -= size
+    return victims
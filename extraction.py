@@ -0,0 +1,147 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ExtractedDocument:
+    """文档提取结果，pages 按页（或段落块）保存文本"""
+    pages: List[str] = field(default_factory=list)
+    truncated: bool = False
+    cached: bool = False
+    sha256: str = ''
+
+    @property
+    def text(self) -> str:
+        return '\n'.join(self.pages)
+
+
+def _extract_worker(data: bytes, ext: str, max_chars: int) -> Tuple[List[str], bool]:
+    """在子进程中逐页提取文本，超过 max_chars 后不再解析后续页面"""
+    pages = []
+    total = 0
+
+    def take(text: str) -> bool:
+        nonlocal total
+        remaining = max_chars - total
+        if len(text) > remaining:
+            pages.append(text[:remaining])
+            total = max_chars
+            return False
+        pages.append(text)
+        total += len(text)
+        return True
+
+    if ext == 'pdf':
+        import PyPDF2
+        reader = PyPDF2.PdfReader(io.BytesIO(data))
+        for page in reader.pages:
+            if not take(page.extract_text() or ''):
+                return pages, True
+        return pages, False
+    if ext in ('doc', 'docx'):
+        from docx import Document
+        doc = Document(io.BytesIO(data))
+        for paragraph in doc.paragraphs:
+            if not take(paragraph.text):
+                return pages, True
+        return pages, False
+    text = data.decode('utf-8', errors='replace')
+    return [text[:max_chars]], len(text) > max_chars
+
+
+class DocumentExtractor:
+    """文档提取服务：进程池解析 PDF/DOCX/文本，按文件内容 SHA-256 缓存结果"""
+
+    def __init__(self, cache_dir: str, max_workers: int = 2, max_chars: int = 200000,
+                 max_pending: int = 8, timeout: float = 120.0):
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.max_chars = max_chars
+        self.timeout = timeout
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def _cache_path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.cache_dir, f"{digest}.{ext}.json")
+
+    def _read_cache(self, path: str) -> Optional[dict]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning(f"提取缓存损坏，重新提取: {path}")
+            return None
+
+    def _write_cache(self, path: str, pages: List[str], truncated: bool):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'pages': pages, 'truncated': truncated}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def extract(self, data: bytes, filename: str) -> ExtractedDocument:
+        """提取文件文本，相同内容的文件直接命中磁盘缓存"""
+        ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else 'txt'
+        digest = hashlib.sha256(data).hexdigest()
+        cache_path = self._cache_path(digest, ext)
+
+        cached = self._read_cache(cache_path)
+        if cached is not None:
+            return ExtractedDocument(cached['pages'], cached['truncated'], cached=True, sha256=digest)
+
+        # 限制排队数量，避免大量上传把进程池队列撑爆
+        if not self._pending.acquire(timeout=self.timeout):
+            raise RuntimeError('文档提取队列已满，请稍后再试')
+        try:
+            executor = self._get_executor()
+            future = executor.submit(_extract_worker, data, ext, self.max_chars)
+            try:
+                pages, truncated = future.result(timeout=self.timeout)
+            except FutureTimeout:
+                # 还在排队就直接取消；已在运行的无法中断，回收整个进程池，免得卡住的进程一直占着名额
+                if not future.cancel():
+                    logger.warning(f"文档提取超时，回收提取进程: {filename}")
+                    self._recycle(executor)
+                raise
+        finally:
+            self._pending.release()
+
+        try:
+            self._write_cache(cache_path, pages, truncated)
+        except OSError as e:
+            logger.error(f"写入提取缓存失败: {str(e)}")
+        return ExtractedDocument(pages, truncated, cached=False, sha256=digest)
+
+    def _recycle(self, executor: ProcessPoolExecutor):
+        """终止进程池的工作进程，下次提取时新建；池中其他进行中的任务会失败"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        processes = list((getattr(executor, '_processes', None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
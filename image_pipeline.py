@@ -0,0 +1,227 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from resize_images import fit_image
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tif', '.tiff'}
+
+EXIF_ORIENTATION = 0x0112
+
+# 变体名 -> (文件名, 保存格式, 保存参数)
+VARIANTS = {
+    'large': ('large.jpg', 'JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+    'large_webp': ('large.webp', 'WEBP', {'quality': 80, 'method': 4}),
+    'thumb': ('thumb.webp', 'WEBP', {'quality': 75, 'method': 4}),
+}
+
+
+@dataclass
+class ProcessedImage:
+    """图片预处理结果，variants 为 变体名 -> 缓存中的文件路径"""
+    sha256: str
+    format: str
+    width: int
+    height: int
+    sizes: Dict[str, Tuple[int, int]] = field(default_factory=dict)
+    variants: Dict[str, str] = field(default_factory=dict)
+    cached: bool = False
+
+
+def _process_worker(data: bytes, out_dir: str, max_side: int, thumb_size: int) -> dict:
+    """在子进程中解码一次，依次生成各个变体，最后写 meta.json 作为完成标记"""
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as img:
+        source_format = img.format or ''
+        # 原图尺寸要在 draft() 之前读取，draft 之后 size 变为缩小后的尺寸
+        width, height = img.size
+        # 手机照片的方向记录在 EXIF 中，5–8 表示需要旋转 90°，宽高互换
+        if img.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+            width, height = height, width
+        # JPEG 可以在解码时直接按 1/2、1/4、1/8 缩小，手机大图省掉大部分解码开销
+        img.draft('RGB', (max_side, max_side))
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ('RGBA', 'LA', 'P'):
+            # 透明区域铺白底，避免转 RGB 后变黑
+            rgba = img.convert('RGBA')
+            background = Image.new('RGB', rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            img = background
+
+        large = fit_image(img, (max_side, max_side), pad=False)
+        thumb = fit_image(large, (thumb_size, thumb_size), pad=False)
+        images = {'large': large, 'large_webp': large, 'thumb': thumb}
+
+        os.makedirs(out_dir, exist_ok=True)
+        sizes = {}
+        for name, (filename, fmt, params) in VARIANTS.items():
+            path = os.path.join(out_dir, filename)
+            images[name].save(f"{path}.tmp", fmt, **params)
+            os.replace(f"{path}.tmp", path)
+            sizes[name] = images[name].size
+
+    meta = {'format': source_format, 'width': width, 'height': height, 'sizes': sizes}
+    meta_path = os.path.join(out_dir, 'meta.json')
+    with open(f"{meta_path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(f"{meta_path}.tmp", meta_path)
+    return meta
+
+
+def find_images(paths: Iterable[str]) -> List[str]:
+    """展开文件和目录（递归），返回图片文件列表"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(
+                    os.path.join(root, name) for name in sorted(names)
+                    if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+                )
+        elif os.path.isfile(path):
+            files.append(path)
+    return files
+
+
+class ImagePipeline:
+    """图片预处理服务：进程池缩放并生成缩略图和 WebP，按内容 SHA-256 缓存变体
+
+    相同内容的图片只处理一次：磁盘上已有变体直接返回，正在处理的同一张图片
+    共享同一个任务。
+    """
+
+    def __init__(self, cache_dir: str, max_workers: int = 2, max_side: int = 1568,
+                 thumb_size: int = 256, max_pending: int = 8, timeout: float = 120.0):
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.max_side = max_side
+        self.thumb_size = thumb_size
+        self.timeout = timeout
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def variant_dir(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def variant_path(self, digest: str, name: str) -> Optional[str]:
+        """变体文件路径，变体名未知时返回 None"""
+        if name not in VARIANTS:
+            return None
+        return os.path.join(self.variant_dir(digest), VARIANTS[name][0])
+
+    def _result(self, digest: str, meta: dict, cached: bool) -> ProcessedImage:
+        return ProcessedImage(
+            sha256=digest,
+            format=meta['format'],
+            width=meta['width'],
+            height=meta['height'],
+            sizes={name: tuple(size) for name, size in meta['sizes'].items()},
+            variants={name: self.variant_path(digest, name) for name in VARIANTS},
+            cached=cached
+        )
+
+    def _read_meta(self, digest: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.variant_dir(digest), 'meta.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning(f"图片缓存损坏，重新处理: {digest}")
+            return None
+
+    def _submit(self, digest: str, data: bytes) -> Future:
+        """提交处理任务；同一张图片已在处理中时返回已有任务"""
+        executor = self._get_executor()
+        with self._lock:
+            future = self._in_flight.get(digest)
+            if future is not None:
+                return future
+            future = executor.submit(
+                _process_worker, data, self.variant_dir(digest), self.max_side, self.thumb_size
+            )
+            self._in_flight[digest] = future
+        future.add_done_callback(lambda _: self._forget(digest))
+        return future
+
+    def _forget(self, digest: str):
+        with self._lock:
+            self._in_flight.pop(digest, None)
+
+    def process(self, data: bytes) -> ProcessedImage:
+        """预处理一张图片，相同内容直接命中磁盘缓存"""
+        digest = hashlib.sha256(data).hexdigest()
+        meta = self._read_meta(digest)
+        if meta is not None:
+            return self._result(digest, meta, cached=True)
+
+        # 限制排队数量，避免大量上传把进程池队列撑爆
+        if not self._pending.acquire(timeout=self.timeout):
+            raise RuntimeError('图片处理队列已满，请稍后再试')
+        try:
+            future = self._submit(digest, data)
+            meta = future.result(timeout=self.timeout)
+        finally:
+            self._pending.release()
+        return self._result(digest, meta, cached=False)
+
+    def _start_file(self, path: str) -> Tuple[Optional[str], object]:
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            return None, e
+        digest = hashlib.sha256(data).hexdigest()
+        meta = self._read_meta(digest)
+        if meta is not None:
+            return digest, self._result(digest, meta, cached=True)
+        return digest, self._submit(digest, data)
+
+    def _finish_file(self, digest: Optional[str], job: object) -> object:
+        if not isinstance(job, Future):
+            return job
+        try:
+            return self._result(digest, job.result(), cached=False)
+        except Exception as e:
+            return e
+
+    def process_files(self, paths: Iterable[str]) -> Iterator[Tuple[str, object]]:
+        """批量处理文件，按输入顺序产出 (路径, ProcessedImage 或异常)
+
+        提交窗口为进程数的两倍：进程池保持满载，同时内存中最多只有窗口内的文件。
+        """
+        window = deque()
+        limit = self.max_workers * 2
+        for path in paths:
+            window.append((path,) + self._start_file(path))
+            if len(window) > limit:
+                path, digest, job = window.popleft()
+                yield path, self._finish_file(digest, job)
+        while window:
+            path, digest, job = window.popleft()
+            yield path, self._finish_file(digest, job)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,140 @@
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+import httpx
+import openai
+
+logger = logging.getLogger(__name__)
+
+
+def _http2_available() -> bool:
+    """检查是否安装了 HTTP/2 依赖（h2）"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _connect_timer(scheme: str, on_connect: Callable[[float], None]):
+    """生成 httpcore trace 回调，新建连接时报告 TCP（+TLS）建连耗时"""
+    final_event = 'connection.start_tls.complete' if scheme == 'https' else 'connection.connect_tcp.complete'
+    started = []
+
+    def trace(event_name, info):
+        if event_name == 'connection.connect_tcp.started':
+            started.append(time.perf_counter())
+        elif event_name == final_event and started:
+            on_connect(time.perf_counter() - started.pop())
+
+    return trace
+
+
+class LLMClientManager:
+    """进程级共享的上游客户端，复用 keep-alive 连接池"""
+
+    def __init__(self, api_key: Optional[str], base_url: Optional[str],
+                 max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 30.0, connect_timeout: float = 10.0,
+                 read_timeout: float = 1800.0, http2: bool = False,
+                 on_connect: Optional[Callable[[float], None]] = None,
+                 max_retries: int = openai.DEFAULT_MAX_RETRIES):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.http2 = http2
+        if http2 and not _http2_available():
+            logger.warning("未安装 h2，HTTP/2 已禁用，回退到 HTTP/1.1")
+            self.http2 = False
+        self.on_connect = on_connect  # 新建上游连接时回调建连耗时（秒）
+        self.max_retries = max_retries  # SDK 内部重试次数，由外层路由重试时设为 0
+        self._client = None
+        self._http_client = None
+        self._async_client = None
+        self._async_http_client = None
+        self._lock = threading.Lock()
+
+    def _trace_request(self, request: httpx.Request):
+        if 'trace' not in request.extensions:
+            request.extensions['trace'] = _connect_timer(request.url.scheme, self.on_connect)
+
+    async def _atrace_request(self, request: httpx.Request):
+        if 'trace' not in request.extensions:
+            trace = _connect_timer(request.url.scheme, self.on_connect)
+
+            async def atrace(event_name, info):
+                trace(event_name, info)
+
+            request.extensions['trace'] = atrace
+
+    def get_client(self) -> openai.OpenAI:
+        """获取共享客户端，首次调用时创建"""
+        client = self._client
+        if client is not None:
+            return client
+        with self._lock:
+            if self._client is None:
+                self._http_client = httpx.Client(
+                    timeout=self.timeout,
+                    limits=self.limits,
+                    http2=self.http2,
+                    follow_redirects=True,
+                    event_hooks={'request': [self._trace_request] if self.on_connect else []}
+                )
+                self._client = openai.OpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    max_retries=self.max_retries,
+                    http_client=self._http_client
+                )
+                logger.info("已创建共享上游客户端 (http2=%s)", self.http2)
+            return self._client
+
+    def get_async_client(self) -> openai.AsyncOpenAI:
+        """获取异步客户端，供 ASGI 模式使用（绑定到首次调用时的事件循环）"""
+        client = self._async_client
+        if client is not None:
+            return client
+        with self._lock:
+            if self._async_client is None:
+                self._async_http_client = httpx.AsyncClient(
+                    timeout=self.timeout,
+                    limits=self.limits,
+                    http2=self.http2,
+                    follow_redirects=True,
+                    event_hooks={'request': [self._atrace_request] if self.on_connect else []}
+                )
+                self._async_client = openai.AsyncOpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    max_retries=self.max_retries,
+                    http_client=self._async_http_client
+                )
+                logger.info("已创建共享异步上游客户端 (http2=%s)", self.http2)
+            return self._async_client
+
+    async def aclose(self):
+        """关闭异步连接池，在 ASGI lifespan 结束时调用"""
+        http_client = self._async_http_client
+        self._async_client = None
+        self._async_http_client = None
+        if http_client is not None:
+            await http_client.aclose()
+
+    def close(self):
+        """关闭连接池，进程退出时调用"""
+        with self._lock:
+            if self._http_client is not None:
+                try:
+                    self._http_client.close()
+                except Exception as e:
+                    logger.error(f"关闭上游客户端失败: {str(e)}")
+            self._client = None
+            self._http_client = None
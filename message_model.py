@@ -0,0 +1,131 @@
+import datetime
+import sys
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+# 常见角色预先驻留，所有消息共享同一个字符串对象
+ROLES = {role: sys.intern(role) for role in ('system', 'user', 'assistant')}
+
+_OPTIONAL = ('tokens', 'reasoning_content')
+
+
+def intern_role(role: str) -> str:
+    return ROLES.get(role) or sys.intern(role)
+
+
+def to_epoch(value: Union[str, float, int, None]) -> float:
+    """ISO 时间字符串（本地时间）或秒数转为 epoch 秒"""
+    if value is None:
+        return datetime.datetime.now().timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def to_iso(epoch: float) -> str:
+    """epoch 秒转为与 datetime.now().isoformat() 相同格式的字符串"""
+    return datetime.datetime.fromtimestamp(epoch).isoformat()
+
+
+class Message:
+    """一条历史消息：__slots__ 对象，角色驻留，时间戳存为 epoch 浮点数
+
+    同时支持字典式读取（message['role']、message.get('tokens')），'timestamp'
+    按需转回 ISO 字符串，现有代码和 JSON 接口看到的字段与原来的 dict 一致。
+    落盘时用 to_compact() 写成紧凑数组 [role, content, created, tokens, reasoning_content]。
+    """
+
+    __slots__ = ('role', 'content', 'created', 'tokens', 'reasoning_content')
+
+    FIELDS = ('role', 'content', 'timestamp', 'tokens', 'reasoning_content')
+
+    def __init__(self, role: str, content: str, created: Optional[float] = None,
+                 tokens: Optional[int] = None, reasoning_content: Optional[str] = None):
+        self.role = intern_role(role)
+        self.content = content
+        self.created = to_epoch(created)
+        self.tokens = tokens
+        self.reasoning_content = reasoning_content or None
+
+    @property
+    def timestamp(self) -> str:
+        return to_iso(self.created)
+
+    # ---- 字典兼容 ----
+
+    def __getitem__(self, key: str) -> Any:
+        if key == 'timestamp':
+            return self.timestamp
+        if key not in self.__slots__ or key == 'created':
+            raise KeyError(key)
+        value = getattr(self, key)
+        if value is None and key in _OPTIONAL:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key: str, value: Any):
+        if key == 'timestamp':
+            self.created = to_epoch(value)
+        elif key == 'role':
+            self.role = intern_role(value)
+        elif key in ('content', 'tokens', 'reasoning_content'):
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        return self.get(key) is not None if key in self.FIELDS else False
+
+    def keys(self) -> List[str]:
+        return [key for key in self.FIELDS if key in self]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Message):
+            return self.to_compact() == other.to_compact()
+        return isinstance(other, dict) and self.to_dict() == other
+
+    def __repr__(self) -> str:
+        return f"Message({self.role!r}, {self.content[:20]!r}, {self.timestamp})"
+
+    # ---- 序列化 ----
+
+    def to_dict(self) -> Dict[str, Any]:
+        """接口返回的格式，与原来的消息 dict 相同；tokens 只是内部缓存，不返回给客户端"""
+        message = {'role': self.role, 'content': self.content, 'timestamp': self.timestamp}
+        if self.reasoning_content:
+            message['reasoning_content'] = self.reasoning_content
+        return message
+
+    def to_compact(self) -> list:
+        """落盘格式，省去重复的键名，末尾的空字段不写"""
+        if self.reasoning_content:
+            return [self.role, self.content, self.created, self.tokens, self.reasoning_content]
+        if self.tokens is not None:
+            return [self.role, self.content, self.created, self.tokens]
+        return [self.role, self.content, self.created]
+
+    @classmethod
+    def load(cls, data: Union['Message', list, Dict[str, Any]]) -> 'Message':
+        """从紧凑数组、旧版 dict 或 Message 构造"""
+        if isinstance(data, Message):
+            return data
+        if isinstance(data, list):
+            return cls(*data)
+        return cls(data['role'], data.get('content') or '', data.get('timestamp'),
+                   data.get('tokens'), data.get('reasoning_content'))
+
+
+def load_messages(messages: List[Any]) -> List[Message]:
+    return [Message.load(m) for m in messages]
+
+
+def compact_messages(messages: List[Message]) -> List[list]:
+    return [m.to_compact() for m in messages]
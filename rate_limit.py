@@ -0,0 +1,260 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+
+class UpstreamBusyError(RuntimeError):
+    """上游并发已满且等待队列也已满（或等待超时）"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """令牌桶：以 rate 个/秒补充，最多 capacity 个"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self, cost: float = 1.0) -> Tuple[bool, float]:
+        """取令牌，不阻塞；失败时返回需要等待的秒数"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True, 0.0
+        return False, (cost - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """按键（IP、会话 ID 等）维护令牌桶，最久未用的键超出上限后被丢弃"""
+
+    def __init__(self, per_minute: float, burst: float, max_keys: int = 10000):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def check(self, key: str) -> Tuple[bool, float]:
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            allowed, retry_after = bucket.try_acquire()
+            if not allowed:
+                self.rejected += 1
+            return allowed, retry_after
+
+
+class AdmissionController:
+    """上游并发闸门：最多 max_concurrent 个调用同时进行，其余按优先级 + 先来先到排队
+
+    priority 越小越优先。队列满或等待超时时抛出 UpstreamBusyError。
+    线程用 acquire() 在条件变量上等待；协程用 acquire_async() 等待自己的 future，
+    名额在 release() 时直接分配给排在队首的协程，不占用线程。
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, timeout: float = 60.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self._waiters = []  # (priority, seq)
+        self._async_waiters = {}  # (priority, seq) -> (loop, future, 开始等待的时间)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, priority: int = 0):
+        start = time.monotonic()
+        with self._cond:
+            if self.active < self.max_concurrent and not self._waiters:
+                self._admit(0.0)
+                return
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                raise UpstreamBusyError('上游繁忙，请稍后再试', retry_after=self._estimate_wait())
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiters, entry)
+            deadline = start + self.timeout
+            try:
+                while not (self.active < self.max_concurrent and self._waiters[0] == entry):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise UpstreamBusyError('等待上游超时，请稍后再试', retry_after=self._estimate_wait())
+                    self._cond.wait(remaining)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                # 队首变化后唤醒其他等待者
+                self._wake()
+            self._admit(time.monotonic() - start)
+
+    async def acquire_async(self, priority: int = 0):
+        """acquire() 的协程版本；等待中被取消或超时都不会占用名额"""
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self.active < self.max_concurrent and not self._waiters:
+                self._admit(0.0)
+                return
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                raise UpstreamBusyError('上游繁忙，请稍后再试', retry_after=self._estimate_wait())
+            entry = (priority, next(self._seq))
+            future = loop.create_future()
+            heapq.heappush(self._waiters, entry)
+            self._async_waiters[entry] = (loop, future, start)
+        try:
+            await asyncio.wait_for(future, self.timeout)
+        except BaseException as e:
+            with self._cond:
+                granted = self._async_waiters.pop(entry, None) is None
+                if not granted:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._wake()
+            # 名额已分配但调用方不再需要：结果已送达时在这里归还，否则由 _grant 归还
+            if granted and future.done() and not future.cancelled():
+                self.release()
+            if isinstance(e, asyncio.TimeoutError):
+                with self._cond:
+                    self.rejected += 1
+                raise UpstreamBusyError('等待上游超时，请稍后再试', retry_after=self._estimate_wait()) from None
+            raise
+
+    def _wake(self):
+        """队首或名额变化后调用，调用方需持有锁：把空出的名额分给排在队首的协程，并唤醒等待的线程"""
+        while self._waiters and self.active < self.max_concurrent:
+            head = self._waiters[0]
+            waiter = self._async_waiters.pop(head, None)
+            if waiter is None:
+                # 队首是线程，由它自己在 acquire() 中占用名额
+                break
+            heapq.heappop(self._waiters)
+            loop, future, start = waiter
+            self._admit(time.monotonic() - start)
+            loop.call_soon_threadsafe(self._grant, future)
+        self._cond.notify_all()
+
+    def _grant(self, future: asyncio.Future):
+        """在协程所在的事件循环中执行；等待方已取消时归还刚分配的名额"""
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def _admit(self, waited: float):
+        self.active += 1
+        self.admitted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def _estimate_wait(self) -> float:
+        average = self.total_wait / self.admitted if self.admitted else 1.0
+        return max(average, 1.0)
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._wake()
+
+    @contextmanager
+    def slot(self, priority: int = 0):
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return {
+                'active': self.active,
+                'queue_depth': len(self._waiters),
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'avg_wait_seconds': round(self.total_wait / self.admitted, 4) if self.admitted else 0.0,
+                'max_wait_seconds': round(self.max_wait, 4)
+            }
+
+
+class AdmittedStream:
+    """包装上游流式响应，迭代结束或关闭时归还并发名额"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+        self._released = False
+        self._lock = threading.Lock()
+
+    def _done(self):
+        # close() 可能与读取线程中的迭代结束同时发生，名额只归还一次
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._release()
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+        finally:
+            self._done()
+
+    def close(self):
+        try:
+            close = getattr(self._stream, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._done()
+
+    def __del__(self):
+        # 兜底：流从未被迭代就被丢弃时也要归还名额
+        self._done()
+
+
+class AsyncAdmittedStream(AdmittedStream):
+    """AdmittedStream 的异步版本"""
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        finally:
+            self._done()
+
+    async def aclose(self):
+        try:
+            close = getattr(self._stream, 'close', None)
+            if close is not None:
+                result = close()
+                if hasattr(result, '__await__'):
+                    await result
+        finally:
+            self._done()
@@ -1,56 +1,94 @@
 from PIL import Image
+import argparse
 import os
 
+def fit_image(img, size=(100, 100), pad=True):
+    """
+    按比例缩放到 size 以内；pad 为 True 时居中贴到白色背景上，输出正好为 size
+    """
+    # 转换为RGB模式（如果是RGBA，去除透明通道）
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    # 计算新的尺寸，保持纵横比（不填充背景时只缩小不放大）
+    ratio = min(size[0] / img.width, size[1] / img.height)
+    if not pad:
+        ratio = min(ratio, 1.0)
+    new_size = (max(1, round(img.width * ratio)), max(1, round(img.height * ratio)))
+
+    # 调整大小
+    if new_size != img.size:
+        img = img.resize(new_size, Image.Resampling.LANCZOS)
+    if not pad:
+        return img
+
+    # 创建一个新的白色背景图片
+    background = Image.new('RGB', size, (255, 255, 255))
+
+    # 计算粘贴位置（居中）
+    paste_x = (size[0] - new_size[0]) // 2
+    paste_y = (size[1] - new_size[1]) // 2
+
+    # 粘贴调整后的图片
+    background.paste(img, (paste_x, paste_y))
+    return background
+
 def resize_image(input_path, output_path, size=(100, 100)):
     """
     调整图片大小并保持纵横比
     """
     try:
         with Image.open(input_path) as img:
-            # 转换为RGB模式（如果是RGBA，去除透明通道）
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-            
-            # 计算新的尺寸，保持纵横比
-            ratio = min(size[0] / img.width, size[1] / img.height)
-            new_size = (int(img.width * ratio), int(img.height * ratio))
-            
-            # 调整大小
-            resized_img = img.resize(new_size, Image.Resampling.LANCZOS)
-            
-            # 创建一个新的白色背景图片
-            background = Image.new('RGB', size, (255, 255, 255))
-            
-            # 计算粘贴位置（居中）
-            paste_x = (size[0] - new_size[0]) // 2
-            paste_y = (size[1] - new_size[1]) // 2
-            
-            # 粘贴调整后的图片
-            background.paste(resized_img, (paste_x, paste_y))
-            
             # 保存
-            background.save(output_path, 'JPEG', quality=95)
+            fit_image(img, size).save(output_path, 'JPEG', quality=95)
             print(f"成功处理图片: {os.path.basename(input_path)}")
-            
+
     except Exception as e:
         print(f"处理图片时出错 {input_path}: {str(e)}")
 
-def main():
+def resize_avatars():
     # 图片目录
     static_image_dir = os.path.join('static', 'image')
-    
+
     # 确保输出目录存在
     os.makedirs(static_image_dir, exist_ok=True)
-    
+
     # 要处理的图片
     images = [
         ('image/deepseek.jpg', os.path.join(static_image_dir, 'deepseek.jpg')),
         ('image/用户.jpg', os.path.join(static_image_dir, '用户.jpg'))
     ]
-    
+
     # 处理每张图片
     for input_path, output_path in images:
         resize_image(input_path, output_path, size=(100, 100))
 
+def main():
+    parser = argparse.ArgumentParser(description='批量预处理图片：缩放、缩略图和 WebP，按内容去重缓存')
+    parser.add_argument('paths', nargs='*', help='图片文件或目录（目录递归处理）；不传时处理头像')
+    parser.add_argument('--output', default=os.path.join('uploads', 'image_cache'), help='变体缓存目录')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='进程数')
+    parser.add_argument('--max-side', type=int, default=1568, help='模型用图片的最长边')
+    parser.add_argument('--thumb-size', type=int, default=256, help='缩略图边长')
+    args = parser.parse_args()
+
+    if not args.paths:
+        resize_avatars()
+        return
+
+    from image_pipeline import ImagePipeline, find_images
+    files = find_images(args.paths)
+    pipeline = ImagePipeline(args.output, max_workers=args.workers,
+                             max_side=args.max_side, thumb_size=args.thumb_size)
+    try:
+        for path, result in pipeline.process_files(files):
+            if isinstance(result, Exception):
+                print(f"处理图片时出错 {path}: {str(result)}")
+            else:
+                status = '已缓存' if result.cached else '已处理'
+                print(f"{status} {path} -> {result.sha256[:12]} ({result.width}x{result.height})")
+    finally:
+        pipeline.shutdown()
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_messages(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """统一换行并去掉首尾空白，避免无意义的差异导致缓存未命中"""
+    return [
+        {
+            'role': msg['role'],
+            'content': (msg.get('content') or '').replace('\r\n', '\n').strip()
+        }
+        for msg in messages
+    ]
+
+
+def make_cache_key(model: str, messages: List[Dict[str, str]], **params) -> str:
+    """由模型、消息和采样参数生成缓存键"""
+    payload = {'model': model, 'messages': normalize_messages(messages), 'params': params}
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """LRU + TTL 的上游响应缓存，按条数和字节数限制内存，可选持久化到磁盘"""
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 32 * 1024 * 1024,
+                 ttl: float = 3600.0, persist_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.persist_path = persist_path
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if persist_path:
+            self.load()
+
+    @staticmethod
+    def _size(value: Dict[str, Any]) -> int:
+        """按 UTF-8 字节计算，中文回答每个字约 3 字节"""
+        return sum(len(v.encode('utf-8')) for v in value.values() if isinstance(v, str))
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                self._bytes -= size
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None):
+        size = self._size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (time.time() + (ttl or self.ttl), size, value)
+            self._bytes += size
+            # 淘汰最久未使用的条目
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def load(self):
+        """从磁盘恢复未过期的条目"""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"加载响应缓存失败: {str(e)}")
+            return
+        now = time.time()
+        with self._lock:
+            for key, expires_at, value in data:
+                if expires_at > now:
+                    size = self._size(value)
+                    self._entries[key] = (expires_at, size, value)
+                    self._bytes += size
+        logger.info(f"已加载 {len(self._entries)} 条响应缓存")
+
+    def save(self):
+        """原子写入磁盘"""
+        if not self.persist_path:
+            return
+        with self._lock:
+            data = [[key, expires_at, value] for key, (expires_at, _, value) in self._entries.items()]
+        tmp_path = f"{self.persist_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.persist_path)
+        except OSError as e:
+            logger.error(f"保存响应缓存失败: {str(e)}")
@@ -0,0 +1,173 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterator, Optional, Tuple
+
+from sse import StreamEncoder
+
+
+def parse_event_id(event_id: str) -> Optional[Tuple[str, int]]:
+    """解析 SSE 事件 id（<流 id>:<序号>），格式不对时返回 None"""
+    stream_id, _, seq = (event_id or '').strip().rpartition(':')
+    if not stream_id or not seq.isdigit():
+        return None
+    return stream_id, int(seq)
+
+
+class ResumableStream:
+    """一次生成的 SSE 帧，所有连接共享，环形缓冲最近的帧以便断线续传
+
+    不单独起线程：哪个连接需要的帧还没产生，就由它从生成器拉取下一帧。
+    最后一个连接断开后等待 grace 秒，仍无人续传就关闭生成器（随之关闭上游）；
+    grace 为 0 时立即关闭。
+    """
+
+    def __init__(self, stream_id: str, frames: Iterator[str], capacity: int = 10000,
+                 grace: float = 10.0):
+        self.stream_id = stream_id
+        self.grace = grace
+        self.done = False
+        self.cancelled = False
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self._frames = frames
+        self._buffer = deque(maxlen=capacity)  # (序号, 帧)
+        self._next_seq = 1
+        self._pulling = False
+        self._timer: Optional[threading.Timer] = None
+        self._cond = threading.Condition()
+
+    def subscribe(self, after: int = 0) -> Iterator[str]:
+        """从序号 after 之后开始读取（0 为从头），返回带 id 行的 SSE 帧
+
+        after 超过已产生的最后一帧时抛出 ValueError：客户端不可能收到过这样的事件。
+        """
+        with self._cond:
+            if after < 0 or after >= self._next_seq:
+                raise ValueError(f'续传位置 {after} 超出已产生的事件（最新为 {self._next_seq - 1}）')
+            self.subscribers += 1
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        return self._iterate(after)
+
+    def _iterate(self, after: int) -> Iterator[str]:
+        try:
+            seq = after
+            while True:
+                entry = self._get(seq + 1)
+                if entry is None:
+                    if self.cancelled:
+                        yield StreamEncoder.error('生成已取消')
+                    return
+                if entry[0] != seq + 1:
+                    # 想要的帧已被挤出缓冲区，无法无缝续传
+                    yield StreamEncoder.error('续传位置已超出缓冲范围，请重新提问')
+                    return
+                seq, frame = entry
+                yield f"id: {self.stream_id}:{seq}\n{frame}"
+        finally:
+            self._leave()
+
+    def _finish(self):
+        """调用方需持有锁"""
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._pulling = False
+        self._cond.notify_all()
+
+    def _get(self, seq: int) -> Optional[Tuple[int, str]]:
+        with self._cond:
+            while True:
+                if self._buffer and seq < self._buffer[0][0]:
+                    return self._buffer[0]
+                if seq < self._next_seq:
+                    return self._buffer[seq - self._buffer[0][0]]
+                if self.done:
+                    return None
+                if not self._pulling:
+                    self._pulling = True
+                    break
+                self._cond.wait()
+        try:
+            frame = next(self._frames)
+        except StopIteration:
+            with self._cond:
+                self._finish()
+            return None
+        except BaseException:
+            with self._cond:
+                self._finish()
+            raise
+        with self._cond:
+            entry = (self._next_seq, frame)
+            self._buffer.append(entry)
+            self._next_seq += 1
+            self._pulling = False
+            self._cond.notify_all()
+        return entry
+
+    def _leave(self):
+        with self._cond:
+            self.subscribers -= 1
+            if self.subscribers or self.done:
+                return
+            if self.grace > 0:
+                self._timer = threading.Timer(self.grace, self.cancel)
+                self._timer.daemon = True
+                self._timer.start()
+                return
+        self.cancel()
+
+    def cancel(self):
+        """没有连接时关闭生成器；生成器的 finally 负责关闭上游"""
+        with self._cond:
+            if self.subscribers or self.done or self._pulling:
+                return
+            self.cancelled = True
+            self._finish()
+        self._frames.close()
+
+
+class ResumableStreams:
+    """进行中（及刚结束）的可续传流，按流 id 查找
+
+    结束的流保留 retention 秒，断线时恰好错过结尾的客户端仍可取回剩余的帧。
+    """
+
+    def __init__(self, capacity: int = 10000, grace: float = 10.0, retention: float = 60.0):
+        self.capacity = capacity
+        self.grace = grace
+        self.retention = retention
+        self._streams: Dict[str, ResumableStream] = {}
+        self._lock = threading.Lock()
+
+    def start(self, stream_id: str, frames: Iterator[str]) -> ResumableStream:
+        stream = ResumableStream(stream_id, frames, self.capacity, self.grace)
+        with self._lock:
+            self._prune()
+            self._streams[stream_id] = stream
+        return stream
+
+    def get(self, stream_id: str) -> Optional[ResumableStream]:
+        with self._lock:
+            return self._streams.get(stream_id)
+
+    def _prune(self):
+        """调用方需持有锁"""
+        cutoff = time.monotonic() - self.retention
+        expired = [
+            stream_id for stream_id, stream in self._streams.items()
+            if stream.finished_at is not None and stream.finished_at < cutoff
+        ]
+        for stream_id in expired:
+            del self._streams[stream_id]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            streams = list(self._streams.values())
+        return {
+            'streams': len(streams),
+            'active': sum(1 for s in streams if not s.done),
+            'subscribers': sum(s.subscribers for s in streams)
+        }
@@ -0,0 +1,324 @@
+import bisect
+import heapq
+import html
+import logging
+import math
+import os
+import pickle
+import re
+import sys
+import threading
+from array import array
+from operator import itemgetter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 中日韩文字按二元组切分，其余按字母数字连续串切分
+_CJK = r'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+_TOKEN_RE = re.compile(rf'([{_CJK}]+)|([0-9a-z\u00c0-\u024f]+)')
+
+INDEX_VERSION = 1
+MAX_TF = 65535
+
+
+def tokenize(text: str) -> List[str]:
+    """中文（含日韩）切成相邻二元组，单字保留；英文和数字按词切分并转小写"""
+    tokens = []
+    for cjk, word in _TOKEN_RE.findall((text or '').lower()):
+        if cjk:
+            if len(cjk) == 1:
+                tokens.append(cjk)
+            else:
+                tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def highlight(text: str, query: str, width: int = 120) -> str:
+    """截取第一个命中附近的片段，HTML 转义后用 <mark> 标出命中的词"""
+    terms = sorted(set(tokenize(query)), key=len, reverse=True)
+    text = text or ''
+    spans = []
+    if terms:
+        parts = [
+            re.escape(t) if _TOKEN_RE.fullmatch(t).group(1) else rf'(?<![0-9a-z]){re.escape(t)}(?![0-9a-z])'
+            for t in terms
+        ]
+        for match in re.finditer('|'.join(parts), text.lower()):
+            if spans and match.start() <= spans[-1][1]:
+                spans[-1] = (spans[-1][0], max(spans[-1][1], match.end()))
+            else:
+                spans.append((match.start(), match.end()))
+    begin = max(0, spans[0][0] - width // 4) if spans else 0
+    end = min(len(text), begin + width)
+
+    pieces = ['…'] if begin > 0 else []
+    cursor = begin
+    for start, stop in spans:
+        if stop <= begin or start >= end:
+            continue
+        start, stop = max(start, begin), min(stop, end)
+        pieces.append(html.escape(text[cursor:start]))
+        pieces.append(f'<mark>{html.escape(text[start:stop])}</mark>')
+        cursor = stop
+    pieces.append(html.escape(text[cursor:end]))
+    if end < len(text):
+        pieces.append('…')
+    return ''.join(pieces).replace('\n', ' ')
+
+
+class HistorySearchIndex:
+    """对话历史的倒排索引，BM25 排序
+
+    每条消息是一个文档，按 (会话 id, 消息序号) 定位。倒排表用紧凑数组存储
+    （文档号递增追加，天然有序）；删除会话只打删除标记，保存时删除比例
+    过高才整体重排。索引定期在后台线程中持久化，启动时直接加载。
+    """
+
+    def __init__(self, path: Optional[str] = None, k1: float = 1.2, b: float = 0.75,
+                 save_every: int = 1000):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.save_every = save_every
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._changes = 0
+        self._saving = False
+        self._reset()
+
+    def _reset(self):
+        self._terms: Dict[str, Tuple[array, array]] = {}  # 词 -> (文档号, 词频)
+        self._doc_conv: List[str] = []
+        self._doc_pos = array('I')
+        self._doc_len = array('I')
+        self._deleted = bytearray()
+        self._conv_docs: Dict[str, array] = {}
+        self.live_docs = 0
+        self.total_len = 0
+
+    @property
+    def message_count(self) -> int:
+        return self.live_docs
+
+    # ---- 更新 ----
+
+    def add_message(self, conversation_id: str, content: str):
+        """把会话的下一条消息加入索引"""
+        tokens = tokenize(content)
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        with self._lock:
+            self._add(conversation_id, len(tokens), counts)
+        self._after_change()
+
+    def _add(self, conversation_id: str, length: int, counts: Dict[str, int]):
+        doc = len(self._doc_conv)
+        docs = self._conv_docs.get(conversation_id)
+        if docs is None:
+            conversation_id = sys.intern(conversation_id)
+            docs = self._conv_docs[conversation_id] = array('I')
+        self._doc_conv.append(conversation_id)
+        self._doc_pos.append(len(docs))
+        self._doc_len.append(length)
+        self._deleted.append(0)
+        docs.append(doc)
+        for term, tf in counts.items():
+            postings = self._terms.get(term)
+            if postings is None:
+                postings = self._terms[term] = (array('I'), array('H'))
+            postings[0].append(doc)
+            postings[1].append(min(tf, MAX_TF))
+        self.live_docs += 1
+        self.total_len += length
+
+    def remove_conversation(self, conversation_id: str):
+        """删除会话的全部消息（打删除标记）"""
+        with self._lock:
+            docs = self._conv_docs.pop(conversation_id, None)
+            if not docs:
+                return
+            for doc in docs:
+                self._deleted[doc] = 1
+                self.total_len -= self._doc_len[doc]
+            self.live_docs -= len(docs)
+        self._after_change()
+
+    def rebuild(self, conversations: Iterable[Dict]):
+        """从全部会话重建索引"""
+        with self._lock:
+            self._reset()
+            for conversation in conversations:
+                for message in conversation.get('messages', []):
+                    tokens = tokenize(message.get('content'))
+                    counts: Dict[str, int] = {}
+                    for token in tokens:
+                        counts[token] = counts.get(token, 0) + 1
+                    self._add(conversation['id'], len(tokens), counts)
+        logger.info(f"已重建历史搜索索引，共 {self.live_docs} 条消息、{len(self._terms)} 个词")
+        self.save()
+
+    # ---- 查询 ----
+
+    def search(self, query: str, limit: int = 20) -> List[Tuple[str, int, float]]:
+        """返回按 BM25 得分排序的 (会话 id, 消息序号, 得分)"""
+        terms = set(tokenize(query))
+        with self._lock:
+            if not terms or not self.live_docs:
+                return []
+            n = self.live_docs
+            avgdl = self.total_len / n or 1.0
+            k1, b = self.k1, self.b
+            postings = sorted(
+                (self._terms[t] for t in terms if t in self._terms), key=lambda p: len(p[0])
+            )
+            deleted = self._deleted
+            doc_len = self._doc_len
+            idfs = [math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5)) for ids, _ in postings]
+            # 单个词的得分上界是 idf * (k1 + 1)；尚未进入候选集的文档只能从剩余的词得分
+            bounds = [idf * (k1 + 1) for idf in idfs]
+            for i in range(len(bounds) - 2, -1, -1):
+                bounds[i] += bounds[i + 1]
+            scores: Dict[int, float] = {}
+            # 从最稀有的词开始；高频词的倒排表远长于候选集、且新文档即使命中全部剩余的词
+            # 也进不了前 limit 名时（MaxScore），只给已有候选加分，结果与全量扫描相同
+            for (ids, tfs), idf, bound in zip(postings, idfs, bounds):
+                df = len(ids)
+                if len(scores) >= limit and df > 8 * len(scores) and \
+                        heapq.nlargest(limit, scores.values())[-1] >= bound:
+                    for doc in list(scores):
+                        i = bisect.bisect_left(ids, doc)
+                        if i < df and ids[i] == doc:
+                            tf = tfs[i]
+                            scores[doc] += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len[doc] / avgdl))
+                    continue
+                for doc, tf in zip(ids, tfs):
+                    if deleted[doc]:
+                        continue
+                    score = idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len[doc] / avgdl))
+                    scores[doc] = scores.get(doc, 0.0) + score
+            top = heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+            return [(self._doc_conv[doc], self._doc_pos[doc], score) for doc, score in top]
+
+    # ---- 持久化 ----
+
+    def _after_change(self):
+        self._changes += 1
+        if self.path and self._changes >= self.save_every and not self._saving:
+            self._saving = True
+            threading.Thread(target=self.save, name='search-index-save', daemon=True).start()
+
+    def _purge(self):
+        """删除标记过多时重排文档号，回收空间，调用方需持有锁"""
+        keep = [doc for doc in range(len(self._doc_conv)) if not self._deleted[doc]]
+        remap = {old: new for new, old in enumerate(keep)}
+        terms = {}
+        for term, (ids, tfs) in self._terms.items():
+            new_ids, new_tfs = array('I'), array('H')
+            for doc, tf in zip(ids, tfs):
+                new = remap.get(doc)
+                if new is not None:
+                    new_ids.append(new)
+                    new_tfs.append(tf)
+            if new_ids:
+                terms[term] = (new_ids, new_tfs)
+        self._terms = terms
+        self._doc_conv = [self._doc_conv[doc] for doc in keep]
+        self._doc_pos = array('I', (self._doc_pos[doc] for doc in keep))
+        self._doc_len = array('I', (self._doc_len[doc] for doc in keep))
+        self._deleted = bytearray(len(keep))
+        self._conv_docs = {
+            cid: array('I', (remap[doc] for doc in docs)) for cid, docs in self._conv_docs.items()
+        }
+
+    def save(self):
+        """原子写入磁盘"""
+        if not self.path:
+            self._saving = False
+            return
+        with self._save_lock:
+            try:
+                with self._lock:
+                    if len(self._doc_conv) and self.live_docs < len(self._doc_conv) * 0.75:
+                        self._purge()
+                    data = pickle.dumps({
+                        'version': INDEX_VERSION,
+                        'terms': self._terms,
+                        'doc_conv': self._doc_conv,
+                        'doc_pos': self._doc_pos,
+                        'doc_len': self._doc_len,
+                        'deleted': self._deleted,
+                        'conv_docs': self._conv_docs,
+                        'live_docs': self.live_docs,
+                        'total_len': self.total_len
+                    }, protocol=pickle.HIGHEST_PROTOCOL)
+                    self._changes = 0
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.error(f"保存历史搜索索引失败: {str(e)}")
+            finally:
+                self._saving = False
+
+    def load(self) -> bool:
+        """从磁盘加载索引，文件不存在或版本不符时返回 False"""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickle.load(f)
+        except Exception as e:
+            logger.error(f"加载历史搜索索引失败: {str(e)}")
+            return False
+        if data.get('version') != INDEX_VERSION:
+            return False
+        with self._lock:
+            self._terms = data['terms']
+            self._doc_conv = data['doc_conv']
+            self._doc_pos = data['doc_pos']
+            self._doc_len = data['doc_len']
+            self._deleted = data['deleted']
+            self._conv_docs = data['conv_docs']
+            self.live_docs = data['live_docs']
+            self.total_len = data['total_len']
+        logger.info(f"已加载历史搜索索引，共 {self.live_docs} 条消息")
+        return True
+
+
+class StoreSearchIndex:
+    """由存储后端维护的历史搜索索引（SQLite FTS5），接口与 HistorySearchIndex 相同
+
+    消息和索引在存储的同一事务中增删，多个工作进程看到同一份索引，
+    因此这里的增删和保存都是空操作。
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    @property
+    def message_count(self) -> int:
+        return self.store.search_index_size()
+
+    def add_message(self, conversation_id: str, content: str):
+        pass
+
+    def remove_conversation(self, conversation_id: str):
+        pass
+
+    def rebuild(self, conversations: Iterable[Dict]):
+        self.store.rebuild_search_index()
+        logger.info(f"已重建历史搜索索引，共 {self.message_count} 条消息")
+
+    def search(self, query: str, limit: int = 20) -> List[Tuple[str, int, float]]:
+        return self.store.search_messages(query, limit)
+
+    def save(self):
+        pass
+
+    def load(self) -> bool:
+        return True
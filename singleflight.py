@@ -0,0 +1,210 @@
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional
+
+_END = object()
+
+
+class StreamAbandoned(RuntimeError):
+    """所有订阅者都已离开，共享的上游流被提前关闭"""
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class StreamFlight:
+    """一次共享的上游流式调用
+
+    已产生的块保存在 chunks 中，订阅者从头回放后跟随新块。不单独起线程：
+    哪个订阅者需要的块还没产生，就由它从上游拉取下一块，其余订阅者等待。
+    最后一个订阅者离开而上游未结束时关闭上游。
+    """
+
+    def __init__(self, key: str, on_finish: Callable[['StreamFlight'], None]):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._source = None
+        self._iterator = None
+        self._pulling = True  # 上游创建完成前视为正在拉取，订阅者等待
+        self._cond = threading.Condition()
+        self._on_finish = on_finish
+
+    def subscribe(self) -> 'FlightSubscriber':
+        with self._cond:
+            self.subscribers += 1
+        return FlightSubscriber(self)
+
+    def start(self, source: Iterable):
+        with self._cond:
+            self._source = source
+            self._iterator = iter(source)
+            self._pulling = False
+            self._cond.notify_all()
+
+    def fail(self, error: BaseException):
+        with self._cond:
+            self._finish(error)
+        self._on_finish(self)
+
+    def _finish(self, error: Optional[BaseException]):
+        """调用方需持有锁"""
+        self.done = True
+        self.error = error
+        self._pulling = False
+        self._cond.notify_all()
+
+    def get(self, index: int) -> Any:
+        """取第 index 块，必要时从上游拉取；结束时返回 _END"""
+        with self._cond:
+            while True:
+                if index < len(self.chunks):
+                    return self.chunks[index]
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return _END
+                if not self._pulling:
+                    self._pulling = True
+                    break
+                self._cond.wait()
+        try:
+            chunk = next(self._iterator)
+        except StopIteration:
+            with self._cond:
+                self._finish(None)
+            self._on_finish(self)
+            return _END
+        except BaseException as e:
+            with self._cond:
+                self._finish(e)
+            self._on_finish(self)
+            raise
+        with self._cond:
+            self.chunks.append(chunk)
+            self._pulling = False
+            self._cond.notify_all()
+        return chunk
+
+    def leave(self):
+        with self._cond:
+            self.subscribers -= 1
+            abandon = self.subscribers == 0 and not self.done
+            if abandon:
+                self._finish(StreamAbandoned('共享的上游流已关闭'))
+        if abandon:
+            close = getattr(self._source, 'close', None)
+            if close is not None:
+                try:
+                    close()
+                except Exception:
+                    pass
+            self._on_finish(self)
+
+
+class FlightSubscriber:
+    """共享流的一个订阅者，可迭代，关闭或被回收时退出订阅"""
+
+    def __init__(self, flight: StreamFlight):
+        self._flight = flight
+        self._closed = False
+
+    def __iter__(self):
+        index = 0
+        try:
+            while True:
+                chunk = self._flight.get(index)
+                if chunk is _END:
+                    return
+                index += 1
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._flight.leave()
+
+    def __del__(self):
+        self.close()
+
+
+class SingleFlight:
+    """合并相同的并发上游请求：同一 key 同时只有一次真实调用
+
+    do() 用于非流式调用，跟随者等待并共享结果（或异常）；stream() 用于流式
+    调用，返回可迭代的订阅者，晚加入的订阅者先回放已产生的块。
+    """
+
+    def __init__(self, on_coalesce: Optional[Callable[[str], None]] = None):
+        self._calls: Dict[str, _Call] = {}
+        self._flights: Dict[str, StreamFlight] = {}
+        self._lock = threading.Lock()
+        self._on_coalesce = on_coalesce
+        self.coalesced = 0
+
+    def _coalesced(self, mode: str):
+        self.coalesced += 1
+        if self._on_coalesce is not None:
+            self._on_coalesce(mode)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self._coalesced('once')
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def stream(self, key: str, factory: Callable[[], Iterable]) -> FlightSubscriber:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and not flight.done:
+                self._coalesced('stream')
+                return flight.subscribe()
+            flight = self._flights[key] = StreamFlight(key, self._forget)
+            subscriber = flight.subscribe()
+        try:
+            source = factory()
+        except BaseException as e:
+            flight.fail(e)
+            raise
+        flight.start(source)
+        return subscriber
+
+    def _forget(self, flight: StreamFlight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'in_flight_calls': len(self._calls),
+                'in_flight_streams': len(self._flights),
+                'coalesced': self.coalesced
+            }
@@ -0,0 +1,315 @@
+import asyncio
+import hashlib
+import json
+import queue
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+# 句末标点：ASCII、中文/全角、半角日文句号，后面可以跟右引号或右括号
+SENTENCE_END = re.compile(r'[.!?;\n。！？；…．｡︒]+["\'”’」』）)】》〉]*')
+
+
+def sse_event(payload: Dict[str, Any]) -> str:
+    """编码一条 SSE data 帧"""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+class StreamEncoder:
+    """把推理/正文增量编码为 SSE 帧
+
+    默认使用增量（delta）格式：每帧只携带新增文本和递增的序号，结束帧附带
+    正文长度和 SHA-256 校验值。cumulative=True 时保持旧格式，每帧重发完整缓冲区。
+    """
+
+    def __init__(self, cumulative: bool = False):
+        self.cumulative = cumulative
+        self.seq = 0
+        self.content = []
+        self.reasoning = []
+        self.content_length = 0
+        self.reasoning_length = 0
+        self._content_hash = hashlib.sha256()
+
+    @property
+    def content_text(self) -> str:
+        return ''.join(self.content)
+
+    @property
+    def reasoning_text(self) -> str:
+        return ''.join(self.reasoning)
+
+    def _frame(self, event_type: str, parts: list, delta: str) -> str:
+        self.seq += 1
+        if self.cumulative:
+            return sse_event({'type': event_type, 'content': ''.join(parts)})
+        return sse_event({'type': event_type, 'delta': delta, 'seq': self.seq})
+
+    def add_reasoning(self, text: str) -> str:
+        """记录推理增量并返回对应的帧"""
+        self.reasoning.append(text)
+        self.reasoning_length += len(text)
+        return self._frame('reasoning', self.reasoning, text)
+
+    def add_content(self, text: str) -> str:
+        """记录正文增量并返回对应的帧"""
+        self.content.append(text)
+        self.content_length += len(text)
+        self._content_hash.update(text.encode('utf-8'))
+        return self._frame('content', self.content, text)
+
+    def done(self, **extra) -> str:
+        """结束帧，增量模式下附带长度和校验值供客户端核对"""
+        payload = {'type': 'done', **extra}
+        if not self.cumulative:
+            payload.update({
+                'seq': self.seq,
+                'content_length': self.content_length,
+                'reasoning_length': self.reasoning_length,
+                'content_sha256': self._content_hash.hexdigest()
+            })
+        return sse_event(payload)
+
+    @staticmethod
+    def error(message: str) -> str:
+        return sse_event({'type': 'error', 'content': message})
+
+
+@dataclass(frozen=True)
+class FlushPolicy:
+    """一路文本（推理或正文）合并成帧的策略
+
+    距上一帧不足 max_delay 秒到达的增量先缓冲，超过后随下一个增量一起发出；
+    缓冲达到 max_bytes（UTF-8）立即发送；sentence 为 True 时遇到句末标点就发出
+    到该标点为止的内容。每路的第一段文本总是立即发送。max_delay 为 0 时逐个增量发送。
+    """
+    max_delay: float = 0.1
+    max_bytes: int = 512
+    sentence: bool = True
+
+
+CONTENT_POLICY = FlushPolicy(max_delay=0.1, max_bytes=512, sentence=True)
+REASONING_POLICY = FlushPolicy(max_delay=0.25, max_bytes=2048, sentence=False)
+
+
+class FlushBuffer:
+    """按 FlushPolicy 缓冲一路文本，记录收到的增量数和发出的帧数
+
+    增量到达时判断是否发送；上游停顿时由调用方在 deadline() 到期后调用 due()，
+    已缓冲的文本最多延迟 max_delay。
+    """
+
+    def __init__(self, policy: FlushPolicy, clock: Callable[[], float] = time.monotonic):
+        self.policy = policy
+        self._clock = clock
+        self._parts: List[str] = []
+        self._bytes = 0
+        self._last_flush: Optional[float] = None
+        self.deltas = 0
+        self.frames = 0
+
+    def add(self, text: str) -> Optional[str]:
+        """缓冲一个增量，需要发送时返回要发送的文本"""
+        self.deltas += 1
+        self._parts.append(text)
+        self._bytes += len(text.encode('utf-8'))
+        now = self._clock()
+        if (self._last_flush is None or now - self._last_flush >= self.policy.max_delay
+                or self._bytes >= self.policy.max_bytes):
+            return self.flush(now)
+        if self.policy.sentence:
+            # 之前的缓冲中没有句末标点，只需在新增量里找最后一个
+            end = None
+            for match in SENTENCE_END.finditer(text):
+                end = match.end()
+            if end is not None:
+                buffered = ''.join(self._parts)
+                cut = len(buffered) - len(text) + end
+                rest = buffered[cut:]
+                self._parts = [buffered[:cut]]
+                sentence = self.flush(now)
+                if rest:
+                    self._parts = [rest]
+                    self._bytes = len(rest.encode('utf-8'))
+                return sentence
+        return None
+
+    def deadline(self) -> Optional[float]:
+        """缓冲的文本最迟应在何时发出，没有缓冲时返回 None"""
+        if not self._parts:
+            return None
+        if self._last_flush is None:
+            return self._clock()
+        return self._last_flush + self.policy.max_delay
+
+    def due(self, now: float) -> Optional[str]:
+        """已到 deadline() 时发出缓冲的文本"""
+        deadline = self.deadline()
+        if deadline is None or now < deadline:
+            return None
+        return self.flush(now)
+
+    def flush(self, now: Optional[float] = None) -> Optional[str]:
+        """发出全部缓冲的文本，没有缓冲时返回 None"""
+        if not self._parts:
+            return None
+        text = ''.join(self._parts)
+        self._parts = []
+        self._bytes = 0
+        self._last_flush = self._clock() if now is None else now
+        self.frames += 1
+        return text
+
+
+class AnswerStream:
+    """把上游流式 chunk 转换为 SSE 帧，同步和异步路由共用
+
+    推理和正文各用一个 FlushBuffer 合并增量，减少小帧数量；正文开始前先发出
+    缓冲中的推理，保证顺序。stats() 返回首个可见文本的耗时（ttfv）和帧数，
+    on_finish 在 finish() 时收到同样的统计。
+
+    iter_frames() / aiter_frames() 读取上游时以最近一个缓冲的到期时间为超时，
+    上游停顿时按时发出已缓冲的文本。
+    """
+
+    def __init__(self, cumulative: bool = False, content_policy: FlushPolicy = CONTENT_POLICY,
+                 reasoning_policy: FlushPolicy = REASONING_POLICY,
+                 on_finish: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.encoder = StreamEncoder(cumulative=cumulative)
+        self.on_finish = on_finish
+        self._clock = clock
+        self._started = clock()
+        self.ttfv: Optional[float] = None
+        self._content = FlushBuffer(content_policy, clock)
+        self._reasoning = FlushBuffer(reasoning_policy, clock)
+
+    def _emit_reasoning(self, text: Optional[str], frames: List[str]):
+        if text:
+            self._mark_visible()
+            frames.append(self.encoder.add_reasoning(text))
+
+    def _emit_content(self, text: Optional[str], frames: List[str]):
+        if text:
+            self._mark_visible()
+            frames.append(self.encoder.add_content(text))
+
+    def _mark_visible(self):
+        if self.ttfv is None:
+            self.ttfv = self._clock() - self._started
+
+    def feed(self, chunk) -> List[str]:
+        """处理一个上游 chunk，返回需要发送的帧"""
+        frames = []
+        if not (chunk.choices and chunk.choices[0].delta):
+            return frames
+        delta = chunk.choices[0].delta
+
+        if getattr(delta, 'reasoning_content', None):
+            self._emit_reasoning(self._reasoning.add(delta.reasoning_content), frames)
+
+        if delta.content:
+            self._emit_reasoning(self._reasoning.flush(), frames)
+            self._emit_content(self._content.add(delta.content), frames)
+        return frames
+
+    def timeout(self) -> Optional[float]:
+        """距最早一个缓冲到期的秒数，没有缓冲时返回 None（可以一直等待上游）"""
+        deadlines = [d for d in (self._reasoning.deadline(), self._content.deadline()) if d is not None]
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - self._clock())
+
+    def tick(self) -> List[str]:
+        """等待上游超时后调用，发出已到期的缓冲"""
+        frames = []
+        now = self._clock()
+        self._emit_reasoning(self._reasoning.due(now), frames)
+        self._emit_content(self._content.due(now), frames)
+        return frames
+
+    def iter_frames(self, chunks: Iterator) -> Iterator[str]:
+        """逐个处理上游 chunk 并产出帧（不含 finish()）
+
+        阻塞的迭代器无法带超时等待，上游在后台线程中读取，经队列交给本生成器。
+        本生成器被关闭时只通知读取线程、不等它退出；chunks 需支持从其他线程 close()，
+        由调用方关闭以打断停顿中的读取（见 app.MeteredStream）。
+        """
+        items: queue.Queue = queue.Queue()
+        stop = threading.Event()
+        end = object()
+
+        def read():
+            try:
+                for chunk in chunks:
+                    if stop.is_set():
+                        return
+                    items.put(chunk)
+            except BaseException as e:
+                items.put(e)
+            finally:
+                items.put(end)
+
+        reader = threading.Thread(target=read, name='stream-reader', daemon=True)
+        reader.start()
+        try:
+            while True:
+                try:
+                    item = items.get(timeout=self.timeout())
+                except queue.Empty:
+                    yield from self.tick()
+                    continue
+                if item is end:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield from self.feed(item)
+        finally:
+            stop.set()
+
+    async def aiter_frames(self, chunks: AsyncIterator) -> AsyncIterator[str]:
+        """iter_frames() 的异步版本：等待下一个 chunk 超时不取消读取，到期发出缓冲后继续等待"""
+        iterator = chunks.__aiter__()
+        pending: Optional[asyncio.Future] = None
+        try:
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                done, _ = await asyncio.wait({pending}, timeout=self.timeout())
+                if not done:
+                    for frame in self.tick():
+                        yield frame
+                    continue
+                future, pending = pending, None
+                try:
+                    chunk = future.result()
+                except StopAsyncIteration:
+                    return
+                for frame in self.feed(chunk):
+                    yield frame
+        finally:
+            if pending is not None:
+                # 关闭时取消正在进行的读取，并等它结束，之后调用方才能关闭 chunks
+                pending.cancel()
+                try:
+                    await pending
+                except BaseException:
+                    pass
+
+    def finish(self) -> List[str]:
+        """发送剩余的内容"""
+        frames = []
+        self._emit_reasoning(self._reasoning.flush(), frames)
+        self._emit_content(self._content.flush(), frames)
+        if self.on_finish:
+            self.on_finish(self.stats())
+        return frames
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'ttfv': self.ttfv,
+            'frames': {'reasoning': self._reasoning.frames, 'content': self._content.frames},
+            'deltas': {'reasoning': self._reasoning.deltas, 'content': self._content.deltas}
+        }
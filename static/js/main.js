@@ -1,6 +1,8 @@
 // 全局状态管理
 let currentConversationId = null;
 let isSearchEnabled = false;
+let conversationsCursor = null;
+let historySearchTimer = null;
 
 // 调试工具
 const DEBUG = {
@@ -21,10 +23,12 @@ const elements = {
     sendButton: document.getElementById('askAssistant'),
     responseContainer: document.getElementById('assistantResponse'),
     fileInput: document.getElementById('fileInput'),
-    uploadButton: document.getElementById('uploadButton'),
+    uploadButtons: document.querySelectorAll('.upload-buttons .toolbar-button'),
+    fileType: document.getElementById('fileType'),
     searchToggle: document.getElementById('searchToggle'),
     searchStatus: document.getElementById('searchStatus'),
     newChatButton: document.getElementById('newChat'),
+    historySearch: document.getElementById('historySearch'),
     conversationsList: document.getElementById('conversationsList')
 };
 
@@ -75,7 +79,9 @@ const ChatState = {
         const avatar = document.createElement('div');
         avatar.className = 'avatar';
         const img = document.createElement('img');
-        img.src = role === 'assistant' ? '/static/image/deepseek.jpg' : '/static/image/user.jpg';
+        img.src = role === 'assistant'
+            ? (document.body.dataset.assistantAvatar || '/static/image/deepseek.jpg')
+            : (document.body.dataset.userAvatar || '/static/image/user.jpg');
         img.alt = role === 'assistant' ? 'AI' : 'User';
         img.onerror = function(e) {
             console.error(`Error loading image for ${role}:`, e);
@@ -197,12 +203,15 @@ function setupEventListeners() {
         });
     }
     
-    if (elements.uploadButton) {
-        elements.uploadButton.addEventListener('click', () => {
-            console.log('Upload button clicked');
+    elements.uploadButtons.forEach(button => {
+        button.addEventListener('click', () => {
+            console.log('Upload button clicked:', button.dataset.type);
+            if (elements.fileType) {
+                elements.fileType.value = button.dataset.type;
+            }
             elements.fileInput.click();
         });
-    }
+    });
     
     if (elements.searchToggle) {
         elements.searchToggle.addEventListener('change', (e) => {
@@ -217,6 +226,17 @@ function setupEventListeners() {
             createNewConversation();
         });
     }
+    
+    // 输入停顿后再搜索，清空时恢复对话列表
+    if (elements.historySearch) {
+        elements.historySearch.addEventListener('input', () => {
+            clearTimeout(historySearchTimer);
+            historySearchTimer = setTimeout(() => {
+                const query = elements.historySearch.value.trim();
+                query ? searchHistory(query) : loadConversations();
+            }, 250);
+        });
+    }
 }
 
 // 用户输入处理
@@ -234,14 +254,14 @@ async function handleUserMessage(message) {
     try {
         // 如果没有当前对话ID，创建新对话
         if (!currentConversationId) {
-            const response = await fetch('/conversations', {
+            const response = await fetch('/conversations/summary?limit=1', {
                 method: 'GET'
             });
             if (!response.ok) throw new Error('Failed to create conversation');
-            const conversations = await response.json();
-            if (conversations && conversations.length > 0) {
+            const { items } = await response.json();
+            if (items && items.length > 0) {
                 // 使用最新的对话
-                currentConversationId = conversations[0].id;
+                currentConversationId = items[0].id;
             } else {
                 // 如果没有对话，创建新对话
                 const newConv = await createNewConversation();
@@ -259,6 +279,7 @@ async function handleUserMessage(message) {
         // 显示加载状态
         ChatState.addTypingIndicator();
         
+        // 对话轮次统一走 /ask，由服务端写入会话历史
         const response = await fetch('/ask', {
             method: 'POST',
             headers: {
@@ -287,68 +308,201 @@ async function handleUserMessage(message) {
     }
 }
 
+// 增量流消费者：拼接 delta 帧，按帧合并渲染
+class StreamConsumer {
+    constructor() {
+        this.content = '';
+        this.reasoning = '';
+        this.lastSeq = 0;
+        this.renderScheduled = false;
+        this.contentDirty = false;
+        this.reasoningDirty = false;
+    }
+
+    // 兼容两种格式：delta（增量）和 content（完整缓冲区）
+    apply(parsed, field) {
+        if (typeof parsed.seq === 'number') {
+            if (parsed.seq !== this.lastSeq + 1) {
+                DEBUG.error('Stream', `SSE 序号不连续: 期望 ${this.lastSeq + 1}, 收到 ${parsed.seq}`);
+            }
+            this.lastSeq = parsed.seq;
+        }
+        if (typeof parsed.delta === 'string') {
+            this[field] += parsed.delta;
+        } else {
+            this[field] = parsed.content || '';
+        }
+        this[`${field}Dirty`] = true;
+        this.scheduleRender();
+    }
+
+    // 每个动画帧最多渲染一次 markdown
+    scheduleRender() {
+        if (this.renderScheduled) return;
+        this.renderScheduled = true;
+        requestAnimationFrame(() => this.render());
+    }
+
+    render() {
+        this.renderScheduled = false;
+        if (this.reasoningDirty && ChatState.currentMessageDiv) {
+            const reasoningDiv = ChatState.currentMessageDiv.querySelector('.reasoning-content');
+            if (reasoningDiv) {
+                reasoningDiv.innerHTML = md.render(this.reasoning);
+            }
+        }
+        if (this.contentDirty) {
+            ChatState.updateContent(this.content);
+        }
+        this.reasoningDirty = false;
+        this.contentDirty = false;
+    }
+
+    // 结束帧核对长度，Python 按码点计数
+    verify(parsed) {
+        if (typeof parsed.content_length !== 'number') return true;
+        const length = Array.from(this.content).length;
+        if (length !== parsed.content_length) {
+            DEBUG.error('Stream', `正文长度不一致: 本地 ${length}, 服务端 ${parsed.content_length}`);
+            return false;
+        }
+        return true;
+    }
+}
+
 // 处理流式响应
-function handleStream(response) {
-    const reader = response.body.getReader();
+async function handleStream(response) {
     const decoder = new TextDecoder();
-    let accumulatedContent = '';
+    const consumer = new StreamConsumer();
+    let pending = '';
 
-    return new ReadableStream({
-        async start(controller) {
-            try {
-                while (true) {
-                    const { done, value } = await reader.read();
-                    if (done) break;
-
-                    const chunk = decoder.decode(value);
-                    const lines = chunk.split('\n');
-
-                    for (const line of lines) {
-                        if (line.startsWith('data: ')) {
-                            const data = line.slice(6);
-                            if (data === '[DONE]') continue;
-
-                            try {
-                                const parsed = JSON.parse(data);
-                                switch (parsed.type) {
-                                    case 'content':
-                                        accumulatedContent = parsed.content;
-                                        ChatState.updateContent(accumulatedContent);
-                                        break;
-                                    case 'reasoning':
-                                        if (ChatState.currentMessageDiv) {
-                                            const reasoningDiv = ChatState.currentMessageDiv.querySelector('.reasoning-content');
-                                            if (reasoningDiv) {
-                                                reasoningDiv.innerHTML = md.render(parsed.content);
-                                            }
-                                        }
-                                        break;
-                                    case 'error':
-                                        showError(parsed.content);
-                                        break;
-                                    case 'done':
-                                        ChatState.history.push({ 
-                                            content: accumulatedContent, 
-                                            role: 'assistant'
-                                        });
-                                        ChatState.removeTypingIndicator();
-                                        break;
-                                }
-                            } catch (e) {
-                                console.error('Error parsing SSE data:', e);
-                            }
-                        }
-                    }
+    const handleEvent = (data) => {
+        if (data === '[DONE]') return;
+        let parsed;
+        try {
+            parsed = JSON.parse(data);
+        } catch (e) {
+            console.error('Error parsing SSE data:', e);
+            return;
+        }
+        switch (parsed.type) {
+            case 'content':
+                consumer.apply(parsed, 'content');
+                break;
+            case 'reasoning':
+                consumer.apply(parsed, 'reasoning');
+                break;
+            case 'progress':
+                // 大文件分块分析的进度，正文到达前显示
+                if (!consumer.content) {
+                    ChatState.updateContent(`*正在分析（${parsed.stage}）：${parsed.completed}/${parsed.total}*`);
                 }
+                break;
+            case 'error':
+                showError(parsed.content);
+                break;
+            case 'done':
+                consumer.render();
+                consumer.verify(parsed);
+                ChatState.history.push({ 
+                    content: consumer.content, 
+                    role: 'assistant'
+                });
+                ChatState.removeTypingIndicator();
+                break;
+        }
+    };
+
+    // 断线续传：服务端事件带 id 行，连接中断时带 Last-Event-ID 重连，从断点继续
+    let lastEventId = null;
+    let eventId = null;
+    let finished = false;
+    let retries = 0;
+
+    const handleLine = (line) => {
+        if (line.startsWith('id: ')) {
+            eventId = line.slice(4);
+        } else if (line.startsWith('data: ')) {
+            const data = line.slice(6);
+            handleEvent(data);
+            if (eventId !== null) {
+                // 事件处理完才记下 id，重连时不会跳过它
+                lastEventId = eventId;
+                retries = 0;
+            }
+            const type = data === '[DONE]' ? 'done' : (data.match(/"type":\s*"(\w+)"/) || [])[1];
+            if (type === 'done' || type === 'error') {
+                finished = true;
+            }
+        } else if (line === '') {
+            eventId = null;
+        }
+    };
+
+    const readAll = async (reader) => {
+        try {
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+
+                // 网络分片可能切断一行，保留未完成的部分
+                pending += decoder.decode(value, { stream: true });
+                const lines = pending.split('\n');
+                pending = lines.pop();
+                lines.forEach(handleLine);
+            }
+            handleLine(pending);
+        } finally {
+            pending = '';
+            eventId = null;
+            reader.releaseLock();
+        }
+    };
+
+    let reader = response.body.getReader();
+    let lastError = null;
+    while (true) {
+        if (reader) {
+            try {
+                await readAll(reader);
+                lastError = null;
             } catch (error) {
-                console.error('Stream reading error:', error);
-                controller.error(error);
-            } finally {
-                controller.close();
-                reader.releaseLock();
+                lastError = error;
             }
+            // readAll 已释放读取锁，不能再读
+            reader = null;
         }
-    });
+        if (finished || !lastEventId || retries >= 3) {
+            if (lastError) {
+                console.error('Stream reading error:', lastError);
+                throw lastError;
+            }
+            if (!finished && lastEventId) {
+                throw new Error('连接中断，续传失败');
+            }
+            break;
+        }
+
+        retries += 1;
+        DEBUG.log('Stream', `连接中断，第 ${retries} 次续传: ${lastEventId}`);
+        await new Promise(resolve => setTimeout(resolve, 500 * retries));
+        try {
+            const resumed = await fetch('/ask/resume', { headers: { 'Last-Event-ID': lastEventId } });
+            if (!resumed.ok) {
+                const body = await resumed.json().catch(() => ({}));
+                // 除限流外的 4xx 表示无法续传（已过期、位置无效或服务端不支持），不再重试
+                if (resumed.status >= 400 && resumed.status < 500 && resumed.status !== 429) {
+                    retries = 3;
+                }
+                throw new Error(body.error || `HTTP error! status: ${resumed.status}`);
+            }
+            reader = resumed.body.getReader();
+        } catch (error) {
+            DEBUG.log('Stream', `续传失败: ${error.message}`);
+            lastError = error;
+        }
+    }
+    return consumer.content;
 }
 
 // 文件处理
@@ -356,36 +510,60 @@ function handleFileSelection() {
     const file = elements.fileInput.files[0];
     if (!file) return;
     
-    const reader = new FileReader();
-    reader.onload = async (e) => {
-        try {
-            const content = e.target.result;
-            await uploadFile(file.name, content);
-            showSuccess('文件上传成功');
-        } catch (error) {
-            showError('文件上传失败: ' + error.message);
-        }
-    };
-    reader.readAsText(file);
+    const fileType = elements.fileType ? elements.fileType.value : 'code';
+    uploadFile(file, fileType).finally(() => {
+        // 允许再次选择同一个文件
+        elements.fileInput.value = '';
+    });
 }
 
-async function uploadFile(filename, content) {
-    const response = await fetch('/upload', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({
-            filename,
-            content
-        })
-    });
-    
-    if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`);
+// 上传文件并以流式方式接收分析结果
+async function uploadFile(file, fileType) {
+    if (ChatState.isStreaming) {
+        showError('请等待当前回复完成');
+        return;
     }
     
-    return await response.json();
+    const message = elements.messageInput.value.trim();
+    const formData = new FormData();
+    formData.append('file', file);
+    formData.append('type', fileType);
+    formData.append('message', message);
+    formData.append('stream', '1');
+    
+    ChatState.isStreaming = true;
+    elements.sendButton.disabled = true;
+    
+    try {
+        appendMessage(`上传文件：${file.name}${message ? `\n${message}` : ''}`, 'user');
+        elements.messageInput.value = '';
+        ChatState.addTypingIndicator();
+        
+        const response = await fetch('/upload', {
+            method: 'POST',
+            body: formData
+        });
+        
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        
+        // 出错时服务端返回 JSON，正常时返回 SSE
+        if ((response.headers.get('Content-Type') || '').includes('text/event-stream')) {
+            await handleStream(response);
+        } else {
+            const result = await response.json();
+            if (result.error) throw new Error(result.error);
+            ChatState.updateContent(result.content || '');
+            ChatState.removeTypingIndicator();
+        }
+    } catch (error) {
+        showError('文件上传失败: ' + error.message);
+        ChatState.removeTypingIndicator();
+    } finally {
+        ChatState.isStreaming = false;
+        elements.sendButton.disabled = false;
+    }
 }
 
 // 搜索功能
@@ -423,15 +601,21 @@ async function createNewConversation() {
     }
 }
 
-async function loadConversations() {
+// 分页加载对话摘要列表，append 为 true 时追加下一页
+async function loadConversations(append = false) {
     try {
-        const response = await fetch('/conversations');
+        const params = new URLSearchParams({ limit: 50 });
+        if (append && conversationsCursor) {
+            params.set('cursor', conversationsCursor);
+        }
+        const response = await fetch(`/conversations/summary?${params}`);
         if (!response.ok) {
             throw new Error('Failed to load conversations');
         }
         
-        const conversations = await response.json();
-        updateConversationsList(conversations);
+        const { items, next_cursor } = await response.json();
+        conversationsCursor = next_cursor;
+        updateConversationsList(items, append);
         
     } catch (error) {
         console.error('Error loading conversations:', error);
@@ -439,24 +623,22 @@ async function loadConversations() {
     }
 }
 
-function updateConversationsList(conversations) {
+function updateConversationsList(conversations, append = false) {
     const list = document.querySelector('.conversations-list');
     if (!list) return;
     
-    list.innerHTML = '';
-    
-    conversations.sort((a, b) => new Date(b.updated_at) - new Date(a.updated_at));
+    if (!append) {
+        list.innerHTML = '';
+    }
+    list.querySelector('.load-more-conversations')?.remove();
     
     conversations.forEach(conv => {
         const item = document.createElement('div');
         item.className = `conversation-item ${conv.id === currentConversationId ? 'active' : ''}`;
-        
-        // 获取对话的第一条消息作为标题
-        const title = conv.messages[0]?.content || '新对话';
-        const truncatedTitle = title.length > 30 ? title.substring(0, 30) + '...' : title;
+        item.dataset.id = conv.id;
         
         item.innerHTML = `
-            <div class="conversation-title">${truncatedTitle}</div>
+            <div class="conversation-title">${md.utils.escapeHtml(conv.title)}</div>
             <div class="conversation-time">${formatTime(conv.updated_at)}</div>
             <button class="delete-conversation" data-id="${conv.id}">
                 <i class="fas fa-trash"></i>
@@ -483,6 +665,60 @@ function updateConversationsList(conversations) {
         
         list.appendChild(item);
     });
+    
+    // 还有更多对话时显示加载按钮
+    if (conversationsCursor) {
+        const loadMore = document.createElement('button');
+        loadMore.className = 'load-more-conversations';
+        loadMore.textContent = '加载更多';
+        loadMore.addEventListener('click', () => loadConversations(true));
+        list.appendChild(loadMore);
+    }
+}
+
+// 全文搜索历史消息
+async function searchHistory(query) {
+    try {
+        const params = new URLSearchParams({ q: query, limit: 30 });
+        const response = await fetch(`/conversations/search?${params}`);
+        if (!response.ok) {
+            throw new Error('Failed to search history');
+        }
+        
+        const { items } = await response.json();
+        // 用户已经改了输入时丢弃过期结果
+        if (elements.historySearch.value.trim() !== query) return;
+        renderSearchResults(items);
+        
+    } catch (error) {
+        console.error('Error searching history:', error);
+        showError('搜索历史失败');
+    }
+}
+
+function renderSearchResults(items) {
+    const list = document.querySelector('.conversations-list');
+    if (!list) return;
+    list.innerHTML = '';
+    
+    if (items.length === 0) {
+        list.innerHTML = '<div class="history-search-empty">没有找到相关对话</div>';
+        return;
+    }
+    
+    items.forEach(hit => {
+        const item = document.createElement('div');
+        item.className = `conversation-item ${hit.conversation_id === currentConversationId ? 'active' : ''}`;
+        item.dataset.id = hit.conversation_id;
+        // snippet 已由服务端转义，只包含 <mark> 标签
+        item.innerHTML = `
+            <div class="conversation-title">${md.utils.escapeHtml(hit.title)}</div>
+            <div class="history-search-snippet">${hit.snippet}</div>
+            <div class="conversation-time">${formatTime(hit.timestamp)}</div>
+        `;
+        item.addEventListener('click', () => loadConversation(hit.conversation_id));
+        list.appendChild(item);
+    });
 }
 
 async function loadConversation(conversationId) {
@@ -0,0 +1,164 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from flask import Response, request, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，缺失时只提供 gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# 需要预压缩的文本类资源
+COMPRESSIBLE = {'.js', '.css', '.html', '.svg', '.json', '.txt', '.map'}
+# 带版本号的 URL 内容不会变化，可以长期缓存
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+# 不带版本号的请求每次用 ETag 协商
+REVALIDATE_CACHE = 'no-cache'
+
+
+@dataclass
+class StaticAsset:
+    """一个静态文件：内容摘要、原始内容和预压缩的各编码版本"""
+    path: str
+    digest: str
+    mtime: float
+    size: int
+    mimetype: str
+    body: Optional[bytes] = None  # 超过 max_inline_bytes 的文件不驻留内存
+    variants: Dict[str, bytes] = field(default_factory=dict)
+
+
+class StaticAssets:
+    """静态资源管线：内容哈希版本号、ETag、不可变缓存和预压缩
+
+    启动时扫描静态目录，为每个文件计算 SHA-256 并预先生成 gzip（安装了
+    brotli 时还有 br）版本，请求时按 Accept-Encoding 直接返回内存中的字节。
+    模板通过 url() 生成 /static/<文件>?v=<摘要>，版本号匹配时下发 immutable。
+    每次请求只 stat 一次文件，内容变化时重新计算（开发时修改 JS/CSS 立即生效）。
+    """
+
+    def __init__(self, static_dir: str, min_compress_bytes: int = 512,
+                 max_inline_bytes: int = 1024 * 1024):
+        self.static_dir = os.path.abspath(static_dir)
+        self.min_compress_bytes = min_compress_bytes
+        self.max_inline_bytes = max_inline_bytes
+        self.encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+        self._assets: Dict[str, StaticAsset] = {}
+        self._lock = threading.Lock()
+
+    def build(self) -> int:
+        """扫描静态目录并预压缩，返回文件数"""
+        count = 0
+        original = 0
+        compressed = 0
+        for root, _, files in os.walk(self.static_dir):
+            for name in files:
+                if name.endswith(('.bak', '.tmp')):
+                    continue
+                rel_path = os.path.relpath(os.path.join(root, name), self.static_dir).replace(os.sep, '/')
+                asset = self._load(rel_path)
+                if asset is None:
+                    continue
+                count += 1
+                if 'gzip' in asset.variants:
+                    original += asset.size
+                    compressed += len(asset.variants['gzip'])
+        logger.info(f"静态资源已就绪：{count} 个文件，可压缩资源 gzip 后 {original} -> {compressed} 字节")
+        return count
+
+    def _load(self, rel_path: str) -> Optional[StaticAsset]:
+        full_path = os.path.join(self.static_dir, rel_path)
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            return None
+        sha = hashlib.sha256()
+        body = None
+        with open(full_path, 'rb') as f:
+            if stat.st_size <= self.max_inline_bytes:
+                body = f.read()
+                sha.update(body)
+            else:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    sha.update(block)
+        mimetype = mimetypes.guess_type(rel_path)[0] or 'application/octet-stream'
+        asset = StaticAsset(rel_path, sha.hexdigest()[:16], stat.st_mtime, stat.st_size, mimetype, body)
+
+        ext = os.path.splitext(rel_path)[1].lower()
+        if body is not None and ext in COMPRESSIBLE and len(body) >= self.min_compress_bytes:
+            variants = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variants['br'] = brotli.compress(body, quality=11)
+            # 压缩后没有变小的版本不值得发送
+            asset.variants = {k: v for k, v in variants.items() if len(v) < len(body)}
+        with self._lock:
+            self._assets[rel_path] = asset
+        return asset
+
+    def get(self, rel_path: str) -> Optional[StaticAsset]:
+        """取资源，文件修改过则重新计算"""
+        with self._lock:
+            asset = self._assets.get(rel_path)
+        full_path = os.path.join(self.static_dir, rel_path)
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            return None
+        if asset is None or asset.mtime != stat.st_mtime or asset.size != stat.st_size:
+            if not os.path.isfile(full_path):
+                return None
+            asset = self._load(rel_path)
+        return asset
+
+    def url(self, filename: str) -> str:
+        """模板辅助函数：带内容摘要的静态资源 URL"""
+        asset = self.get(filename)
+        if asset is None:
+            return f'/static/{filename}'
+        return f'/static/{filename}?v={asset.digest}'
+
+    def _choose_encoding(self, asset: StaticAsset) -> Optional[str]:
+        for encoding in self.encodings:
+            if encoding in asset.variants and request.accept_encodings.quality(encoding) > 0:
+                return encoding
+        return None
+
+    def serve(self, filename: str) -> Response:
+        """替代 Flask 默认的静态文件视图"""
+        if safe_join(self.static_dir, filename) is None:
+            return Response('Not Found', status=404)
+        asset = self.get(filename)
+        if asset is None:
+            return Response('Not Found', status=404)
+
+        versioned = request.args.get('v') == asset.digest
+        cache_control = IMMUTABLE_CACHE if versioned else REVALIDATE_CACHE
+
+        if asset.body is None:
+            response = send_from_directory(self.static_dir, filename, conditional=True, etag=asset.digest)
+            response.headers['Cache-Control'] = cache_control
+            return response
+
+        encoding = self._choose_encoding(asset)
+        etag = f'"{asset.digest}-{encoding}"' if encoding else f'"{asset.digest}"'
+        headers = {'ETag': etag, 'Cache-Control': cache_control}
+        if asset.variants:
+            headers['Vary'] = 'Accept-Encoding'
+        if request.if_none_match.contains_weak(etag.strip('"')):
+            return Response(status=304, headers=headers)
+
+        if encoding:
+            headers['Content-Encoding'] = encoding
+            body = asset.variants[encoding]
+        else:
+            body = asset.body
+        return Response(body, mimetype=asset.mimetype, headers=headers)
@@ -0,0 +1,98 @@
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """你负责维护一段对话的滚动摘要。请把“已有摘要”和“新增对话”合并为一份新的摘要：
+1. 保留用户的目标、约束、关键结论和未解决的问题
+2. 保留代码、文件名、数字等关键细节
+3. 不要编造内容，使用简洁的条目
+4. 只输出摘要本身"""
+
+
+class ConversationSummarizer:
+    """滚动摘要：历史超过阈值后，把较早的对话增量压缩进摘要
+
+    摘要以 {"content", "upto", "tokens"} 的形式保存在会话中，upto 表示
+    已被摘要覆盖的消息条数。每次只把 upto 之后、最近 keep_recent 条之前的
+    消息与旧摘要合并，不会重新处理整段历史。
+    """
+
+    def __init__(self, complete: Callable[[List[Dict]], str], count_tokens: Callable[[Dict], int],
+                 trigger_tokens: int = 6000, keep_recent: int = 6):
+        self.complete = complete
+        self.count_tokens = count_tokens
+        self.trigger_tokens = trigger_tokens
+        self.keep_recent = keep_recent
+        self._running = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def covered(conversation: Dict) -> int:
+        summary = conversation.get('summary')
+        return summary['upto'] if summary else 0
+
+    def needs_summary(self, conversation: Dict) -> bool:
+        messages = conversation['messages']
+        start = self.covered(conversation)
+        cut = len(messages) - self.keep_recent
+        if cut <= start:
+            return False
+        pending = sum(self.count_tokens(m) for m in messages[start:])
+        return pending > self.trigger_tokens
+
+    def summarize(self, conversation: Dict) -> Optional[Dict]:
+        """合并旧摘要与新增消息，返回新的摘要；无需更新时返回 None"""
+        messages = conversation['messages']
+        start = self.covered(conversation)
+        cut = len(messages) - self.keep_recent
+        if cut <= start:
+            return None
+        previous = (conversation.get('summary') or {}).get('content', '无')
+        transcript = '\n'.join(f"{m['role']}: {m['content']}" for m in messages[start:cut])
+        content = self.complete([
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"已有摘要：\n{previous}\n\n新增对话：\n{transcript}"}
+        ])
+        return {
+            'content': content,
+            'upto': cut,
+            'tokens': self.count_tokens({'content': content})
+        }
+
+    def summarize_in_background(self, conversation_id: str,
+                                load: Callable[[str], Optional[Dict]],
+                                save: Callable[[str, Dict], bool]):
+        """在后台线程中更新摘要，同一会话同时只运行一个任务"""
+        with self._lock:
+            if conversation_id in self._running:
+                return
+            self._running.add(conversation_id)
+
+        def run():
+            try:
+                conversation = load(conversation_id)
+                if conversation is None or not self.needs_summary(conversation):
+                    return
+                summary = self.summarize(conversation)
+                if summary:
+                    save(conversation_id, summary)
+                    logger.info(f"已更新会话摘要 {conversation_id}，覆盖 {summary['upto']} 条消息")
+            except Exception as e:
+                logger.error(f"生成会话摘要失败: {str(e)}")
+            finally:
+                with self._lock:
+                    self._running.discard(conversation_id)
+
+        threading.Thread(target=run, name='conversation-summary', daemon=True).start()
+
+    @staticmethod
+    def apply(system_prompt: Dict, conversation: Dict) -> Tuple[Dict, List[Dict]]:
+        """把摘要并入系统提示，返回 (系统提示, 未被摘要覆盖的消息)"""
+        summary = conversation.get('summary')
+        if not summary:
+            return system_prompt, conversation['messages']
+        prompt = dict(system_prompt)
+        prompt['content'] = f"{system_prompt['content']}\n\n以下是之前对话的摘要：\n{summary['content']}"
+        return prompt, conversation['messages'][summary['upto']:]
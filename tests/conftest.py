@@ -0,0 +1,16 @@
+import os
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """在临时目录中导入 app：模块导入时会按相对路径创建存储文件"""
+    os.environ.setdefault('ARK_API_KEY', 'test')
+    os.environ.setdefault('OPENAI_BASE_URL', 'http://127.0.0.1:9/v1')
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('app'))
+    import app
+    app.load_conversations_from_file()
+    yield app
+    os.chdir(cwd)
@@ -0,0 +1,44 @@
+import pytest
+from starlette.testclient import TestClient
+
+from rate_limit import RateLimiter
+
+
+@pytest.fixture
+def client(app_module, monkeypatch):
+    import asgi
+
+    def prepare(data):
+        # 通过限流后到达这里即可，不调用上游
+        raise ValueError('prepared')
+
+    monkeypatch.setattr(app_module, 'prepare_ask_messages', prepare)
+    monkeypatch.setattr(app_module, 'ip_limiter', RateLimiter(60, 1000))
+    monkeypatch.setattr(app_module, 'conversation_limiter', RateLimiter(60, 1000))
+    return TestClient(asgi.app)
+
+
+def test_ask_applies_ip_limit(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, 'ip_limiter', RateLimiter(1, 1))
+    assert client.post('/ask', json={'message': 'hi'}).status_code == 400
+    response = client.post('/ask', json={'message': 'hi'})
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert response.json() == {'error': app_module.RATE_LIMITED_MESSAGE}
+
+
+def test_ask_applies_conversation_limit(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, 'conversation_limiter', RateLimiter(1, 1))
+    assert client.post('/ask', json={'message': 'hi', 'conversation_id': 'a'}).status_code == 400
+    assert client.post('/ask', json={'message': 'hi', 'conversation_id': 'a'}).status_code == 429
+    # 其他会话不受影响
+    assert client.post('/ask', json={'message': 'hi', 'conversation_id': 'b'}).status_code == 400
+
+
+def test_limited_response_matches_flask(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, 'ip_limiter', RateLimiter(1, 0))
+    asgi_response = client.post('/ask', json={'message': 'hi'})
+    flask_response = app_module.app.test_client().post('/ask', json={'message': 'hi'})
+    assert asgi_response.status_code == flask_response.status_code == 429
+    assert asgi_response.json() == flask_response.get_json()
+    assert asgi_response.headers['Retry-After'] == flask_response.headers['Retry-After']
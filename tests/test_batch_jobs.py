@@ -0,0 +1,70 @@
+import json
+import threading
+
+import pytest
+
+from batch_jobs import BatchJobManager
+
+
+def read_output(job):
+    with open(job.output_path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_resume_refused_while_cancelled_runner_is_draining(tmp_path):
+    gate = threading.Event()
+    started = threading.Event()
+
+    def process(prompt, system=None):
+        started.set()
+        gate.wait(5)
+        return prompt.upper()
+
+    manager = BatchJobManager(str(tmp_path), process, max_workers=2)
+    lines = [json.dumps({'id': i, 'prompt': f'p{i}'}) for i in range(20)]
+    job = manager.submit(lines)
+    assert started.wait(5)
+
+    manager.cancel(job.id)
+    assert job.status == 'running'
+    # 在途请求还没结束，状态改为 cancelled 之后上一次调用也可能仍在运行
+    job.status = 'cancelled'
+    with pytest.raises(ValueError):
+        manager.resume(job.id)
+
+    gate.set()
+    job.runner.result(5)
+    assert job.status == 'cancelled'
+    manager.resume(job.id)
+    job.runner.result(5)
+    assert job.status == 'completed'
+
+    indices = [row['index'] for row in read_output(job)]
+    assert sorted(indices) == list(range(1, 21))
+    manager.shutdown()
+
+
+def test_cancel_pending_job_never_runs(tmp_path):
+    gate = threading.Event()
+    calls = []
+
+    def process(prompt, system=None):
+        calls.append(prompt)
+        gate.wait(5)
+        return prompt
+
+    manager = BatchJobManager(str(tmp_path), process, max_workers=1, max_jobs=1)
+    first = manager.submit([json.dumps({'prompt': 'first'})])
+    second = manager.submit([json.dumps({'prompt': 'second'})])
+    manager.cancel(second.id)
+    assert second.status == 'cancelled'
+    assert not second.active
+
+    # 排队的调用已撤销，可以立即续跑，且只会有一个调用执行
+    manager.resume(second.id)
+    gate.set()
+    first.runner.result(5)
+    second.runner.result(5)
+    assert second.status == 'completed'
+    assert calls.count('second') == 1
+    manager.shutdown()
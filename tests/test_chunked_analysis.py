@@ -0,0 +1,88 @@
+import random
+import threading
+import time
+
+from chunked_analysis import REDUCE_PROMPT, ChunkedAnalyzer, split_into_chunks
+
+BUDGET = 100
+
+
+def reduce_body(prompt):
+    """取出合并提示中的分析结果部分"""
+    head = REDUCE_PROMPT.split('{partials}')[0].split('\n')[-3]
+    return prompt.split(head, 1)[1].lstrip("\n")
+
+
+def run(analyzer, pages):
+    events = list(analyzer.run(pages, 'a.txt', '问题：测试'))
+    assert events[-1]['type'] == 'result'
+    return events
+
+
+def test_split_respects_budget_and_order():
+    pages = ['甲' * 30, '乙' * 250, '丙\n' * 10, '丁' * 40]
+    chunks = split_into_chunks(pages, len, BUDGET)
+    assert all(len(chunk) <= BUDGET for chunk in chunks)
+    assert ''.join(chunks).replace('\n', '') == ''.join(pages).replace('\n', '')
+
+
+def test_map_results_keep_chunk_order():
+    calls = []
+
+    def complete(messages):
+        prompt = messages[-1]['content']
+        calls.append(prompt)
+        if prompt.startswith('你正在分块'):
+            time.sleep(random.random() / 50)
+            return prompt.split('这是第 ')[1].split('/')[0]
+        return 'done'
+
+    analyzer = ChunkedAnalyzer(complete, len, chunk_tokens=BUDGET, max_concurrency=4)
+    events = run(analyzer, ['字' * 60] * 8)
+    assert events[-1] == {'type': 'result', 'content': 'done', 'chunks': 8}
+    final = reduce_body(calls[-1])
+    positions = [final.index(f'【第 {i} 部分】\n{i}') for i in range(1, 9)]
+    assert positions == sorted(positions)
+
+
+def test_hierarchical_reduce_stays_within_budget():
+    reduce_sizes = []
+
+    def complete(messages):
+        prompt = messages[-1]['content']
+        if not prompt.startswith('你正在分块'):
+            reduce_sizes.append(len(reduce_body(prompt)))
+        # 每份结果都接近一块的预算，无法成组
+        return '果' * (BUDGET - 5)
+
+    analyzer = ChunkedAnalyzer(complete, len, chunk_tokens=BUDGET, max_concurrency=4)
+    events = run(analyzer, ['字' * 90] * 9)
+    stages = [event['stage'] for event in events if event['type'] == 'progress']
+    assert 'reduce-1' in stages
+    assert reduce_sizes and max(reduce_sizes) <= BUDGET + 1
+
+
+def test_close_does_not_wait_for_running_calls():
+    running = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def complete(messages):
+        calls.append(messages)
+        if len(calls) > 1:
+            running.set()
+            release.wait(5)
+        return 'x'
+
+    analyzer = ChunkedAnalyzer(complete, len, chunk_tokens=BUDGET, max_concurrency=1)
+    events = analyzer.run(['字' * 90] * 5, 'a.txt', '')
+    assert next(events)['stage'] == 'split'
+    assert next(events)['completed'] == 1
+    # 第二个调用进行中、其余排队时客户端断开
+    assert running.wait(1)
+    start = time.monotonic()
+    events.close()
+    assert time.monotonic() - start < 1
+    release.set()
+    time.sleep(0.05)
+    assert len(calls) == 2
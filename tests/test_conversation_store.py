@@ -0,0 +1,161 @@
+import threading
+
+from conversation_store import JournaledConversationStore
+from message_model import Message
+
+THREADS = 8
+CONVERSATIONS_PER_THREAD = 5
+MESSAGES_PER_CONVERSATION = 12
+
+
+def snapshot(store):
+    return {
+        conversation['id']: (
+            [message.to_compact() for message in conversation['messages']],
+            conversation['updated_at'],
+            conversation.get('summary')
+        )
+        for conversation in store.get_conversations()
+    }
+
+
+def concurrent_writes(store):
+    """多个线程同时建会话、追加消息、写摘要和删除会话"""
+    errors = []
+
+    def worker(n):
+        try:
+            for c in range(CONVERSATIONS_PER_THREAD):
+                conversation_id = f't{n}-c{c}'
+                store.create_conversation({
+                    'id': conversation_id, 'messages': [],
+                    'created_at': '2026-01-01T00:00:00', 'updated_at': '2026-01-01T00:00:00'
+                })
+                for m in range(MESSAGES_PER_CONVERSATION):
+                    role = 'user' if m % 2 == 0 else 'assistant'
+                    message = Message(role, f'{conversation_id} 第 {m} 条消息 ' * 5, tokens=m,
+                                      reasoning_content=f'推理 {m}' if m % 3 == 0 else None)
+                    assert store.add_message(conversation_id, message, f'2026-01-01T00:{c:02d}:{m:02d}')
+                    if m == 6:
+                        store.set_summary(conversation_id, {'text': f'摘要 {conversation_id}', 'covered': 6})
+                if c % 3 == 2:
+                    assert store.delete_conversation(conversation_id)
+        except Exception as e:  # pragma: no cover - 失败时在主线程报告
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+
+def reopen(tmp_path, **kwargs):
+    store = JournaledConversationStore(str(tmp_path / 'conversations.json'), **kwargs)
+    store.load()
+    return store
+
+
+def test_background_compaction_under_concurrent_writes(tmp_path):
+    # 阈值很小，写入期间会多次触发后台压缩；内存预算很小，大部分会话被换出
+    store = reopen(tmp_path, compact_threshold=25, memory_budget=4096)
+    concurrent_writes(store)
+    expected = snapshot(store)
+    stats = store.stats()
+    store.close()
+    assert (tmp_path / 'conversations.json').exists()
+
+    deleted_per_thread = sum(1 for c in range(CONVERSATIONS_PER_THREAD) if c % 3 == 2)
+    assert len(expected) == THREADS * (CONVERSATIONS_PER_THREAD - deleted_per_thread)
+    assert stats['messages'] == len(expected) * MESSAGES_PER_CONVERSATION
+
+    reloaded = reopen(tmp_path)
+    assert snapshot(reloaded) == expected
+    assert reloaded.stats()['messages'] == stats['messages']
+    assert reloaded.stats()['history_bytes'] == stats['history_bytes']
+    reloaded.close()
+
+
+def test_replay_journal_without_compaction(tmp_path):
+    store = reopen(tmp_path, compact_threshold=10 ** 9)
+    concurrent_writes(store)
+    expected = snapshot(store)
+    store.close()
+    assert not (tmp_path / 'conversations.json').exists()
+
+    reloaded = reopen(tmp_path)
+    assert snapshot(reloaded) == expected
+    # 重放后再压缩一次，结果不变
+    reloaded.compact()
+    reloaded.close()
+    assert snapshot(reopen(tmp_path)) == expected
+
+
+def test_replay_after_interrupted_compaction(tmp_path):
+    store = reopen(tmp_path, compact_threshold=10 ** 9)
+    concurrent_writes(store)
+
+    # 日志轮转之后、快照写出之前失败：轮转的日志留在磁盘上
+    original = store._write_data_file
+    store._write_data_file = lambda *args: (_ for _ in ()).throw(OSError('disk full'))
+    store.compact()
+    store._write_data_file = original
+    assert (tmp_path / 'conversations.json.journal.1').exists()
+
+    # 之后的写入进入新的日志
+    store.create_conversation({'id': 'late', 'messages': [],
+                               'created_at': '2026-01-02T00:00:00', 'updated_at': '2026-01-02T00:00:00'})
+    store.add_message('late', Message('user', '压缩失败后的消息'), '2026-01-02T00:00:01')
+    expected = snapshot(store)
+    store.close()
+
+    reloaded = reopen(tmp_path)
+    assert snapshot(reloaded) == expected
+    reloaded.close()
+
+
+def contents(store, conversation_id):
+    return [message['content'] for message in store.get_conversation(conversation_id)['messages']]
+
+
+def test_evicted_body_pages_in_across_compaction(tmp_path):
+    # 预算只够一个会话常驻
+    store = reopen(tmp_path, compact_threshold=10 ** 9, memory_budget=40)
+    for cid in ('a', 'b'):
+        store.create_conversation({'id': cid, 'messages': [],
+                                   'created_at': '2026-01-01T00:00:00', 'updated_at': '2026-01-01T00:00:00'})
+        for i in range(2):
+            store.add_message(cid, Message('user', f'{cid} 快照前 {i}'), f'2026-01-01T00:00:0{i}')
+    store.compact()
+    assert list(store.conversations) == ['b']
+
+    # a 不常驻时追加的消息留在 tail，不加载正文
+    store.add_message('a', Message('assistant', 'a 快照后'), '2026-01-01T00:01:00')
+    assert 'a' not in store.conversations
+    assert store.meta['a']['tail'][-1]['content'] == 'a 快照后'
+
+    # 换入 a 会换出 b；b 的正文之后从新数据文件读回
+    assert contents(store, 'a') == ['a 快照前 0', 'a 快照前 1', 'a 快照后']
+    assert list(store.conversations) == ['a']
+    store.add_message('b', Message('assistant', 'b 快照后'), '2026-01-01T00:02:00')
+    store.compact()
+    assert store.meta['a']['persisted'] == 3 and store.meta['b']['persisted'] == 3
+    assert contents(store, 'b') == ['b 快照前 0', 'b 快照前 1', 'b 快照后']
+    assert contents(store, 'a') == ['a 快照前 0', 'a 快照前 1', 'a 快照后']
+    assert store.resident_bytes == store.meta['a']['bytes']
+    expected = snapshot(store)
+    store.close()
+
+    reloaded = reopen(tmp_path, memory_budget=40)
+    assert not reloaded.conversations
+    assert snapshot(reloaded) == expected
+    reloaded.close()
+
+
+def test_tokens_cached_but_not_returned_to_clients():
+    message = Message('user', '你好', tokens=3)
+    assert message.get('tokens') == 3
+    assert message.to_compact()[3] == 3
+    assert 'tokens' not in message.to_dict()
+    assert Message.load(message.to_compact()).tokens == 3
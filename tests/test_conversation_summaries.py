@@ -0,0 +1,65 @@
+import pytest
+
+# 时间戳在未来，保证排在其他测试创建的会话之前
+CONVERSATIONS = [
+    ('page-a', '2099-01-01T00:00:00'),
+    ('page-b', '2099-01-02T00:00:00'),
+    ('page-c', '2099-01-03T00:00:00'),
+    ('page-d', '2099-01-03T00:00:00'),
+    ('page-e', '2099-01-04T00:00:00'),
+]
+
+
+@pytest.fixture(scope='module')
+def client(app_module):
+    for conversation_id, updated_at in CONVERSATIONS:
+        if app_module.get_conversation(conversation_id) is None:
+            app_module.conversation_store.create_conversation({
+                'id': conversation_id, 'messages': [], 'created_at': updated_at, 'updated_at': updated_at
+            })
+    return app_module.app.test_client()
+
+
+def test_cursor_pagination_walks_all_pages_in_order(client):
+    seen = []
+    cursor = None
+    while len(seen) < 5:
+        query = {'limit': 2}
+        if cursor:
+            query['cursor'] = cursor
+        data = client.get('/conversations/summary', query_string=query).get_json()
+        assert 1 <= len(data['items']) <= 2
+        assert set(data['items'][0]) == {'id', 'title', 'created_at', 'updated_at', 'message_count'}
+        seen.extend(item['id'] for item in data['items'])
+        cursor = data['next_cursor']
+    # updated_at 相同时按 id 倒序，翻页不重复也不遗漏
+    assert seen[:5] == ['page-e', 'page-d', 'page-c', 'page-b', 'page-a']
+
+
+def test_last_page_has_no_cursor(client):
+    data = client.get('/conversations/summary', query_string={'limit': 200}).get_json()
+    assert data['next_cursor'] is None
+    assert len({item['id'] for item in data['items']}) == len(data['items'])
+
+
+def test_invalid_cursor_is_rejected(client):
+    assert client.get('/conversations/summary?cursor=not-a-cursor').status_code == 400
+    assert client.get('/conversations/summary?limit=abc').status_code == 400
+
+
+def test_if_none_match_returns_304_until_list_changes(client, app_module):
+    first = client.get('/conversations/summary?limit=3')
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and etag
+    assert first.headers['Cache-Control'] == 'no-cache'
+
+    cached = client.get('/conversations/summary?limit=3', headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.data == b''
+
+    app_module.conversation_store.add_message('page-e', {'role': 'user', 'content': '新标题'},
+                                              '2099-01-05T00:00:00')
+    changed = client.get('/conversations/summary?limit=3', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.get_json()['items'][0]['title'] == '新标题'
@@ -0,0 +1,65 @@
+import datetime
+
+import pytest
+
+from conversation_store import JournaledConversationStore, SQLiteConversationStore
+from eviction import EvictionPolicy, select_victims
+from message_model import Message
+
+NOW = datetime.datetime(2026, 1, 10)
+
+
+def day(n):
+    return datetime.datetime(2026, 1, n).isoformat()
+
+
+ENTRIES = [(day(5), 'e', 10), (day(1), 'a', 10), (day(3), 'c', 50), (day(2), 'b', 10), (day(4), 'd', 10)]
+
+
+def test_select_victims_oldest_first_until_within_limits():
+    assert select_victims(ENTRIES, EvictionPolicy(), NOW) == []
+    assert select_victims(ENTRIES, EvictionPolicy(max_count=3), NOW) == ['a', 'b']
+    assert select_victims(ENTRIES, EvictionPolicy(max_age=7.5 * 86400), NOW) == ['a', 'b']
+    # 字节数：删到 c（50 字节）之后才不超限
+    assert select_victims(ENTRIES, EvictionPolicy(max_bytes=40), NOW) == ['a', 'b', 'c']
+    # 多个限制同时生效时取并集
+    assert select_victims(ENTRIES, EvictionPolicy(max_count=4, max_bytes=70), NOW) == ['a', 'b']
+
+
+@pytest.mark.parametrize('backend', ['journal', 'sqlite'])
+def test_delete_skips_conversations_updated_after_selection(tmp_path, backend):
+    if backend == 'journal':
+        store = JournaledConversationStore(str(tmp_path / 'c.json'))
+    else:
+        store = SQLiteConversationStore(str(tmp_path / 'c.db'))
+    store.load()
+    for n, cid in enumerate('abc', 1):
+        store.create_conversation({'id': cid, 'messages': [], 'created_at': day(n), 'updated_at': day(n)})
+
+    victims = select_victims(store.conversation_sizes(), EvictionPolicy(max_count=1), NOW)
+    assert victims == ['a', 'b']
+    # 选出之后 a 又收到新消息
+    store.add_message('a', Message('user', '还在用'), day(11))
+    assert store.delete_conversations(victims, updated_before=NOW.isoformat()) == ['b']
+    assert sorted(summary['id'] for summary in store.list_summaries(10)) == ['a', 'c']
+    store.close()
+
+
+def test_cleanup_keeps_conversation_updated_during_selection(app_module, monkeypatch):
+    store = app_module.conversation_store
+    old = datetime.datetime(2020, 1, 1).isoformat()
+    for cid in ('evict-old', 'evict-busy'):
+        store.create_conversation({'id': cid, 'messages': [], 'created_at': old, 'updated_at': old})
+    sizes = store.conversation_sizes
+
+    def sizes_then_reply():
+        result = sizes()
+        # 模拟选出淘汰对象与删除之间到达的新消息
+        app_module.add_message('evict-busy', 'user', '新消息')
+        return result
+
+    monkeypatch.setattr(store, 'conversation_sizes', sizes_then_reply)
+    monkeypatch.setattr(app_module, 'eviction_policy', EvictionPolicy(max_age=86400))
+    assert app_module.cleanup_conversations() == 1
+    assert app_module.get_conversation('evict-old') is None
+    assert app_module.get_conversation('evict-busy') is not None
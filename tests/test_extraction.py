@@ -0,0 +1,39 @@
+import time
+
+import pytest
+
+import extraction
+from extraction import DocumentExtractor
+
+
+def slow_worker(data, ext, max_chars):
+    time.sleep(30)
+    return [], False
+
+
+def test_cache_hit_skips_worker(tmp_path):
+    extractor = DocumentExtractor(str(tmp_path), max_workers=1)
+    try:
+        first = extractor.extract('第一页内容'.encode('utf-8'), 'a.txt')
+        second = extractor.extract('第一页内容'.encode('utf-8'), 'b.txt')
+    finally:
+        extractor.shutdown()
+    assert first.pages == ['第一页内容'] and not first.cached
+    assert second.pages == first.pages and second.cached
+    assert second.sha256 == first.sha256
+
+
+def test_timeout_recycles_stuck_worker(tmp_path, monkeypatch):
+    extractor = DocumentExtractor(str(tmp_path), max_workers=1, max_pending=1, timeout=0.5)
+    monkeypatch.setattr(extraction, '_extract_worker', slow_worker)
+    try:
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            extractor.extract(b'slow', 'a.txt')
+        assert time.monotonic() - start < 5
+        monkeypatch.undo()
+        # 卡住的进程已被终止，排队名额也已归还，新的提取不受影响
+        document = extractor.extract(b'fast', 'b.txt')
+    finally:
+        extractor.shutdown()
+    assert document.pages == ['fast'] and not document.cached
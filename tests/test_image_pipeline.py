@@ -0,0 +1,30 @@
+import io
+
+from PIL import Image
+
+from image_pipeline import EXIF_ORIENTATION, _process_worker
+
+
+def jpeg_bytes(size, orientation=None):
+    img = Image.new('RGB', size, (200, 100, 50))
+    buffer = io.BytesIO()
+    if orientation is None:
+        img.save(buffer, 'JPEG')
+    else:
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION] = orientation
+        img.save(buffer, 'JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+def test_reports_original_size_after_draft(tmp_path):
+    meta = _process_worker(jpeg_bytes((4000, 3000)), str(tmp_path), 512, 128)
+    assert (meta['width'], meta['height']) == (4000, 3000)
+    assert max(meta['sizes']['large']) <= 512
+
+
+def test_rotated_orientation_swaps_size(tmp_path):
+    meta = _process_worker(jpeg_bytes((4000, 3000), orientation=6), str(tmp_path), 512, 128)
+    assert (meta['width'], meta['height']) == (3000, 4000)
+    large_w, large_h = meta['sizes']['large']
+    assert large_h > large_w
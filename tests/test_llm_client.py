@@ -0,0 +1,68 @@
+import asyncio
+import threading
+
+import pytest
+
+from bench.mock_upstream import MockSettings, start_mock_upstream
+from llm_client import LLMClientManager
+from upstream_router import UpstreamEndpoint, UpstreamRouter
+
+MESSAGES = [{'role': 'user', 'content': '你好'}]
+
+
+@pytest.fixture(scope='module')
+def base_url():
+    server = start_mock_upstream(0, MockSettings(first_token_latency=0, tokens_per_second=10000,
+                                                 reasoning_tokens=2, content_tokens=2))
+    yield f'http://127.0.0.1:{server.server_address[1]}/v1'
+    server.shutdown()
+
+
+def test_threads_share_one_client_and_connection(base_url):
+    connects = []
+    manager = LLMClientManager('test', base_url, on_connect=connects.append)
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(manager.get_client())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(clients) == 8 and all(client is clients[0] for client in clients)
+
+    # 顺序请求复用同一条 keep-alive 连接
+    for _ in range(3):
+        manager.get_client().chat.completions.create(model='m', messages=MESSAGES)
+    assert len(connects) == 1
+
+    http_client = manager._http_client
+    manager.close()
+    assert http_client.is_closed
+    # 关闭后再取会新建客户端
+    assert manager.get_client() is not clients[0]
+    manager.close()
+
+
+def test_async_client_shared_and_closed(base_url):
+    manager = LLMClientManager('test', base_url)
+
+    async def scenario():
+        client = manager.get_async_client()
+        assert manager.get_async_client() is client
+        await client.chat.completions.create(model='m', messages=MESSAGES)
+        http_client = manager._async_http_client
+        await manager.aclose()
+        return http_client
+
+    assert asyncio.run(scenario()).is_closed
+    assert manager._async_client is None
+
+
+def test_router_shutdown_closes_every_endpoint_client(base_url):
+    managers = [LLMClientManager('test', base_url) for _ in range(2)]
+    router = UpstreamRouter([UpstreamEndpoint(f'e{i}', manager, 'm') for i, manager in enumerate(managers)])
+    http_clients = []
+    for manager in managers:
+        manager.get_client()
+        http_clients.append(manager._http_client)
+    router.close()
+    assert all(client.is_closed for client in http_clients)
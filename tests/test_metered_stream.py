@@ -0,0 +1,53 @@
+import threading
+import time
+from contextlib import closing
+from types import SimpleNamespace
+
+from rate_limit import AdmissionController, AdmittedStream
+from sse import AnswerStream, FlushPolicy
+
+
+class StalledUpstream:
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content='a', reasoning_content=None))])
+        self.closed.wait(5)
+        raise ConnectionError('closed')
+
+    def close(self):
+        self.closed.set()
+
+
+def test_close_during_stall_closes_upstream_and_releases_slot(app_module, monkeypatch):
+    admission = AdmissionController(max_concurrent=1, max_queue=1, timeout=1)
+    upstream = StalledUpstream()
+
+    def create_chat_completion(messages, stream=False, priority=0):
+        admission.acquire()
+        return AdmittedStream(upstream, admission.release)
+
+    monkeypatch.setattr(app_module, 'create_chat_completion', create_chat_completion)
+    stream = AnswerStream(content_policy=FlushPolicy(max_delay=0.05, max_bytes=4096, sentence=False))
+
+    def frames():
+        with closing(app_module.MeteredStream([], 'ask')) as chunks:
+            yield from stream.iter_frames(chunks)
+
+    generator = frames()
+    next(generator)
+    start = time.monotonic()
+    generator.close()
+    assert time.monotonic() - start < 1
+    assert upstream.closed.is_set()
+    assert admission.stats()['active'] == 0
+
+
+def test_close_before_iteration_closes_new_upstream(app_module, monkeypatch):
+    upstream = StalledUpstream()
+    monkeypatch.setattr(app_module, 'create_chat_completion', lambda *args, **kwargs: upstream)
+    metered = app_module.MeteredStream([], 'ask')
+    metered.close()
+    assert list(metered) == []
+    assert upstream.closed.is_set()
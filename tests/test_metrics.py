@@ -0,0 +1,88 @@
+import math
+import re
+
+from metrics import MetricsRegistry
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\\n]|\\[\\"n])*)"(,|$)')
+SUFFIXES = {'histogram': ('_bucket', '_sum', '_count'), 'counter': ('', '_total'), 'gauge': ('',)}
+
+
+def parse_labels(text):
+    labels, pos = {}, 0
+    while pos < len(text):
+        match = LABEL.match(text, pos)
+        assert match, f'bad labels: {text!r}'
+        labels[match.group(1)] = match.group(2).replace('\\n', '\n').replace('\\"', '"').replace('\\\\', '\\')
+        pos = match.end()
+    return labels
+
+
+def parse(text):
+    """按 Prometheus 文本格式 0.0.4 解析，返回 {指标名: (类型, [(样本名, 标签, 值)])}"""
+    assert text.endswith('\n')
+    families = {}
+    for line in text.splitlines():
+        if line.startswith('# HELP '):
+            continue
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ')
+            assert name not in families, f'duplicate family {name}'
+            families[name] = (kind, [])
+            continue
+        match = SAMPLE.match(line)
+        assert match, f'bad sample line: {line!r}'
+        name, labels, value = match.groups()
+        family = next(f for f in families if name in (f + s for s in SUFFIXES[families[f][0]]))
+        families[family][1].append((name, parse_labels(labels or ''), float(value)))
+    return families
+
+
+def check_histograms(families):
+    for family, (kind, samples) in families.items():
+        if kind != 'histogram':
+            continue
+        series = {}
+        for name, labels, value in samples:
+            key = tuple(sorted((k, v) for k, v in labels.items() if k != 'le'))
+            series.setdefault(key, {'buckets': []})
+            if name.endswith('_bucket'):
+                series[key]['buckets'].append((float(labels['le']), value))
+            else:
+                series[key][name[len(family) + 1:]] = value
+        for values in series.values():
+            bounds = [bound for bound, _ in values['buckets']]
+            counts = [count for _, count in values['buckets']]
+            assert bounds == sorted(bounds) and math.isinf(bounds[-1])
+            assert counts == sorted(counts)
+            assert counts[-1] == values['count']
+
+
+def test_registry_output_is_parseable_with_escaped_labels():
+    registry = MetricsRegistry()
+    counter = registry.counter('t_requests_total', '请求数', ['path'])
+    counter.inc(path='/a"b\\c\nd')
+    registry.gauge('t_active', '活跃数', function=lambda: 3)
+    histogram = registry.histogram('t_seconds', '耗时', ['endpoint'], buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, endpoint='ask')
+
+    families = parse(registry.render())
+    assert families['t_requests_total'] == ('counter', [('t_requests_total', {'path': '/a"b\\c\nd'}, 1.0)])
+    assert families['t_active'] == ('gauge', [('t_active', {}, 3.0)])
+    check_histograms(families)
+    buckets = [value for name, _, value in families['t_seconds'][1] if name == 't_seconds_bucket']
+    assert buckets == [1, 2, 3]
+
+
+def test_metrics_endpoint_is_parseable(app_module):
+    client = app_module.app.test_client()
+    client.get('/conversations/summary')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    families = parse(response.get_data(as_text=True))
+    check_histograms(families)
+    assert families['pip_http_request_seconds'][0] == 'histogram'
+    assert any(labels.get('endpoint') == 'list_conversation_summaries_route'
+               for _, labels, _ in families['pip_http_request_seconds'][1])
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from rate_limit import AdmissionController, UpstreamBusyError
+
+
+def test_cancelled_async_waiter_does_not_leak_slot():
+    admission = AdmissionController(max_concurrent=1, max_queue=10, timeout=5)
+
+    async def scenario():
+        admission.acquire()
+        waiter = asyncio.create_task(admission.acquire_async())
+        await asyncio.sleep(0.01)
+        assert admission.stats()['queue_depth'] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        admission.release()
+        await asyncio.sleep(0.01)
+
+    asyncio.run(scenario())
+    stats = admission.stats()
+    assert stats['active'] == 0
+    assert stats['queue_depth'] == 0
+
+
+def test_cancel_after_grant_returns_slot():
+    admission = AdmissionController(max_concurrent=1, max_queue=10, timeout=5)
+
+    async def scenario():
+        admission.acquire()
+        waiter = asyncio.create_task(admission.acquire_async())
+        await asyncio.sleep(0.01)
+        # 名额分配（回调排入事件循环）后、协程恢复前取消
+        admission.release()
+        waiter.cancel()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        else:
+            # wait_for 可能先看到结果而吞掉取消，此时名额归调用方
+            admission.release()
+        await asyncio.sleep(0.01)
+
+    asyncio.run(scenario())
+    assert admission.stats()['active'] == 0
+
+
+def test_async_waiters_admitted_in_priority_order():
+    admission = AdmissionController(max_concurrent=1, max_queue=10, timeout=5)
+    order = []
+
+    async def waiter(name, priority):
+        await admission.acquire_async(priority)
+        order.append(name)
+        admission.release()
+
+    async def scenario():
+        admission.acquire()
+        tasks = [asyncio.create_task(waiter('low', 2)), asyncio.create_task(waiter('high', 0))]
+        await asyncio.sleep(0.01)
+        admission.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert order == ['high', 'low']
+    assert admission.stats()['active'] == 0
+
+
+def test_async_waiter_times_out():
+    admission = AdmissionController(max_concurrent=1, max_queue=10, timeout=0.05)
+
+    async def scenario():
+        admission.acquire()
+        with pytest.raises(UpstreamBusyError):
+            await admission.acquire_async()
+
+    asyncio.run(scenario())
+    stats = admission.stats()
+    assert stats['active'] == 1
+    assert stats['queue_depth'] == 0
+    assert stats['rejected'] == 1
+
+
+def test_thread_and_async_waiters_share_queue():
+    admission = AdmissionController(max_concurrent=1, max_queue=10, timeout=5)
+    admitted = []
+
+    def thread_waiter():
+        admission.acquire(priority=1)
+        admitted.append('thread')
+        admission.release()
+
+    async def scenario():
+        admission.acquire()
+        thread = threading.Thread(target=thread_waiter)
+        thread.start()
+        time.sleep(0.05)
+        task = asyncio.create_task(admission.acquire_async(priority=0))
+        await asyncio.sleep(0.01)
+        admission.release()
+        await task
+        admitted.append('async')
+        admission.release()
+        await asyncio.to_thread(thread.join)
+
+    asyncio.run(scenario())
+    assert admitted == ['async', 'thread']
+    assert admission.stats()['active'] == 0
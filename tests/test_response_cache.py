@@ -0,0 +1,17 @@
+from response_cache import ResponseCache
+
+
+def test_size_counts_utf8_bytes():
+    cache = ResponseCache(max_entries=10, max_bytes=1000)
+    cache.set('ascii', {'content': 'a' * 30})
+    cache.set('cjk', {'content': '中' * 30})
+    assert cache.stats()['bytes'] == 30 + 90
+
+
+def test_eviction_by_bytes():
+    cache = ResponseCache(max_entries=10, max_bytes=100)
+    cache.set('first', {'content': '中' * 20})
+    cache.set('second', {'content': '文' * 20})
+    # 两条共 120 字节，超过上限时淘汰最早的一条
+    assert cache.get('first') is None
+    assert cache.get('second') == {'content': '文' * 20}
@@ -0,0 +1,35 @@
+import pytest
+
+from resumable_stream import ResumableStream, parse_event_id
+
+
+def frames(count):
+    for i in range(count):
+        yield f"data: {i}\n\n"
+
+
+def test_resume_continues_after_event():
+    stream = ResumableStream('c:m', frames(5), grace=0)
+    first = stream.subscribe()
+    received = [next(first), next(first)]
+    assert received[-1].startswith('id: c:m:2\n')
+    rest = list(stream.subscribe(after=2))
+    assert [f.split('\n')[0] for f in rest] == ['id: c:m:3', 'id: c:m:4', 'id: c:m:5']
+
+
+def test_resume_beyond_head_is_rejected():
+    stream = ResumableStream('c:m', frames(5), grace=0)
+    first = stream.subscribe()
+    next(first)
+    with pytest.raises(ValueError):
+        stream.subscribe(after=5)
+    with pytest.raises(ValueError):
+        stream.subscribe(after=-1)
+    # 被拒绝的续传不计入订阅者
+    assert stream.subscribers == 1
+
+
+def test_parse_event_id():
+    assert parse_event_id('conv:msg:12') == ('conv:msg', 12)
+    assert parse_event_id('conv:msg:x') is None
+    assert parse_event_id('') is None
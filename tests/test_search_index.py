@@ -0,0 +1,187 @@
+import math
+import random
+
+from conversation_store import JournaledConversationStore, SQLiteConversationStore
+from message_model import Message
+from search_index import HistorySearchIndex, StoreSearchIndex, tokenize
+
+
+def brute_force(conversations, query, k1=1.2, b=0.75):
+    docs = [(cid, pos, tokenize(text)) for cid, texts in conversations.items() for pos, text in enumerate(texts)]
+    n = len(docs)
+    avgdl = sum(len(tokens) for _, _, tokens in docs) / n
+    scores = {}
+    for term in set(tokenize(query)):
+        matching = [d for d in docs if term in d[2]]
+        df = len(matching)
+        if not df:
+            continue
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        for cid, pos, tokens in matching:
+            tf = tokens.count(term)
+            scores[(cid, pos)] = scores.get((cid, pos), 0.0) + \
+                idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(tokens) / avgdl))
+    return scores
+
+
+def build_corpus(seed=7, conversations=40, messages=50):
+    rng = random.Random(seed)
+    corpus = {}
+    for c in range(conversations):
+        texts = []
+        for _ in range(messages):
+            words = ['common'] * rng.randint(1, 3)
+            if rng.random() < 0.05:
+                words.append('rare')
+            if rng.random() < 0.5:
+                words.append('medium')
+            if rng.random() < 0.002:
+                words.append('scarce')
+            if rng.random() < 0.1:
+                words.append('frequent')
+            words.extend(f'w{rng.randint(0, 300)}' for _ in range(rng.randint(2, 20)))
+            rng.shuffle(words)
+            texts.append(' '.join(words))
+        corpus[f'c{c}'] = texts
+    return corpus
+
+
+def test_pruned_search_matches_full_scoring():
+    corpus = build_corpus()
+    index = HistorySearchIndex()
+    for cid, texts in corpus.items():
+        for text in texts:
+            index.add_message(cid, text)
+
+    queries = ('rare common', 'rare medium common', 'common', 'w5 common', 'w5 w6 rare',
+               'scarce frequent', 'scarce rare frequent')
+    for query in queries:
+        expected = brute_force(corpus, query)
+        for limit in (1, 5, 20):
+            hits = index.search(query, limit)
+            assert len(hits) == min(limit, len(expected))
+            top = sorted(expected.values(), reverse=True)[:limit]
+            assert [round(score, 9) for _, _, score in hits] == [round(score, 9) for score in top]
+            for cid, pos, score in hits:
+                assert math.isclose(expected[(cid, pos)], score)
+
+
+def test_sqlite_index_is_shared_between_store_instances(tmp_path):
+    path = str(tmp_path / 'conversations.db')
+    writer, reader = SQLiteConversationStore(path), SQLiteConversationStore(path)
+    if not writer.full_text:
+        return
+    for cid in ('a', 'b'):
+        writer.create_conversation({'id': cid, 'created_at': '2026-01-01T00:00:00',
+                                    'updated_at': '2026-01-01T00:00:00'})
+    writer.add_message('a', Message('user', '如何部署 flask 应用'), '2026-01-01T00:00:01')
+    writer.add_message('a', Message('assistant', '使用 gunicorn 部署'), '2026-01-01T00:00:02')
+    writer.add_message('b', Message('user', '今天天气怎么样'), '2026-01-01T00:00:03')
+
+    index = StoreSearchIndex(reader)
+    assert index.message_count == 3
+    hits = index.search('部署', 10)
+    assert sorted((cid, pos) for cid, pos, _ in hits) == [('a', 0), ('a', 1)]
+    assert all(score > 0 for _, _, score in hits)
+
+    writer.delete_conversation('a')
+    assert index.search('部署', 10) == []
+    assert index.message_count == 1
+
+    # 旧数据库没有索引时重建
+    conn = reader._connect()
+    conn.execute('DELETE FROM message_terms')
+    index.rebuild([])
+    assert [(cid, pos) for cid, pos, _ in index.search('天气', 10)] == [('b', 0)]
+    writer.close()
+    reader.close()
+
+
+def test_purge_and_reload_match_fresh_index(tmp_path):
+    corpus = build_corpus(seed=11, conversations=30, messages=20)
+    path = str(tmp_path / 'conversations.index')
+    index = HistorySearchIndex(path, save_every=10 ** 9)
+    for cid, texts in corpus.items():
+        for text in texts:
+            index.add_message(cid, text)
+
+    # 删除一半以上的会话，保存时触发重排
+    removed = [cid for i, cid in enumerate(corpus) if i % 3 != 0]
+    for cid in removed:
+        index.remove_conversation(cid)
+    remaining = {cid: texts for cid, texts in corpus.items() if cid not in removed}
+    queries = ('rare common', 'medium', 'w1 w2 w3', 'scarce frequent', 'common')
+    # 重排前 df 仍计入打了删除标记的文档，得分可能不同，但不会返回已删除的会话
+    for query in queries:
+        assert all(cid in remaining for cid, _, _ in index.search(query, 15))
+
+    index.save()
+    assert len(index._doc_conv) == index.live_docs == sum(len(t) for t in remaining.values())
+    reloaded = HistorySearchIndex(path)
+    assert reloaded.load()
+
+    fresh = HistorySearchIndex()
+    fresh.rebuild({'id': cid, 'messages': [{'content': text} for text in texts]}
+                  for cid, texts in remaining.items())
+
+    for query in queries:
+        expected = fresh.search(query, 15)
+        for hits in (index.search(query, 15), reloaded.search(query, 15)):
+            assert [(cid, pos) for cid, pos, _ in hits] == [(cid, pos) for cid, pos, _ in expected]
+            assert all(math.isclose(a[2], b[2]) for a, b in zip(hits, expected))
+        assert all(cid in remaining for cid, _, _ in expected)
+
+    # 重排之后继续增量更新，新消息的序号接着原会话往下排
+    cid = next(iter(remaining))
+    reloaded.add_message(cid, 'purged scarce')
+    assert (cid, len(remaining[cid])) in [(c, p) for c, p, _ in reloaded.search('purged', 5)]
+
+
+def test_hit_lookup_does_not_page_in_bodies(tmp_path):
+    store = JournaledConversationStore(str(tmp_path / 'c.json'), memory_budget=1)
+    store.load()
+    for cid in ('a', 'b', 'c'):
+        store.create_conversation({'id': cid, 'messages': [], 'created_at': 't', 'updated_at': 't'})
+        for i in range(3):
+            store.add_message(cid, Message('user', f'{cid} 第 {i} 条'), f't{i}')
+    store.compact()
+    store.add_message('a', Message('assistant', 'a 快照之后'), 't9')
+    resident = list(store.conversations)
+    assert 'a' not in resident
+
+    messages = store.get_messages('a', [1, 3, 7])
+    assert {p: m['content'] for p, m in messages.items()} == {1: 'a 第 1 条', 3: 'a 快照之后'}
+    summaries = store.get_summaries(['a', 'b', 'x'])
+    assert sorted(summaries) == ['a', 'b']
+    assert summaries['a']['title'] == 'a 第 0 条' and summaries['a']['message_count'] == 4
+    assert list(store.conversations) == resident
+    store.close()
+
+
+def test_sqlite_hit_lookup(tmp_path):
+    store = SQLiteConversationStore(str(tmp_path / 'c.db'))
+    store.create_conversation({'id': 'a', 'created_at': 't', 'updated_at': 't'})
+    for i in range(3):
+        store.add_message('a', Message('user', f'第 {i} 条'), f't{i}')
+    assert {p: m['content'] for p, m in store.get_messages('a', [0, 2, 5]).items()} == {0: '第 0 条', 2: '第 2 条'}
+    summaries = store.get_summaries(['a', 'x'])
+    assert list(summaries) == ['a'] and summaries['a']['message_count'] == 3
+    store.close()
+
+
+def test_search_route_does_not_load_conversations(app_module, monkeypatch):
+    conversation = app_module.create_conversation()
+    app_module.add_message(conversation['id'], 'user', '如何配置 nginx 反向代理')
+
+    def fail(conversation_id):
+        raise AssertionError('search should not load whole conversations')
+
+    monkeypatch.setattr(app_module, 'get_conversation', fail)
+    monkeypatch.setattr(app_module.conversation_store, 'get_conversation', fail)
+    response = app_module.app.test_client().get('/conversations/search?q=nginx')
+    assert response.status_code == 200
+    items = response.get_json()['items']
+    assert [(item['conversation_id'], item['message_index'], item['role']) for item in items] == \
+        [(conversation['id'], 0, 'user')]
+    assert items[0]['title'] == '如何配置 nginx 反向代理'
+    assert '<mark>nginx</mark>' in items[0]['snippet']
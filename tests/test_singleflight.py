@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+FOLLOWERS = 4
+
+
+def run_concurrently(flights, key, fn):
+    """一个领头调用阻塞期间，其余调用加入同一 key"""
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flights.do(key, fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(FOLLOWERS + 1)]
+    threads[0].start()
+    return threads, results, errors
+
+
+def test_leader_and_followers_share_one_call():
+    flights = SingleFlight()
+    entered = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        entered.set()
+        release.wait(5)
+        return {'answer': 42}
+
+    threads, results, errors = run_concurrently(flights, 'k', fn)
+    assert entered.wait(1)
+    for thread in threads[1:]:
+        thread.start()
+    while flights.stats()['coalesced'] < FOLLOWERS:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(1)
+
+    assert calls == [1]
+    assert errors == []
+    assert len(results) == FOLLOWERS + 1
+    assert all(result is results[0] for result in results)
+    assert flights.stats() == {'in_flight_calls': 0, 'in_flight_streams': 0, 'coalesced': FOLLOWERS}
+    # 调用结束后同一 key 重新发起
+    assert flights.do('k', lambda: 'again') == 'again'
+
+
+def test_exception_reaches_all_waiters():
+    flights = SingleFlight()
+    entered = threading.Event()
+    release = threading.Event()
+    error = RuntimeError('upstream down')
+
+    def fn():
+        entered.set()
+        release.wait(5)
+        raise error
+
+    threads, results, errors = run_concurrently(flights, 'k', fn)
+    assert entered.wait(1)
+    for thread in threads[1:]:
+        thread.start()
+    while flights.stats()['coalesced'] < FOLLOWERS:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(1)
+
+    assert results == []
+    assert errors == [error] * (FOLLOWERS + 1)
+    assert flights.stats()['in_flight_calls'] == 0
+
+
+def test_stream_subscribers_replay_shared_chunks():
+    flights = SingleFlight()
+    opened = []
+
+    def factory():
+        opened.append(1)
+        return iter(['a', 'b', 'c'])
+
+    first = flights.stream('k', factory)
+    iterator = iter(first)
+    assert next(iterator) == 'a'
+    second = flights.stream('k', factory)
+    assert list(second) == ['a', 'b', 'c']
+    assert list(iterator) == ['b', 'c']
+    assert opened == [1]
+
+    def failing():
+        raise RuntimeError('boom')
+
+    # 创建上游失败时异常抛给调用方，也不留下进行中的流
+    with pytest.raises(RuntimeError):
+        flights.stream('x', failing)
+    assert flights.stats()['in_flight_streams'] == 0
@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from sse import AnswerStream, FlushBuffer, FlushPolicy
+
+
+def chunk(content=None, reasoning=None):
+    delta = SimpleNamespace(content=content, reasoning_content=reasoning)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+POLICY = FlushPolicy(max_delay=0.05, max_bytes=4096, sentence=False)
+
+
+def test_flush_buffer_deadline():
+    now = [0.0]
+    buffer = FlushBuffer(POLICY, clock=lambda: now[0])
+    assert buffer.add('a') == 'a'
+    assert buffer.deadline() is None
+    now[0] = 0.01
+    assert buffer.add('b') is None
+    assert buffer.deadline() == 0.05
+    assert buffer.due(0.04) is None
+    assert buffer.due(0.05) == 'b'
+    assert buffer.deadline() is None
+
+
+def test_iter_frames_flushes_while_upstream_stalls():
+    release = threading.Event()
+    closed = []
+
+    def upstream():
+        try:
+            yield chunk('你')
+            yield chunk('好')
+            # 上游停顿，缓冲中的“好”应按 max_delay 发出，而不是等到下一个 chunk
+            release.wait(5)
+            yield chunk('！')
+        finally:
+            closed.append(True)
+
+    stream = AnswerStream(content_policy=POLICY)
+    frames = stream.iter_frames(upstream())
+    start = time.monotonic()
+    received = [next(frames), next(frames)]
+    elapsed = time.monotonic() - start
+    assert '你' in received[0] and '好' in received[1]
+    assert elapsed < 1
+    release.set()
+    rest = list(frames) + stream.finish()
+    assert any('！' in frame for frame in rest)
+    assert closed == [True]
+
+
+class StalledUpstream:
+    """产出一个 chunk 后停顿，close() 可从其他线程打断停顿"""
+
+    def __init__(self, stall=5):
+        self.stall = stall
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        yield chunk('a')
+        if self.closed.wait(self.stall):
+            raise ConnectionError('closed')
+        yield chunk('b')
+
+    def close(self):
+        self.closed.set()
+
+
+def test_iter_frames_close_during_stall_returns_quickly():
+    upstream = StalledUpstream()
+    stream = AnswerStream(content_policy=POLICY)
+    frames = stream.iter_frames(upstream)
+    next(frames)
+    start = time.monotonic()
+    # 不等读取线程退出，调用方随即关闭上游
+    frames.close()
+    upstream.close()
+    assert time.monotonic() - start < 1
+    assert upstream.closed.is_set()
+
+
+def test_iter_frames_propagates_errors():
+    def upstream():
+        yield chunk('a')
+        raise RuntimeError('boom')
+
+    stream = AnswerStream(content_policy=POLICY)
+    try:
+        list(stream.iter_frames(upstream()))
+    except RuntimeError as e:
+        assert str(e) == 'boom'
+    else:
+        raise AssertionError('expected RuntimeError')
+
+
+def test_aiter_frames_flushes_while_upstream_stalls():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def upstream():
+            yield chunk('你')
+            yield chunk('好')
+            await release.wait()
+            yield chunk('！')
+
+        stream = AnswerStream(content_policy=POLICY)
+        frames = stream.aiter_frames(upstream())
+        received = [await frames.__anext__()]
+        received.append(await asyncio.wait_for(frames.__anext__(), 1))
+        assert '好' in received[1]
+        release.set()
+        rest = [frame async for frame in frames]
+        return rest + stream.finish()
+
+    rest = asyncio.run(scenario())
+    assert any('！' in frame for frame in rest)
+
+
+def test_aiter_frames_close_cancels_pending_read():
+    async def scenario():
+        state = []
+
+        async def upstream():
+            try:
+                yield chunk('a')
+                await asyncio.sleep(10)
+                yield chunk('b')
+            finally:
+                state.append('closed')
+
+        source = upstream()
+        stream = AnswerStream(content_policy=POLICY)
+        frames = stream.aiter_frames(source)
+        await frames.__anext__()
+        task = asyncio.ensure_future(frames.__anext__())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await frames.aclose()
+        await source.aclose()
+        return state
+
+    assert asyncio.run(scenario()) == ['closed']
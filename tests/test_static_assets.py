@@ -0,0 +1,80 @@
+import gzip
+import hashlib
+import os
+
+import pytest
+from flask import Flask
+
+from static_assets import IMMUTABLE_CACHE, REVALIDATE_CACHE, StaticAssets
+
+SCRIPT = ('console.log("静态资源");\n' * 100).encode('utf-8')
+
+
+@pytest.fixture
+def site(tmp_path):
+    static_dir = tmp_path / 'static'
+    (static_dir / 'js').mkdir(parents=True)
+    (static_dir / 'js' / 'main.js').write_bytes(SCRIPT)
+    (static_dir / 'js' / 'main.js.bak').write_bytes(b'old')
+    (static_dir / 'tiny.css').write_bytes(b'a{}')
+    app = Flask(__name__, static_folder=str(static_dir))
+    assets = StaticAssets(app.static_folder)
+    app.view_functions['static'] = assets.serve
+    return assets, app.test_client(), static_dir
+
+
+def test_build_precompresses_text_assets(site):
+    assets, _, _ = site
+    assert assets.build() == 2
+    script = assets.get('js/main.js')
+    assert script.digest == hashlib.sha256(SCRIPT).hexdigest()[:16]
+    assert gzip.decompress(script.variants['gzip']) == SCRIPT
+    # 太小的文件不压缩
+    assert assets.get('tiny.css').variants == {}
+
+
+def test_versioned_url_is_immutable(site):
+    assets, client, _ = site
+    url = assets.url('js/main.js')
+    assert url == f"/static/js/main.js?v={hashlib.sha256(SCRIPT).hexdigest()[:16]}"
+    assert client.get(url).headers['Cache-Control'] == IMMUTABLE_CACHE
+    assert client.get('/static/js/main.js').headers['Cache-Control'] == REVALIDATE_CACHE
+    # 版本号不匹配（旧页面引用）时不能长期缓存
+    assert client.get('/static/js/main.js?v=stale').headers['Cache-Control'] == REVALIDATE_CACHE
+    assert assets.url('missing.js') == '/static/missing.js'
+
+
+def test_precompressed_variant_follows_accept_encoding(site):
+    assets, client, _ = site
+    assets.build()
+    compressed = client.get('/static/js/main.js', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(compressed.data) == SCRIPT
+
+    plain = client.get('/static/js/main.js', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.data == SCRIPT
+    assert plain.headers['ETag'] != compressed.headers['ETag']
+
+    revalidated = client.get('/static/js/main.js', headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': compressed.headers['ETag']
+    })
+    assert revalidated.status_code == 304
+
+
+def test_changed_file_gets_new_digest(site):
+    assets, client, static_dir = site
+    old_url = assets.url('js/main.js')
+    path = static_dir / 'js' / 'main.js'
+    path.write_bytes(SCRIPT + b'// v2\n')
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert assets.url('js/main.js') != old_url
+    assert client.get('/static/js/main.js').data.endswith(b'// v2\n')
+
+
+def test_missing_and_escaping_paths_are_404(site):
+    _, client, _ = site
+    assert client.get('/static/nope.js').status_code == 404
+    assert client.get('/static/../secret.txt').status_code == 404
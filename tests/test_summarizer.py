@@ -0,0 +1,89 @@
+import threading
+
+from conversation_store import JournaledConversationStore
+from message_model import Message
+from summarizer import ConversationSummarizer
+
+SYSTEM = {'role': 'system', 'content': '系统'}
+
+
+def count_tokens(message):
+    return len(message['content'])
+
+
+def conversation(count, summary=None):
+    messages = [{'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'消息{i:02d}'} for i in range(count)]
+    result = {'id': 'c', 'messages': messages}
+    if summary:
+        result['summary'] = summary
+    return result
+
+
+def test_needs_summary_threshold():
+    summarizer = ConversationSummarizer(lambda messages: '', count_tokens, trigger_tokens=20, keep_recent=2)
+    # 每条 4 个 token：5 条共 20，未超过阈值
+    assert not summarizer.needs_summary(conversation(5))
+    assert summarizer.needs_summary(conversation(6))
+    # 已被摘要覆盖的部分不再计入
+    assert not summarizer.needs_summary(conversation(8, {'content': 's', 'upto': 3, 'tokens': 1}))
+    # 待摘要的消息都在最近 keep_recent 条内
+    assert not ConversationSummarizer(lambda messages: '', count_tokens, trigger_tokens=0,
+                                      keep_recent=6).needs_summary(conversation(6))
+
+
+def test_summarize_merges_only_new_messages():
+    prompts = []
+
+    def complete(messages):
+        prompts.append(messages[-1]['content'])
+        return '新摘要'
+
+    summarizer = ConversationSummarizer(complete, count_tokens, trigger_tokens=0, keep_recent=2)
+    summary = summarizer.summarize(conversation(7, {'content': '旧摘要', 'upto': 3, 'tokens': 3}))
+    assert summary == {'content': '新摘要', 'upto': 5, 'tokens': 3}
+    assert '已有摘要：\n旧摘要' in prompts[0]
+    assert [f'消息{i:02d}' in prompts[0] for i in range(7)] == [False] * 3 + [True] * 2 + [False] * 2
+    assert summarizer.summarize(conversation(7, summary)) is None
+
+
+def test_apply_sends_summary_and_uncovered_messages():
+    current = conversation(7, {'content': '旧摘要', 'upto': 5, 'tokens': 3})
+    prompt, history = ConversationSummarizer.apply(SYSTEM, current)
+    assert prompt['content'].endswith('旧摘要')
+    assert SYSTEM['content'] == '系统'
+    assert history == current['messages'][5:]
+    assert ConversationSummarizer.apply(SYSTEM, conversation(3)) == (SYSTEM, conversation(3)['messages'])
+
+
+def test_message_added_during_background_summary_is_kept(tmp_path):
+    store = JournaledConversationStore(str(tmp_path / 's.json'), str(tmp_path / 'j.log'))
+    store.load()
+    store.create_conversation({'id': 'c', 'messages': [], 'created_at': 't', 'updated_at': 't'})
+    for message in conversation(6)['messages']:
+        store.add_message('c', Message(message['role'], message['content']), 't')
+
+    started = threading.Event()
+    release = threading.Event()
+    saved = threading.Event()
+
+    def complete(messages):
+        started.set()
+        release.wait(5)
+        return '摘要'
+
+    def save(conversation_id, summary):
+        result = store.set_summary(conversation_id, summary)
+        saved.set()
+        return result
+
+    summarizer = ConversationSummarizer(complete, count_tokens, trigger_tokens=0, keep_recent=2)
+    summarizer.summarize_in_background('c', store.get_conversation, save)
+    assert started.wait(1)
+    # 摘要进行中追加新消息
+    store.add_message('c', Message('user', '新消息'), 't2')
+    release.set()
+    assert saved.wait(1)
+
+    _, history = ConversationSummarizer.apply(SYSTEM, store.get_conversation('c'))
+    assert [message['content'] for message in history] == ['消息04', '消息05', '新消息']
+    store.close()
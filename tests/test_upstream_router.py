@@ -0,0 +1,180 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from upstream_router import UpstreamEndpoint, UpstreamRouter
+
+REQUEST = httpx.Request('POST', 'http://upstream.test/v1/chat/completions')
+
+
+def connection_error():
+    return openai.APIConnectionError(request=REQUEST)
+
+
+def bad_request():
+    return openai.BadRequestError('bad', response=httpx.Response(400, request=REQUEST), body=None)
+
+
+class FakeStream:
+    def __init__(self, chunks, first_delay=0.0):
+        self.chunks = chunks
+        self.first_delay = first_delay
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        time.sleep(self.first_delay)
+        for chunk in self.chunks:
+            if self.closed.is_set():
+                return
+            yield chunk
+
+    def close(self):
+        self.closed.set()
+
+
+class FakeClients:
+    """按顺序返回预设的结果：异常则抛出，其余原样返回"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **params):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    async def _acreate(self, **params):
+        return self._create(**params)
+
+    def get_client(self):
+        return self
+
+    def get_async_client(self):
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self._acreate)))
+
+    def close(self):
+        pass
+
+
+def endpoint(name, clients, ttfts=()):
+    e = UpstreamEndpoint(name, clients, 'model')
+    e.ttfts.extend(ttfts)
+    return e
+
+
+def wait_idle(*endpoints, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while any(e.active for e in endpoints):
+        assert time.monotonic() < deadline, [e.active for e in endpoints]
+        time.sleep(0.01)
+
+
+def test_complete_retries_on_another_endpoint():
+    a = endpoint('a', FakeClients(connection_error()), ttfts=[0.01])
+    b = endpoint('b', FakeClients('ok'), ttfts=[0.5])
+    router = UpstreamRouter([a, b], max_retries=2, backoff=0)
+
+    assert router.complete(messages=[]) == 'ok'
+    assert (a.clients.calls, b.clients.calls) == (1, 1)
+    assert router.retries == 1
+    assert (a.failures, b.failures) == (1, 0)
+    assert a.active == b.active == 0
+
+
+def test_complete_does_not_retry_client_errors():
+    a = endpoint('a', FakeClients(bad_request()), ttfts=[0.01])
+    b = endpoint('b', FakeClients('ok'), ttfts=[0.5])
+    router = UpstreamRouter([a, b], max_retries=2, backoff=0)
+
+    with pytest.raises(openai.BadRequestError):
+        router.complete(messages=[])
+    assert b.clients.calls == 0
+    # 参数错误不是上游的问题，不计入失败
+    assert a.failures == 0 and a.active == 0
+
+
+def test_stream_retries_before_first_chunk():
+    a = endpoint('a', FakeClients(connection_error()), ttfts=[0.01])
+    b = endpoint('b', FakeClients(FakeStream(['x', 'y'])), ttfts=[0.5])
+    router = UpstreamRouter([a, b], max_retries=1, backoff=0)
+
+    stream = router.stream(messages=[])
+    assert list(stream) == ['x', 'y']
+    assert router.retries == 1
+    assert a.active == b.active == 0
+
+
+def test_retries_exhausted_raises_last_error():
+    a = endpoint('a', FakeClients(connection_error()))
+    b = endpoint('b', FakeClients(connection_error()))
+    router = UpstreamRouter([a, b], max_retries=1, backoff=0)
+
+    with pytest.raises(openai.APIConnectionError):
+        router.complete(messages=[])
+    assert a.clients.calls + b.clients.calls == 2
+    assert a.active == b.active == 0
+
+
+def test_hedge_cancels_slow_primary():
+    slow = FakeStream(['slow'], first_delay=0.3)
+    fast = FakeStream(['fast', 'done'])
+    a = endpoint('a', FakeClients(slow), ttfts=[0.01] * 20)
+    b = endpoint('b', FakeClients(fast), ttfts=[0.5] * 20)
+    router = UpstreamRouter([a, b], hedge_percentile=95, hedge_min_samples=20)
+
+    stream = router.stream(messages=[])
+    assert stream.endpoint is b
+    assert list(stream) == ['fast', 'done']
+    assert router.hedges == 1 and router.hedge_wins == 1
+
+    # 落败的主请求拿到首块后被关闭，名额和统计都归还
+    assert slow.closed.wait(2)
+    wait_idle(a, b)
+    assert a.failures == b.failures == 0
+
+
+def test_hedge_backup_cancelled_when_primary_wins():
+    primary = FakeStream(['primary'], first_delay=0.05)
+    backup = FakeStream(['backup'], first_delay=0.3)
+    a = endpoint('a', FakeClients(primary), ttfts=[0.01] * 20)
+    b = endpoint('b', FakeClients(backup), ttfts=[0.5] * 20)
+    router = UpstreamRouter([a, b], hedge_percentile=95, hedge_min_samples=20)
+
+    stream = router.stream(messages=[])
+    assert stream.endpoint is a
+    assert router.hedges == 1 and router.hedge_wins == 0
+    assert backup.closed.wait(2)
+    assert list(stream) == ['primary']
+    wait_idle(a, b)
+
+
+def test_closing_routed_stream_closes_upstream():
+    upstream = FakeStream(['a', 'b', 'c'])
+    a = endpoint('a', FakeClients(upstream))
+    router = UpstreamRouter([a])
+
+    stream = router.stream(messages=[])
+    iterator = iter(stream)
+    assert next(iterator) == 'a'
+    stream.close()
+    assert upstream.closed.is_set()
+    assert a.active == 0
+
+
+def test_async_create_retries():
+    a = endpoint('a', FakeClients(connection_error()), ttfts=[0.01])
+    b = endpoint('b', FakeClients('ok'), ttfts=[0.5])
+    router = UpstreamRouter([a, b], max_retries=1, backoff=0)
+
+    assert asyncio.run(router.acreate(messages=[])) == 'ok'
+    assert router.retries == 1
+    assert a.active == b.active == 0
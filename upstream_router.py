@@ -0,0 +1,452 @@
+import asyncio
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+import openai
+
+from llm_client import LLMClientManager
+
+logger = logging.getLogger(__name__)
+
+# 可以换个上游重试的错误：连接失败、超时、限流和 5xx；4xx 参数错误重试也没用
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+
+def is_retryable(error: BaseException) -> bool:
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+def parse_endpoints(spec: str, default_base_url: Optional[str],
+                    default_model: str) -> List[Tuple[str, Optional[str], str]]:
+    """解析 UPSTREAM_ENDPOINTS（逗号分隔的 base_url 或 base_url|model），返回 (名称, base_url, model)
+
+    为空时退回单个默认上游。名称取地址的 host:port，重复时加序号。
+    """
+    entries = [entry.strip() for entry in (spec or '').split(',') if entry.strip()]
+    if not entries:
+        return [(urlparse(default_base_url or '').netloc or 'default', default_base_url, default_model)]
+    endpoints = []
+    names = set()
+    for entry in entries:
+        base_url, _, model = entry.partition('|')
+        base_url = base_url.strip()
+        name = urlparse(base_url).netloc or base_url
+        if name in names:
+            name = f"{name}#{len(endpoints) + 1}"
+        names.add(name)
+        endpoints.append((name, base_url, model.strip() or default_model))
+    return endpoints
+
+
+def _percentile(values: Sequence[float], p: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class UpstreamEndpoint:
+    """一个上游地址及其滚动统计（最近 window 次的首块耗时和成败）
+
+    错误率只看最近 error_window 秒，偶尔失败过的上游过后会重新被选中探测。
+    """
+
+    def __init__(self, name: str, clients: LLMClientManager, model: str, window: int = 100,
+                 error_window: float = 60.0):
+        self.name = name
+        self.clients = clients
+        self.model = model
+        self.error_window = error_window
+        self.ttfts = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)  # (时间, 是否失败)
+        self.active = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+
+    @property
+    def error_rate(self) -> float:
+        cutoff = time.monotonic() - self.error_window
+        recent = [failed for at, failed in self.outcomes if at >= cutoff]
+        return sum(recent) / len(recent) if recent else 0.0
+
+    def ttft(self, p: float = 50) -> Optional[float]:
+        return _percentile(self.ttfts, p) if self.ttfts else None
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.down_until
+
+    def score(self) -> float:
+        """越小越好：首块耗时中位数，按进行中的请求数和错误率放大
+
+        没有样本的上游按 0 计，会先被选中，从而得到测量。
+        """
+        ttft = self.ttft() or 0.0
+        return (ttft + 0.05) * (1 + self.active) / max(0.1, 1 - self.error_rate)
+
+
+class UpstreamRouter:
+    """多上游路由：选最快的健康上游，非流式调用失败时退避重试，可选对冲慢请求
+
+    - 每个上游记录最近的首块耗时和错误率，连续失败 failure_threshold 次后
+      摘除 cooldown 秒，到期后放行请求探测，成功即恢复。
+    - 非流式调用是幂等的，可重试错误换一个上游按指数退避（全抖动）重试；
+      流式调用在收到首块之前同样可以重试，之后出错直接抛出。
+    - hedge_percentile > 0 时，首块等待超过该上游首块耗时的此分位数，
+      向另一个上游再发一次，先返回首块的胜出，另一个关闭。
+    """
+
+    def __init__(self, endpoints: List[UpstreamEndpoint], max_retries: int = 2,
+                 backoff: float = 0.5, backoff_max: float = 8.0,
+                 failure_threshold: int = 3, cooldown: float = 30.0,
+                 hedge_percentile: float = 0.0, hedge_min_samples: int = 20,
+                 on_event: Optional[Callable[[str, str], None]] = None):
+        if not endpoints:
+            raise ValueError('至少需要一个上游')
+        self.endpoints = endpoints
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self._on_event = on_event
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    # ---- 选择与统计 ----
+
+    def _event(self, event: str, endpoint: UpstreamEndpoint):
+        if self._on_event is not None:
+            self._on_event(event, endpoint.name)
+
+    def choose(self, exclude: Sequence[UpstreamEndpoint] = ()) -> UpstreamEndpoint:
+        """选得分最低的健康上游；都不可用时选最早恢复的（仍可发出请求）"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e not in exclude] or self.endpoints
+            healthy = [e for e in candidates if e.healthy(now)]
+            if healthy:
+                endpoint = min(healthy, key=UpstreamEndpoint.score)
+            else:
+                endpoint = min(candidates, key=lambda e: e.down_until)
+            endpoint.active += 1
+            endpoint.requests += 1
+        return endpoint
+
+    def _record_ttft(self, endpoint: UpstreamEndpoint, seconds: float):
+        with self._lock:
+            endpoint.ttfts.append(seconds)
+
+    def _finish(self, endpoint: UpstreamEndpoint, error: Optional[BaseException] = None):
+        """请求结束；只有可重试的错误（上游自身的问题）计入失败"""
+        failed = error is not None and is_retryable(error)
+        with self._lock:
+            endpoint.active -= 1
+            endpoint.outcomes.append((time.monotonic(), 1 if failed else 0))
+            if not failed:
+                endpoint.consecutive_failures = 0
+                return
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= self.failure_threshold:
+                endpoint.down_until = time.monotonic() + self.cooldown
+                ejected = True
+            else:
+                ejected = False
+        if ejected:
+            logger.warning(f"上游 {endpoint.name} 连续失败 {endpoint.consecutive_failures} 次，摘除 {self.cooldown:.0f} 秒")
+        self._event('error', endpoint)
+
+    def _retry_delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    def _should_retry(self, error: BaseException, attempt: int, endpoint: UpstreamEndpoint) -> bool:
+        if not is_retryable(error) or attempt >= self.max_retries:
+            return False
+        with self._lock:
+            self.retries += 1
+        self._event('retry', endpoint)
+        logger.warning(f"上游 {endpoint.name} 调用失败，第 {attempt + 1} 次重试: {str(error)}")
+        return True
+
+    def _hedge_delay(self, endpoint: UpstreamEndpoint) -> Optional[float]:
+        if self.hedge_percentile <= 0:
+            return None
+        with self._lock:
+            if len(endpoint.ttfts) < self.hedge_min_samples:
+                return None
+            return endpoint.ttft(self.hedge_percentile)
+
+    # ---- 同步调用 ----
+
+    def complete(self, **params):
+        """非流式调用，可重试错误换上游退避重试"""
+        tried = []
+        attempt = 0
+        while True:
+            endpoint = self.choose(tried)
+            try:
+                response = endpoint.clients.get_client().chat.completions.create(
+                    model=endpoint.model, stream=False, **params
+                )
+            except Exception as e:
+                self._finish(endpoint, e)
+                if not self._should_retry(e, attempt, endpoint):
+                    raise
+                tried.append(endpoint)
+                time.sleep(self._retry_delay(attempt))
+                attempt += 1
+                continue
+            self._finish(endpoint)
+            return response
+
+    def stream(self, **params) -> 'RoutedStream':
+        """流式调用，拿到首块后返回；首块之前失败可以重试"""
+        tried = []
+        attempt = 0
+        while True:
+            endpoint = self.choose(tried)
+            try:
+                return self._first_chunk(endpoint, params, tried)
+            except Exception as e:
+                if not self._should_retry(e, attempt, endpoint):
+                    raise
+                tried.append(endpoint)
+                time.sleep(self._retry_delay(attempt))
+                attempt += 1
+
+    def _first_chunk(self, endpoint: UpstreamEndpoint, params: dict,
+                     tried: List[UpstreamEndpoint]) -> 'RoutedStream':
+        delay = self._hedge_delay(endpoint)
+        if delay is None:
+            attempt = _StreamAttempt(self, endpoint, params)
+            attempt.run()
+            if attempt.error is not None:
+                raise attempt.error
+            return attempt.routed()
+
+        results = queue.Queue()
+        attempts = [_StreamAttempt(self, endpoint, params, results)]
+        attempts[0].start()
+        finished = 0
+        while True:
+            hedging = len(attempts) == 1 and finished == 0
+            try:
+                attempt = results.get(timeout=delay if hedging else None)
+            except queue.Empty:
+                backup = self.choose(tried + [endpoint])
+                with self._lock:
+                    self.hedges += 1
+                self._event('hedge', backup)
+                attempts.append(_StreamAttempt(self, backup, params, results))
+                attempts[1].start()
+                continue
+            finished += 1
+            if attempt.error is None:
+                for other in attempts:
+                    if other is not attempt:
+                        other.cancel()
+                if attempt is not attempts[0]:
+                    with self._lock:
+                        self.hedge_wins += 1
+                    self._event('hedge_won', attempt.endpoint)
+                return attempt.routed()
+            if finished == len(attempts):
+                raise attempt.error
+
+    # ---- 异步调用 ----
+
+    async def acreate(self, stream: bool = False, **params):
+        """异步调用（ASGI 模式），同样选上游和重试；不做对冲"""
+        tried = []
+        attempt = 0
+        while True:
+            endpoint = self.choose(tried)
+            start = time.perf_counter()
+            try:
+                response = await endpoint.clients.get_async_client().chat.completions.create(
+                    model=endpoint.model, stream=stream, **params
+                )
+            except Exception as e:
+                self._finish(endpoint, e)
+                if not self._should_retry(e, attempt, endpoint):
+                    raise
+                tried.append(endpoint)
+                await asyncio.sleep(self._retry_delay(attempt))
+                attempt += 1
+                continue
+            if stream:
+                return AsyncRoutedStream(self, endpoint, response, start)
+            self._finish(endpoint)
+            return response
+
+    # ---- 管理 ----
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        with self._lock:
+            endpoints = [{
+                'name': e.name,
+                'model': e.model,
+                'healthy': e.healthy(now),
+                'active': e.active,
+                'requests': e.requests,
+                'failures': e.failures,
+                'error_rate': round(e.error_rate, 4),
+                'ttft_p50': e.ttft(50),
+                'ttft_p95': e.ttft(95),
+                'samples': len(e.ttfts)
+            } for e in self.endpoints]
+            return {
+                'endpoints': endpoints,
+                'retries': self.retries,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins
+            }
+
+    def close(self):
+        for endpoint in self.endpoints:
+            endpoint.clients.close()
+
+    async def aclose(self):
+        for endpoint in self.endpoints:
+            await endpoint.clients.aclose()
+
+
+class _StreamAttempt:
+    """一次流式请求：建立连接并取到首块。对冲时在后台线程中运行"""
+
+    def __init__(self, router: UpstreamRouter, endpoint: UpstreamEndpoint, params: dict,
+                 results: Optional[queue.Queue] = None):
+        self.router = router
+        self.endpoint = endpoint
+        self.params = params
+        self.results = results
+        self.error: Optional[BaseException] = None
+        self.stream = None
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self.run, name=f'hedge-{self.endpoint.name}', daemon=True).start()
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            stream = self.endpoint.clients.get_client().chat.completions.create(
+                model=self.endpoint.model, stream=True, **self.params
+            )
+            iterator = iter(stream)
+            first = next(iterator, None)
+        except Exception as e:
+            self.router._finish(self.endpoint, e)
+            self.error = e
+            if self.results is not None:
+                self.results.put(self)
+            return
+        self.router._record_ttft(self.endpoint, time.perf_counter() - start)
+        with self._lock:
+            self.stream, self.iterator, self.first = stream, iterator, first
+            cancelled = self._cancelled
+        if cancelled:
+            self._close()
+        elif self.results is not None:
+            self.results.put(self)
+
+    def cancel(self):
+        """对冲落败：已拿到流的直接关闭，否则由 run() 拿到后关闭"""
+        with self._lock:
+            self._cancelled = True
+            opened = self.stream is not None
+        if opened:
+            self._close()
+
+    def _close(self):
+        try:
+            self.stream.close()
+        finally:
+            self.router._finish(self.endpoint)
+
+    def routed(self) -> 'RoutedStream':
+        return RoutedStream(self.router, self.endpoint, self.stream, self.iterator, self.first)
+
+
+class RoutedStream:
+    """选中上游的流：先给出已取到的首块，读完、出错或关闭时记录结果"""
+
+    def __init__(self, router: UpstreamRouter, endpoint: UpstreamEndpoint, stream, iterator, first):
+        self.endpoint = endpoint
+        self._router = router
+        self._stream = stream
+        self._iterator = iterator
+        self._first = first
+        self._finished = False
+
+    def _finish(self, error: Optional[BaseException] = None):
+        if not self._finished:
+            self._finished = True
+            self._router._finish(self.endpoint, error)
+
+    def __iter__(self):
+        try:
+            if self._first is not None:
+                yield self._first
+                for chunk in self._iterator:
+                    yield chunk
+        except Exception as e:
+            self._finish(e)
+            raise
+        finally:
+            self._finish()
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._finish()
+
+
+class AsyncRoutedStream:
+    """RoutedStream 的异步版本，首块到达时记录首块耗时"""
+
+    def __init__(self, router: UpstreamRouter, endpoint: UpstreamEndpoint, stream, start: float):
+        self.endpoint = endpoint
+        self._router = router
+        self._stream = stream
+        self._start = start
+        self._finished = False
+
+    def _finish(self, error: Optional[BaseException] = None):
+        if not self._finished:
+            self._finished = True
+            self._router._finish(self.endpoint, error)
+
+    async def __aiter__(self):
+        first = True
+        try:
+            async for chunk in self._stream:
+                if first:
+                    first = False
+                    self._router._record_ttft(self.endpoint, time.perf_counter() - self._start)
+                yield chunk
+        except Exception as e:
+            self._finish(e)
+            raise
+        finally:
+            self._finish()
+
+    async def close(self):
+        try:
+            await self._stream.close()
+        finally:
+            self._finish()